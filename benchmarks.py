@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+"""
+=======================
+bootstrapper benchmarks
+=======================
+
+Measure bootstrapper's own overhead without touching network. Fake
+``virtualenv``, ``pip`` and ``which`` executables put on ``PATH`` instead of
+real ones, each of them sleeps ``FAKE_SLEEP`` seconds and records its
+invocation. ``HOME`` points to temporary directory as well, so caches of
+bootstrapper are not touched.
+
+Run with::
+
+    $ python benchmarks.py
+
+Store results as baseline and compare next runs with it::
+
+    $ python benchmarks.py --save baseline.json
+    $ python benchmarks.py --compare baseline.json
+
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+import bootstrapper
+
+
+DIRNAME = os.path.abspath(os.path.dirname(__file__))
+FAKE_EXECUTABLE = """#!/bin/sh
+sleep {sleep}
+echo "$(basename "$0") $@" >> "{log}"
+"""
+FAKE_SLEEP = 0.01
+FAKE_VIRTUALENV = FAKE_EXECUTABLE + """for env; do :; done
+mkdir -p "$env/bin"
+cp "{pip}" "$env/bin/pip"
+"""
+NOISE_FLOOR = 0.001
+PHASE_RUNS = 20
+REGRESSION_THRESHOLD = 1.5
+SCALING_SIZES = (1, 10, 100)
+STARTUP_BUDGET = 0.1
+STARTUP_RUNS = 10
+
+
+@contextmanager
+def count_spawns():
+    """Count all child processes spawned via ``subprocess`` module."""
+    counter = []
+    original = subprocess.Popen
+
+    class CountingPopen(original):
+
+        def __init__(self, *args, **kwargs):
+            counter.append(args[0] if args else kwargs.get('args'))
+            super(CountingPopen, self).__init__(*args, **kwargs)
+
+    subprocess.Popen = CountingPopen
+    try:
+        yield counter
+    finally:
+        subprocess.Popen = original
+
+
+@contextmanager
+def fake_project():
+    """Create temporary project with fake executables on ``PATH``.
+
+    Invocations of fake executables are recorded to ``invocations.log`` file
+    in project directory.
+    """
+    dirname = tempfile.mkdtemp(prefix='bootstrapper-bench')
+    original_cwd = os.getcwd()
+    original_environ = dict(os.environ)
+
+    bin_dirname = os.path.join(dirname, 'bin')
+    os.makedirs(bin_dirname)
+
+    log = os.path.join(dirname, 'invocations.log')
+    pip = os.path.join(bin_dirname, 'pip')
+    context = {'log': log, 'pip': pip, 'sleep': FAKE_SLEEP}
+
+    write_script(pip, FAKE_EXECUTABLE.format(**context))
+    write_script(os.path.join(bin_dirname, 'which'),
+                 FAKE_EXECUTABLE.format(**context))
+    write_script(os.path.join(bin_dirname, 'virtualenv'),
+                 FAKE_VIRTUALENV.format(**context))
+
+    with open(os.path.join(dirname, 'requirements.txt'), 'w') as handler:
+        handler.write('ordereddict==1.1\n')
+
+    os.chdir(dirname)
+    os.environ['HOME'] = dirname
+    os.environ['PATH'] = os.pathsep.join((bin_dirname,
+                                          original_environ.get('PATH', '')))
+    bootstrapper.LISTDIR_CACHE.clear()
+
+    try:
+        yield dirname
+    finally:
+        os.chdir(original_cwd)
+        os.environ.clear()
+        os.environ.update(original_environ)
+        bootstrapper.LISTDIR_CACHE.clear()
+        shutil.rmtree(dirname)
+
+
+@contextmanager
+def redirect_streams():
+    """Redirect STDOUT and STDERR to temporary files."""
+    original_out, original_err = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = bootstrapper.get_temp_streams()
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stderr.close()
+        sys.stdout, sys.stderr = original_out, original_err
+
+
+def bench_backends():
+    """Measure time to create virtual environment with each backend.
+
+    Real ``virtualenv`` script used, so backend skipped if it is not
+    installed. As results depend on installed tools, they are not stored in
+    baseline.
+    """
+    results = []
+    dirname = tempfile.mkdtemp(prefix='bootstrapper-bench')
+    original_home = os.environ.get('HOME')
+    os.environ['HOME'] = dirname
+
+    try:
+        for backend in bootstrapper.BACKENDS:
+            if backend == 'virtualenv' and not bootstrapper.which(backend):
+                print('create_env(), {0} backend: skipped, not installed'.
+                      format(backend))
+                continue
+
+            env = os.path.join(dirname, backend)
+            with redirect_streams(), count_spawns() as counter:
+                start = time.time()
+                bootstrapper.create_env(env, (), quiet=True, backend=backend)
+                elapsed = time.time() - start
+            results.append((backend, len(counter), elapsed))
+
+            print('create_env(), {0} backend: {1} processes spawned, '
+                  '{2:.2f}ms'.format(backend, len(counter), elapsed * 1000))
+    finally:
+        os.environ['HOME'] = original_home
+        shutil.rmtree(dirname)
+
+    return results
+
+
+def bench_phases():
+    """Measure bootstrapper's own overhead per phase.
+
+    Phases are reading config, preparing arguments, planning install, spawning
+    child process (without time fake executable sleeps) and printing output.
+    """
+    results = {}
+
+    with fake_project():
+        args = bootstrapper.parse_args([])
+        config = bootstrapper.read_config(args.config, args)
+        bootstrap = config[bootstrapper.__script__]
+
+        def install_plan():
+            """Read requirements and calculate install digest."""
+            _, filenames, install_args = bootstrapper.get_install_args(
+                bootstrap['requirements']
+            )
+            bootstrapper.get_install_digest(
+                '', bootstrapper.walk_requirements(filenames), install_args
+            )
+
+        def output():
+            """Print one message."""
+            bootstrapper.print_message('== Step 2. Install project ==')
+
+        def spawn():
+            """Run fake pip."""
+            bootstrapper.run_cmd(('pip', '--version'))
+
+        with redirect_streams():
+            results['phase.config'] = best_of(
+                lambda: bootstrapper.read_config(args.config, args)
+            )
+            results['phase.args'] = best_of(
+                lambda: (bootstrapper.prepare_args(config['pip'], bootstrap),
+                         bootstrapper.prepare_args(config['virtualenv'],
+                                                   bootstrap))
+            )
+            results['phase.install_plan'] = best_of(install_plan)
+            results['phase.spawn'] = max(best_of(spawn, 5) - FAKE_SLEEP, 0)
+            results['phase.output'] = best_of(output)
+
+    for key, value in sorted(results.items()):
+        print('{0}: {1:.3f}ms'.format(key, value * 1000))
+
+    return results
+
+
+def bench_scaling():
+    """Measure how overhead scales with size of input.
+
+    Inputs are number of pre-requirements, number of pip config keys and
+    number of requirements lines, each of ``SCALING_SIZES``.
+    """
+    results = {}
+
+    with fake_project() as dirname:
+        for size in SCALING_SIZES:
+            names = ['fake-{0}'.format(index) for index in range(size)]
+            for name in names:
+                write_script(os.path.join(dirname, 'bin', name),
+                             FAKE_EXECUTABLE.format(log=os.devnull, pip='',
+                                                    sleep=0))
+            results['scaling.pre_requirements.{0}'.format(size)] = best_of(
+                lambda: bootstrapper.check_pre_requirements(names)
+            )
+
+            with open('bootstrap.cfg', 'w') as handler:
+                handler.write('[pip]\n')
+                handler.write(''.join('option-{0} = {0}\n'.format(index)
+                                      for index in range(size)))
+
+            args = bootstrapper.parse_args([])
+
+            def config_keys():
+                """Read config and prepare pip arguments."""
+                config = bootstrapper.read_config(args.config, args)
+                bootstrapper.prepare_args(config['pip'],
+                                          config[bootstrapper.__script__])
+
+            results['scaling.config_keys.{0}'.format(size)] = best_of(
+                config_keys
+            )
+
+            with open('requirements.txt', 'w') as handler:
+                handler.write(''.join('package-{0}==1.{0}\n'.format(index)
+                                      for index in range(size)))
+
+            def requirements():
+                """Parse requirements and calculate install digest."""
+                bootstrapper.REQUIREMENTS_CACHE.clear()
+                bootstrapper.get_install_digest(
+                    '',
+                    bootstrapper.walk_requirements(['requirements.txt']),
+                    ()
+                )
+                bootstrapper.get_pinned_requirements(['requirements.txt'])
+
+            results['scaling.requirements.{0}'.format(size)] = best_of(
+                requirements
+            )
+
+    for key, value in sorted(results.items()):
+        print('{0}: {1:.3f}ms'.format(key, value * 1000))
+
+    return results
+
+
+def bench_spawns():
+    """Count processes spawned and time spent per ``main()`` run.
+
+    First run creates virtual environment and calls pip, second run should be
+    skipped by stamp file. Overhead is time of ``main()`` run without time
+    spent in child processes.
+    """
+    results = {}
+
+    with fake_project() as dirname:
+        for label in ('first', 'second'):
+            with redirect_streams(), count_spawns() as counter:
+                start = time.time()
+                bootstrapper.main('-e', 'env', '--ignore-activated')
+                elapsed = time.time() - start
+
+            children = sum(event['dur'] / 1e6
+                           for event in bootstrapper.TRACE_EVENTS
+                           if event['cat'] == 'cmd')
+            results['main.{0}'.format(label)] = elapsed - children
+
+            print('main(), {0} run: {1} processes spawned, {2:.2f}ms, '
+                  'overhead: {3:.2f}ms'.format(label, len(counter),
+                                               elapsed * 1000,
+                                               (elapsed - children) * 1000))
+
+        with open(os.path.join(dirname, 'invocations.log')) as handler:
+            print('Fake executables invoked: {0}'.format(
+                ', '.join(line.split()[0] for line in handler)
+            ))
+
+    return results
+
+
+def bench_startup():
+    """Measure ``bootstrapper --version`` startup overhead.
+
+    Overhead is the difference between best of runs of ``bootstrapper
+    --version`` and best of runs of empty interpreter, it should be less than
+    ``STARTUP_BUDGET`` seconds.
+    """
+    script = os.path.join(DIRNAME, 'bootstrapper.py')
+
+    def run(cmd):
+        """Run command hiding its output."""
+        return lambda: subprocess.call(cmd, stdout=subprocess.PIPE)
+
+    interpreter = best_of(run((sys.executable, '-c', 'pass')), STARTUP_RUNS)
+    version = best_of(run((sys.executable, script, '--version')),
+                      STARTUP_RUNS)
+    overhead = version - interpreter
+
+    print('bootstrapper --version: {0:.2f}ms, interpreter startup: {1:.2f}ms, '
+          'overhead: {2:.2f}ms (budget: {3:.2f}ms)'.
+          format(version * 1000, interpreter * 1000, overhead * 1000,
+                 STARTUP_BUDGET * 1000))
+
+    return {'startup': overhead}
+
+
+def best_of(func, runs=PHASE_RUNS):
+    """Return best time of given number of function runs."""
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def compare(results, filename):
+    """Compare results with baseline stored in file.
+
+    Result is regression if it is ``REGRESSION_THRESHOLD`` times slower than
+    baseline and difference exceeds ``NOISE_FLOOR`` seconds.
+
+    :return: List of regressed benchmarks.
+    """
+    with open(filename) as handler:
+        baseline = json.load(handler)
+
+    rows, regressions = [], []
+    for key in sorted(set(baseline) & set(results)):
+        before, after = baseline[key], results[key]
+        regressed = (after > before * REGRESSION_THRESHOLD and
+                     after - before > NOISE_FLOOR)
+        if regressed:
+            regressions.append(key)
+        rows.append((key, '{0:.3f}ms'.format(before * 1000),
+                     '{0:.3f}ms'.format(after * 1000),
+                     '{0:.2f}x'.format(after / before if before else 1),
+                     'REGRESSION' if regressed else ''))
+
+    print()
+    bootstrapper.print_table(('Benchmark', 'Baseline', 'Current', 'Ratio',
+                              ''), rows)
+    return regressions
+
+
+def main(*args):
+    """Run all benchmarks."""
+    parser = ArgumentParser(description='Run bootstrapper benchmarks.')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Store results as baseline to this file.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare results with baseline from this file.')
+    args = parser.parse_args(args or sys.argv[1:])
+
+    if bootstrapper.IS_WINDOWS:
+        print('Benchmarks use shell scripts as fake executables, so they are '
+              'not supported on Windows', file=sys.stderr)
+        return 1
+
+    results = {}
+    for bench in (bench_spawns, bench_phases, bench_scaling, bench_startup):
+        results.update(bench())
+    bench_backends()
+
+    if args.save:
+        bootstrapper.write_json(args.save, results)
+
+    failed = False
+    if results['startup'] > STARTUP_BUDGET:
+        print('Startup overhead exceeds budget', file=sys.stderr)
+        failed = True
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        if regressions:
+            print('Regressed: {0}'.format(', '.join(regressions)),
+                  file=sys.stderr)
+            failed = True
+
+    return int(failed)
+
+
+def write_script(filename, content):
+    """Write executable script to given filename."""
+    with open(filename, 'w') as handler:
+        handler.write(content)
+    os.chmod(filename, 0o755)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,14 +9,24 @@ Bootstrap Python projects or libraries with ease.
 
 from __future__ import print_function
 
+import codecs
 import copy
+import errno
+import glob
+import hashlib
+import json
 import operator
 import os
 import platform
+import re
+import shutil
+import signal
 import subprocess
 import sys
+import sysconfig
 import tempfile
-import traceback
+import threading
+import time
 
 try:
     from configparser import Error as ConfigParserError, ConfigParser
@@ -26,18 +36,21 @@ except ImportError:
         SafeConfigParser as ConfigParser,
     )
 
-from collections import defaultdict
-from contextlib import contextmanager
-from distutils.util import strtobool
-from functools import wraps
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
 
-import pip
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import product
+from string import Formatter
 
 try:
-    from pip.log import _color_wrap
-    from pip._vendor import colorama
+    import fcntl
 except ImportError:
-    colorama = None
+    fcntl = None
 
 
 __author__ = 'Igor Davydenko'
@@ -47,17 +60,144 @@ __version__ = '1.1.0'
 
 
 BOOTSTRAPPER_TEST_KEY = 'BOOTSTRAPPER_TEST'
+BACKENDS = ('virtualenv', 'venv')
+COMMANDS = ('bootstrap', 'lock', 'snapshot')
 CONFIG = {
     __script__: {
+        'backend': 'virtualenv',
         'env': 'env',
+        'golden_envs': False,
+        'incremental': False,
+        'pip_retries': 2,
+        'pip_retry_backoff': 1,
+        'precompile': False,
         'requirements': 'requirements.txt',
         'quiet': False,
+        'wheel_cache_max_size': '1G',
     },
+    'hooks': {},
     'pip': {},
     'virtualenv': {},
 }
+CONFIG_ARGS = ('backend', 'command', 'env', 'force_hooks', 'force_install',
+               'golden_envs', 'hook', 'hook_jobs', 'incremental',
+               'install_dev_requirements', 'ignore_activated', 'jobs',
+               'no_hooks', 'pre_requirements', 'precompile', 'pythons',
+               'quiet', 'recreate', 'requirements', 'snapshots')
+CONFIG_CACHE = {}
+CONFIG_CACHE_FILENAME = 'config.json'
+CONFIG_CACHE_SIZE = 64
+DAEMON = {}
+DAEMON_SOCKET_FILENAME = 'daemon.sock'
+DAEMON_SOCKET_KEY = 'BOOTSTRAPPER_SOCKET'
 DEFAULT_CONFIG = 'bootstrap.cfg'
+ENVIRON_VAR_RE = re.compile(r'\$\{(?P<name>[A-Z0-9_]+)\}')
 ERROR_HANDLER_DISABLED = False
+FICLONE = 0x40049409
+HOOK_OPTIONS = ('after', 'inputs', 'outputs')
+HOOKS_LOCK = threading.Lock()
+HOOKS_STAMP_FILENAME = '.{0}.hooks'.format(__script__)
+LIBRARY_FILES = ('setup.py', 'setup.cfg', 'pyproject.toml')
+LISTDIR_CACHE = {}
+LOCK_DIGEST_PREFIX = '# digest: '
+OUTPUT_LOCK = threading.Lock()
+OUTPUT_TAIL_SIZE = 64 * 1024
+PIP_SCRIPT = """#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+
+from {module} import {func}
+
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit({func}())
+"""
+PINNED_REQUIREMENT_RE = re.compile(
+    r'^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*===?\s*'
+    r'(?P<version>[^\s;,*]+)(\s*;.*)?$'
+)
+PIP_CMD_KWARGS = {}
+PIP_METADATA_RE = re.compile(
+    r'^pip-(?P<version>\d[^-]*)(-py[\d.]+)?\.(dist|egg)-info$'
+)
+PIP_TRANSIENT_ERROR_RE = re.compile(
+    r'(ConnectionError|ConnectTimeout|ReadTimeout|Read timed out|'
+    r'Connection (reset|refused|aborted)|Max retries exceeded|'
+    r'Temporary failure in name resolution|IncompleteRead|ProtocolError|'
+    r'HTTP error 5\d\d|Service Unavailable|Bad Gateway)',
+    re.I
+)
+PRECOMPILE_SCRIPT = """import compileall
+import sys
+import sysconfig
+
+kwargs = {'quiet': 1}
+if sys.version_info >= (3, 5):
+    kwargs['workers'] = int(sys.argv[1])
+# Timestamp-based pycs written by pip are up to date, so force rewriting them
+if sys.version_info >= (3, 7):
+    from py_compile import PycInvalidationMode
+    kwargs['force'] = True
+    kwargs['invalidation_mode'] = PycInvalidationMode.CHECKED_HASH
+
+paths = sorted(set(sysconfig.get_paths()[key]
+                   for key in ('purelib', 'platlib')))
+sys.exit(not all([compileall.compile_dir(path, **kwargs) for path in paths]))
+"""
+PROCESSES = set()
+PROCESSES_LOCK = threading.Lock()
+PYTHON_EXECUTABLE_RE = re.compile(r'^(python|pypy)[\d.]*[dmtw]*(\.exe)?$')
+PYTHON_VERSION_CACHE_FILENAME = 'pythons.json'
+REQUIREMENT_OPTION_RE = re.compile(
+    r'^(?P<option>--[\w-]+|-\w)\s*=?\s*(?P<value>.*)$'
+)
+REQUIREMENTS_CACHE = {}
+SDIST_FILENAME_RE = re.compile(
+    r'^(?P<name>.+?)-\d[^-]*\.(tar\.gz|tar\.bz2|tar\.xz|tgz|zip)$'
+)
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+              'T': 1024 ** 4}
+SNAPSHOT_PATH_KEY = '{0}.path'.format(__script__)
+STAMP_FILENAME = '.{0}.stamp'.format(__script__)
+SUPPORTED_TAGS_SCRIPT = """try:
+    from packaging.tags import sys_tags
+except ImportError:
+    try:
+        from pip._vendor.packaging.tags import sys_tags
+    except ImportError:
+        from pip._internal.pep425tags import get_supported
+
+        def sys_tags():
+            return ('-'.join(tag) for tag in get_supported())
+
+print('\\n'.join(str(tag) for tag in sys_tags()))
+"""
+TRACE_EVENTS = []
+WHEEL_OPTIONS = {
+    '--cache-dir': True,
+    '--cert': True,
+    '--client-cert': True,
+    '--disable-pip-version-check': False,
+    '--extra-index-url': True,
+    '--find-links': True,
+    '--index-url': True,
+    '--isolated': False,
+    '--no-binary': True,
+    '--no-cache-dir': False,
+    '--only-binary': True,
+    '--pre': False,
+    '--prefer-binary': False,
+    '--proxy': True,
+    '--quiet': False,
+    '--retries': True,
+    '--timeout': True,
+    '--trusted-host': True,
+    '--verbose': False,
+}
+WHEELHOUSE_DIRNAME = 'wheelhouse'
+WHEELHOUSE_INDEX_FILENAME = 'wheelhouse.json'
+WHICH_CACHE_FILENAME = 'which.json'
 
 IS_PY3 = sys.version_info[0] == 3
 IS_WINDOWS = platform.system() == 'Windows'
@@ -65,15 +205,46 @@ IS_WINDOWS = platform.system() == 'Windows'
 string_types = (str, ) if IS_PY3 else (basestring, )  # noqa
 
 
-def check_pre_requirements(pre_requirements):
+def cache_wheels(wheelhouse, store):
+    """Atomically copy wheels from wheelhouse to wheel cache.
+
+    Each wheel copied to temporary file in cache directory first and then
+    renamed, so concurrent bootstrapper processes could share the cache.
+    Access time of copied wheel set same way as in :func:`~find_cached_wheel`,
+    as coarse filesystem timestamp could be older than one set there.
+
+    :param wheelhouse: Directory with prefetched wheels.
+    :param store: Wheel cache directory for interpreter of virtual env.
+    """
+    if not os.path.isdir(wheelhouse):
+        return
+
+    if not os.path.isdir(store):
+        os.makedirs(store)
+
+    for name in os.listdir(wheelhouse):
+        filename = os.path.join(store, name)
+        if not name.endswith('.whl') or os.path.exists(filename):
+            continue
+
+        temp = os.path.join(store, '.{0}.{1}.tmp'.format(name, os.getpid()))
+        shutil.copyfile(os.path.join(wheelhouse, name), temp)
+        os.utime(temp, (time.time(), os.stat(temp).st_mtime))
+        os.rename(temp, filename)
+
+
+def check_pre_requirements(pre_requirements, backend='virtualenv'):
     """Check all necessary system requirements to exist.
 
     :param pre_requirements:
-        Sequence of pre-requirements to check by running
-        ``where <pre_requirement>`` on Windows and ``which ...`` elsewhere.
+        Sequence of pre-requirements to check by looking them up in ``PATH``.
+    :param backend:
+        Backend used to create virtual environment. ``virtualenv`` script is
+        required only for ``virtualenv`` backend. By default: virtualenv
     """
     pre_requirements = set(pre_requirements or [])
-    pre_requirements.add('virtualenv')
+    if backend == 'virtualenv':
+        pre_requirements.add('virtualenv')
 
     for requirement in pre_requirements:
         if not which(requirement):
@@ -84,6 +255,85 @@ def check_pre_requirements(pre_requirements):
     return True
 
 
+def clone_env(source, destination, path=None):
+    """Clone virtual environment.
+
+    Files are reflinked (copy-on-write) where filesystem supports it,
+    otherwise hardlinked, otherwise copied. Scripts in ``bin``/``Scripts``
+    directory and ``pyvenv.cfg`` are copied with absolute path of source
+    environment replaced by destination one. Symlinks pointing inside of
+    source environment are retargeted. Hooks stamp (so hooks are run in
+    cloned environment) and prefetched wheels are skipped. ``__pycache__``
+    directories are skipped as well, unless bytecode is precompiled after
+    last install (see :func:`~precompile_env`).
+
+    :param source: Path to virtual environment to clone.
+    :param destination: Path to new virtual environment.
+    :param path:
+        Path to use in scripts and symlinks, when destination is temporary
+        directory to be renamed after cloning. By default: destination
+    """
+    old_path = os.path.abspath(source)
+    new_path = os.path.abspath(path or destination)
+    root = os.path.abspath(destination)
+    scripts = os.path.join(old_path, 'Scripts' if IS_WINDOWS else 'bin')
+    state = {'reflink': fcntl is not None}
+    skip = () if is_precompiled(old_path) else ('__pycache__', )
+
+    def copy_file(source_file, destination_file):
+        """Reflink, hardlink or copy single file."""
+        if state['reflink']:
+            try:
+                with open(source_file, 'rb') as src:
+                    with open(destination_file, 'wb') as dst:
+                        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                shutil.copystat(source_file, destination_file)
+                return
+            except (IOError, OSError):
+                state['reflink'] = False
+                os.unlink(destination_file)
+        try:
+            os.link(source_file, destination_file)
+        except (AttributeError, OSError):
+            shutil.copy2(source_file, destination_file)
+
+    for dirname, dirnames, filenames in os.walk(old_path):
+        target_dirname = os.path.join(root, os.path.relpath(dirname, old_path))
+        if not os.path.isdir(target_dirname):
+            os.makedirs(target_dirname)
+
+        for name in list(dirnames) + filenames:
+            source_file = os.path.join(dirname, name)
+            destination_file = os.path.join(target_dirname, name)
+
+            if os.path.islink(source_file):
+                link = os.readlink(source_file)
+                if os.path.isabs(link) and link.startswith(old_path):
+                    link = new_path + link[len(old_path):]
+                os.symlink(link, destination_file)
+            elif name in dirnames or name in skip or (
+                dirname == old_path and name == HOOKS_STAMP_FILENAME
+            ):
+                continue
+            elif dirname == scripts or source_file == os.path.join(
+                old_path, 'pyvenv.cfg'
+            ):
+                with open(source_file, 'rb') as handler:
+                    content = handler.read()
+                with open(destination_file, 'wb') as handler:
+                    handler.write(content.replace(old_path.encode('utf-8'),
+                                                  new_path.encode('utf-8')))
+                shutil.copystat(source_file, destination_file)
+            else:
+                copy_file(source_file, destination_file)
+
+        dirnames[:] = [name for name in dirnames
+                       if name not in skip and
+                       not os.path.islink(os.path.join(dirname, name)) and
+                       not (dirname == old_path and
+                            name == WHEELHOUSE_DIRNAME)]
+
+
 def config_to_args(config):
     """Convert config dict to arguments list.
 
@@ -108,7 +358,9 @@ def config_to_args(config):
     return tuple(result)
 
 
-def create_env(env, args, recreate=False, ignore_activated=False, quiet=False):
+def create_env(env, args, recreate=False, ignore_activated=False, quiet=False,
+               backend='virtualenv', golden=None, timeout=None,
+               snapshot=None):
     """Create virtual environment.
 
     :param env: Virtual environment name.
@@ -118,6 +370,19 @@ def create_env(env, args, recreate=False, ignore_activated=False, quiet=False):
         Ignore already activated virtual environment and create new one. By
         default: False
     :param quiet: Do not output messages into terminal. By default: False
+    :param backend:
+        Create virtual environment with ``virtualenv`` script or with stdlib
+        ``venv`` module. By default: virtualenv
+    :param golden:
+        Path to golden virtual environment. If it exists, new virtual
+        environment cloned from it instead of creating. By default: None
+    :param timeout:
+        Kill ``virtualenv`` (or ``venv`` subprocess) if it does not finish in
+        given number of seconds. By default: None
+    :param snapshot:
+        Path to snapshot archive of virtual environment. If it exists and no
+        golden environment exists, new virtual environment restored from it
+        instead of creating. By default: None
     """
     cmd = None
     result = True
@@ -142,9 +407,26 @@ def create_env(env, args, recreate=False, ignore_activated=False, quiet=False):
             message = 'Virtual environment {0!r} already created, done...'
         print_message(message.format(env))
 
-    if cmd:
+    # Restore virtual environment from snapshot, unless golden one exists
+    if (
+        cmd and snapshot and not env_exists and os.path.isfile(snapshot) and
+        not (golden and os.path.isdir(golden))
+    ):
+        if not quiet:
+            print_message('Restoring snapshot {0!r}...'.format(snapshot))
+        if restore_env(snapshot, env):
+            cmd = None
+
+    if cmd and golden and not env_exists and os.path.isdir(golden):
+        if not quiet:
+            print_message('Cloning golden environment {0!r}...'.
+                          format(golden))
+        clone_env(golden, env)
+    elif cmd and backend == 'venv':
+        result = create_venv(env, args, quiet, timeout)
+    elif cmd:
         with disable_error_handler():
-            result = not run_cmd(cmd, echo=not quiet)
+            result = not run_cmd(cmd, echo=not quiet, timeout=timeout)
 
     if not quiet:
         print_message()
@@ -152,6 +434,67 @@ def create_env(env, args, recreate=False, ignore_activated=False, quiet=False):
     return result
 
 
+def create_venv(env, args, quiet=False, timeout=None):
+    """Create virtual environment with stdlib ``venv`` module.
+
+    Virtual environment created in-process with symlinks and without pip,
+    then pip seeded from wheel bundled with ``ensurepip``. Only
+    ``--python``, ``--system-site-packages`` and ``--clear`` virtualenv
+    arguments are supported. If other interpreter given, its ``venv`` module
+    called in subprocess instead.
+
+    :param env: Virtual environment name.
+    :param args: Virtualenv arguments.
+    :param quiet: Do not output messages into terminal. By default: False
+    :param timeout:
+        Kill ``venv`` subprocess if it does not finish in given number of
+        seconds. By default: None
+    """
+    options = {'python': None, 'system_site_packages': False, 'clear': False}
+    args = list(args)
+
+    while args:
+        arg = args.pop(0)
+        if arg in ('-p', '--python') and args:
+            options['python'] = args.pop(0)
+        elif arg in ('--system-site-packages', '--clear'):
+            options[arg[2:].replace('-', '_')] = True
+
+    if options['python']:
+        cmd = (options['python'], '-m', 'venv')
+        if not IS_WINDOWS:
+            cmd += ('--symlinks', )
+        if options['system_site_packages']:
+            cmd += ('--system-site-packages', )
+        if options['clear']:
+            cmd += ('--clear', )
+
+        with disable_error_handler():
+            return not run_cmd(cmd + (env, ),
+                               echo=not quiet,
+                               timeout=timeout)
+
+    try:
+        import venv
+    except ImportError:
+        print_error('Python {0}.{1} has no venv module, use virtualenv '
+                    'backend instead'.format(*sys.version_info[:2]))
+        return False
+
+    if not quiet:
+        print_message('$ {0} -m venv {1}'.format(sys.executable, env))
+
+    # Windows scripts need launchers, so let ensurepip install pip there
+    builder = venv.EnvBuilder(
+        system_site_packages=options['system_site_packages'],
+        clear=options['clear'],
+        symlinks=not IS_WINDOWS,
+        with_pip=IS_WINDOWS
+    )
+    builder.create(env)
+    return IS_WINDOWS or seed_pip(env)
+
+
 @contextmanager
 def disable_error_handler():
     """Context manager to temporary disable error handling."""
@@ -183,223 +526,376 @@ def error_handler(func):
     return wrapper
 
 
-def get_temp_streams():
-    """Return two temporary file handlers for STDOUT and STDERR."""
-    kwargs = {'encoding': 'utf-8'} if IS_PY3 else {}
-    return (tempfile.TemporaryFile('w+', **kwargs),
-            tempfile.TemporaryFile('w+', **kwargs))
-
+def evaluate_marker(marker, environment=None):
+    """Evaluate environment marker of requirement.
 
-def install(env, requirements, args, ignore_activated=False,
-            install_dev_requirements=False, quiet=False):
-    """Install library or project into virtual environment.
+    ``packaging`` library used for evaluating, it is not required to be
+    installed.
 
-    :param env: Use given virtual environment name.
-    :param requirements: Use given requirements file for pip.
-    :param args: Pass given arguments to pip script.
-    :param ignore_activated:
-        Do not run pip inside already activated virtual environment. By
-        default: False
-    :param install_dev_requirements:
-        When enabled install prefixed or suffixed dev requirements after
-        original installation process completed. By default: False
-    :param quiet: Do not output message to terminal. By default: False
+    :param marker: Environment marker.
+    :param environment:
+        Marker environment to override values of current interpreter. By
+        default: None
+    :return:
+        ``True`` or ``False``, or ``None`` if marker cannot be evaluated.
     """
-    if os.path.isfile(requirements):
-        args += ('-r', requirements)
-        label = 'project'
-    else:
-        args += ('-U', '-e', '.')
-        label = 'library'
+    try:
+        from packaging.markers import InvalidMarker, Marker
+    except ImportError:
+        return None
 
-    # Attempt to install development requirements
-    if install_dev_requirements:
-        dev_requirements = None
-        dirname = os.path.dirname(requirements)
-        basename, ext = os.path.splitext(os.path.basename(requirements))
-
-        # Possible dev requirements files:
-        #
-        # * <requirements>-dev.<ext>
-        # * dev-<requirements>.<ext>
-        # * <requirements>_dev.<ext>
-        # * dev_<requirements>.<ext>
-        # * <requirements>dev.<ext>
-        # * dev<requirements>.<ext>
-        #
-        # Where <requirements> is basename of given requirements file to use
-        # and <ext> is its extension.
-        for delimiter in ('-', '_', ''):
-            filename = os.path.join(
-                dirname, ''.join((basename, delimiter, 'dev', ext))
-            )
-            if os.path.isfile(filename):
-                dev_requirements = filename
-                break
+    try:
+        return Marker(marker).evaluate(environment)
+    except InvalidMarker:
+        return None
 
-            filename = os.path.join(
-                dirname, ''.join(('dev', delimiter, basename, ext))
-            )
-            if os.path.isfile(filename):
-                dev_requirements = filename
-                break
 
-        # If at least one dev requirements file found, install dev requirements
-        if dev_requirements:
-            args += ('-r', dev_requirements)
+def evict_wheels(wheel_cache, max_size):
+    """Evict least recently used wheels until cache fits its disk budget.
 
-    if not quiet:
-        print_message('== Step 2. Install {0} =='.format(label))
+    :param wheel_cache: Path to wheel cache.
+    :param max_size: Disk budget in bytes.
+    """
+    if not max_size or not os.path.isdir(wheel_cache):
+        return
+
+    wheels = []
+    for dirname, _, names in os.walk(wheel_cache):
+        for name in names:
+            if not name.endswith('.whl'):
+                continue
+            filename = os.path.join(dirname, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            wheels.append((stat.st_atime, stat.st_size, filename))
+
+    total = sum(item[1] for item in wheels)
+    for _, size, filename in sorted(wheels):
+        if total <= max_size:
+            break
+        try:
+            os.unlink(filename)
+        except OSError:
+            continue
+        total -= size
 
-    result = not pip_cmd(env,
-                         ('install', ) + args,
-                         ignore_activated,
-                         echo=not quiet)
 
-    if not quiet:
-        print_message()
+def exclude_args(argv, options):
+    """Remove given options with their values from command line arguments.
+
+    Long options may be abbreviated or given as ``--option=value``, short
+    options may be given with attached value, like ``-j8``.
+
+    :param argv: Command line arguments.
+    :param options: Dict of options to remove, where value is flag whether
+        option takes multiple values or single one.
+    :return: List of remaining arguments.
+    """
+    def match(name):
+        """Return option given argument name stands for, if any."""
+        if name.startswith('--'):
+            return next((option for option in options
+                         if len(name) > 2 and option.startswith(name)), None)
+        return next((option for option in options
+                     if not option.startswith('--') and
+                     name.startswith(option)), None)
+
+    result = []
+    args = list(argv)
+
+    while args:
+        arg = args.pop(0)
+        name = arg.split('=', 1)[0]
+        option = match(name) if arg.startswith('-') else None
+        if option is None:
+            result.append(arg)
+            continue
+        if '=' in arg or len(name) > len(option) and (
+            not option.startswith('--')
+        ):
+            continue
+        if options[option]:
+            while args and not args[0].startswith('-'):
+                args.pop(0)
+        elif args:
+            args.pop(0)
 
     return result
 
 
-def iteritems(data, **kwargs):
-    """Iterate over dict items."""
-    return iter(data.items(**kwargs)) if IS_PY3 else data.iteritems(**kwargs)
+def filter_args(args, options):
+    """Filter pip arguments, keep only given options with their values.
 
+    :param args: Pip arguments tuple.
+    :param options: Dict of options to keep, where value is flag whether
+        option has value or not.
+    """
+    result = []
+    args = list(args)
 
-def iterkeys(data, **kwargs):
-    """Iterate over dict keys."""
-    return iter(data.keys(**kwargs)) if IS_PY3 else data.iterkeys(**kwargs)
+    while args:
+        arg = args.pop(0)
+        if arg not in options:
+            continue
+        result.append(arg)
+        if options[arg] and args:
+            result.append(args.pop(0))
 
+    return tuple(result)
 
-@error_handler
-def main(*args):
-    r"""Bootstrap Python projects and libraries with virtualenv and pip.
 
-    Also check system requirements before bootstrap and run post bootstrap
-    hook if any.
+def find_cached_wheel(store, requirement, tags=None):
+    """Find wheel for pinned requirement in wheel cache.
 
-    :param \*args: Command line arguments list.
+    Only wheels with tags supported by interpreter of virtual environment are
+    matched. Access time of found wheel updated, as it used for LRU eviction
+    and could be not updated by filesystem itself.
+
+    :param store: Wheel cache directory for interpreter of virtual env.
+    :param requirement: Requirement specifier.
+    :param tags:
+        Wheel tags supported by interpreter of virtual environment, see
+        :func:`~get_supported_tags`. If not given, only pure Python wheels
+        (``none-any``) are matched. By default: None
+    :return: Path to wheel or ``None`` if requirement is not pinned or wheel
+        is not cached.
     """
-    # Create parser, read arguments from direct input or command line
-    with disable_error_handler():
-        args = parse_args(args or sys.argv[1:])
+    matched = PINNED_REQUIREMENT_RE.match(requirement)
+    if not matched or not os.path.isdir(store):
+        return None
 
-    # Read current config from file and command line arguments
-    config = read_config(args.config, args)
-    if config is None:
-        return True
-    bootstrap = config[__script__]
+    prefix = '{0}-{1}-'.format(
+        re.sub(r'[-_.]+', '_', matched.group('name')).lower(),
+        matched.group('version').lower()
+    )
 
-    # Check pre-requirements
-    if not check_pre_requirements(bootstrap['pre_requirements']):
-        return True
+    for name in os.listdir(store):
+        if not name.lower().startswith(prefix) or not name.endswith('.whl'):
+            continue
 
-    # Create virtual environment
-    env_args = prepare_args(config['virtualenv'], bootstrap)
-    if not create_env(
-        bootstrap['env'],
-        env_args,
-        bootstrap['recreate'],
-        bootstrap['ignore_activated'],
-        bootstrap['quiet']
-    ):
-        # Exit if couldn't create virtual environment
-        return True
+        # Tags may be compressed, like ``py2.py3-none-any``
+        parts = [item.split('.') for item in name[:-4].split('-')[-3:]]
+        if len(parts) == 3 and any(
+            '-'.join(tag) in tags if tags else tag[1:] == ('none', 'any')
+            for tag in product(*parts)
+        ):
+            filename = os.path.join(store, name)
+            os.utime(filename, (time.time(), os.stat(filename).st_mtime))
+            return filename
 
-    # And install library or project here
-    pip_args = prepare_args(config['pip'], bootstrap)
-    if not install(
-        bootstrap['env'],
-        bootstrap['requirements'],
-        pip_args,
-        bootstrap['ignore_activated'],
-        bootstrap['install_dev_requirements'],
-        bootstrap['quiet']
-    ):
-        # Exist if couldn't install requirements into venv
-        return True
+    return None
 
-    # Run post-bootstrap hook
-    run_hook(bootstrap['hook'], bootstrap, bootstrap['quiet'])
 
-    # All OK!
-    if not bootstrap['quiet']:
-        print_message('All OK!')
+def find_cycle(dependencies):
+    """Find cycle in dependencies graph.
 
-    # False means everything went alright, exit code: 0
-    return False
+    :param dependencies: Dict where key is name and value is names it depends
+        on.
+    :return: List of names in cycle, starting and ending with same name, or
+        ``None`` if there is no cycle.
+    """
+    state = {}
+
+    def visit(name, path):
+        """Depth-first search, return cycle found from given name if any."""
+        state[name] = 'visiting'
+        path.append(name)
+        for dependency in sorted(dependencies.get(name) or ()):
+            if state.get(dependency) == 'visiting':
+                return path[path.index(dependency):] + [dependency]
+            if dependency not in state:
+                cycle = visit(dependency, path)
+                if cycle:
+                    return cycle
+        path.pop()
+        state[name] = 'visited'
+        return None
 
+    for name in sorted(dependencies):
+        if name not in state:
+            cycle = visit(name, [])
+            if cycle:
+                return cycle
+    return None
 
-def parse_args(args):
+
+def flush_streams():
+    """Flush STDOUT and STDERR before passing them to child process."""
+    for stream in (sys.stdout, sys.stderr):
+        stream.flush()
+
+
+def get_cache_key(*parts):
+    r"""Return key for config cache from given JSON serializable parts.
+
+    :param \*parts: Values affecting cached value.
     """
-    Parse args from command line by creating argument parser instance and
-    process it.
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).\
+        hexdigest()
 
-    :param args: Command line arguments list.
+
+def get_cached_value(key):
+    """Return value from config cache stored in ``~/.bootstrapper``.
+
+    Config cache read from disk only once per process.
+
+    :param key: Cache key, see :func:`~get_cache_key`.
+    :return:
+        Copy of cached value or ``None`` if key is not cached or any of
+        environment variables value depends on changed.
     """
-    from argparse import ArgumentParser
+    if 'entries' not in CONFIG_CACHE:
+        CONFIG_CACHE['entries'] = read_json(
+            os.path.join(get_data_dirname(), CONFIG_CACHE_FILENAME)
+        )
+
+    entry = CONFIG_CACHE['entries'].get(key)
+    if not isinstance(entry, dict) or any(
+        os.environ.get(name) != value
+        for name, value in iteritems(entry.get('environ') or {})
+    ):
+        return None
 
-    description = ('Bootstrap Python projects and libraries with virtualenv '
-                   'and pip.')
-    parser = ArgumentParser(description=description)
-    parser.add_argument('--version', action='version', version=__version__)
+    return copy.deepcopy(entry.get('value'))
 
-    parser.add_argument(
-        '-c', '--config', default=DEFAULT_CONFIG,
-        help='Path to config file. By default: {0}'.format(DEFAULT_CONFIG)
-    )
-    parser.add_argument(
-        '-p', '--pre-requirements', default=[], nargs='+',
-        help='List of pre-requirements to check, separated by space.'
-    )
-    parser.add_argument(
-        '-e', '--env',
-        help='Virtual environment name. By default: {0}'.
-             format(CONFIG[__script__]['env'])
-    )
-    parser.add_argument(
-        '-r', '--requirements',
-        help='Path to requirements file. By default: {0}'.
-             format(CONFIG[__script__]['requirements'])
-    )
-    parser.add_argument(
-        '-d', '--install-dev-requirements', action='store_true', default=None,
-        help='Install prefixed or suffixed "dev" requirements after '
-             'installation of original requirements file or library completed '
-             'without errors.'
-    )
-    parser.add_argument(
-        '-C', '--hook', help='Execute this hook after bootstrap process.'
-    )
-    parser.add_argument(
-        '--ignore-activated', action='store_true', default=None,
-        help='Ignore pre-activated virtualenv, like on Travis CI.'
-    )
-    parser.add_argument(
-        '--recreate', action='store_true', default=None,
-        help='Recreate virtualenv on every run.'
-    )
-    parser.add_argument(
-        '-q', '--quiet', action='store_true', default=None,
-        help='Minimize output, show only error messages.'
+
+def get_config_cache_key(filename, args):
+    """Return cache key for config merged from file and arguments.
+
+    Key depends on path, modification time and size of config file, values
+    of command line arguments, home directory, interpreter and modification
+    time of bootstrapper itself.
+
+    :param filename: Path to config file.
+    :param args: Parsed command line arguments.
+    """
+    try:
+        stat = os.stat(filename)
+        stamp = [stat.st_mtime, stat.st_size]
+    except OSError:
+        stamp = None
+
+    return get_cache_key(
+        'config', os.path.abspath(filename), stamp,
+        [(key, getattr(args, key)) for key in CONFIG_ARGS],
+        os.path.expanduser('~'), sys.executable,
+        os.path.getmtime(os.path.abspath(__file__))
     )
 
-    return parser.parse_args(args)
 
+def get_daemon_socket():
+    """Return path to Unix socket of bootstrapper daemon.
 
-def pip_cmd(env, cmd, ignore_activated=False, **kwargs):
-    r"""Run pip command in given or activated virtual environment.
+    Path is read from ``BOOTSTRAPPER_SOCKET`` environment variable. By
+    default: ``~/.bootstrapper/daemon.sock``
+    """
+    filename = os.environ.get(DAEMON_SOCKET_KEY)
+    if filename:
+        return os.path.expanduser(filename)
+    return os.path.join(get_data_dirname(), DAEMON_SOCKET_FILENAME)
+
+
+def get_data_dirname():
+    """Return path to ``~/.bootstrapper`` directory, create it if necessary."""
+    dirname = safe_path(os.path.expanduser(
+        os.path.join('~', '.{0}'.format(__script__))
+    ))
+
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    return dirname
+
+
+def get_dev_requirements(requirements):
+    """Find dev requirements file for given requirements file if any.
+
+    Possible dev requirements files:
+
+    * ``<requirements>-dev.<ext>``
+    * ``dev-<requirements>.<ext>``
+    * ``<requirements>_dev.<ext>``
+    * ``dev_<requirements>.<ext>``
+    * ``<requirements>dev.<ext>``
+    * ``dev<requirements>.<ext>``
+
+    Where ``<requirements>`` is basename of given requirements file to use and
+    ``<ext>`` is its extension.
+
+    :param requirements: Path to original requirements file.
+    """
+    dirname = os.path.dirname(requirements)
+    basename, ext = os.path.splitext(os.path.basename(requirements))
+
+    try:
+        names = listdir(dirname or os.curdir,
+                        os.stat(dirname or os.curdir).st_mtime)
+    except OSError:
+        return None
+
+    for delimiter in ('-', '_', ''):
+        for name in (''.join((basename, delimiter, 'dev', ext)),
+                     ''.join(('dev', delimiter, basename, ext))):
+            if (name.lower() if IS_WINDOWS else name) in names:
+                filename = os.path.join(dirname, name)
+                if os.path.isfile(filename):
+                    return filename
+
+    return None
+
+
+def get_env_digest(env_args, pip_args, requirements,
+                   install_dev_requirements=False, backend='virtualenv'):
+    """Calculate digest of everything affecting installed virtual environment.
+
+    Digest contains interpreter (with its real version, see
+    :func:`~get_python_version`), virtualenv and pip arguments, and content
+    of requirements files with all files included into them.
+
+    :param env_args: Virtualenv arguments.
+    :param pip_args: Pip arguments.
+    :param requirements: Path to requirements file.
+    :param install_dev_requirements: Install dev requirements as well?
+    :param backend: Backend to create virtual environment with.
+    :return:
+        Tuple of interpreter executable and digest, or ``None`` if virtual
+        environment cannot be reused, as project is library or has editable
+        requirements.
+    """
+    env_args = tuple(env_args)
+    python = sys.executable
+    for option in ('-p', '--python'):
+        if option in env_args[:-1]:
+            python = env_args[env_args.index(option) + 1]
+
+    label, filenames, args = get_install_args(requirements,
+                                              install_dev_requirements,
+                                              python=python)
+    if label != 'project':
+        return None
+
+    filenames = walk_requirements(filenames)
+    if any(parse_requirements(filename)['editables']
+           for filename in filenames):
+        return None
+
+    interpreter = ' '.join((backend, python,
+                            get_python_version(python) or ''))
+    digest = get_install_digest(interpreter, filenames,
+                                env_args + ('--', ) + pip_args + args)
+    return python, digest
+
+
+def get_env_dirname(env, ignore_activated=False):
+    """Return path to virtual environment where pip would be run.
 
     :param env: Virtual environment name.
-    :param cmd: Pip subcommand to run.
     :param ignore_activated:
         Ignore activated virtual environment and use given venv instead. By
         default: False
-    :param \*\*kwargs:
-        Additional keyword arguments to be passed to :func:`~run_cmd`
     """
-    cmd = tuple(cmd)
     dirname = safe_path(env)
 
     if not ignore_activated:
@@ -410,51 +906,1768 @@ def pip_cmd(env, cmd, ignore_activated=False, **kwargs):
         elif activated_env:
             dirname = activated_env
 
-    pip_path = os.path.join(dirname, 'Scripts' if IS_WINDOWS else 'bin', 'pip')
+    return dirname
 
-    if kwargs.pop('return_path', False):
-        return pip_path
 
-    if not os.path.isfile(pip_path):
-        raise OSError('No pip found at {0!r}'.format(pip_path))
+def get_env_python(dirname):
+    """Return path to interpreter of virtual environment.
 
-    # Disable pip version check in tests
-    if BOOTSTRAPPER_TEST_KEY in os.environ and cmd[0] == 'install':
-        cmd = list(cmd)
-        cmd.insert(1, '--disable-pip-version-check')
-        cmd = tuple(cmd)
+    Current interpreter returned if virtual environment has no interpreter.
 
-    with disable_error_handler():
-        return run_cmd((pip_path, ) + cmd, **kwargs)
+    :param dirname: Path to virtual environment.
+    """
+    python = os.path.join(dirname, 'Scripts' if IS_WINDOWS else 'bin',
+                          'python.exe' if IS_WINDOWS else 'python')
+    return python if os.path.isfile(python) else sys.executable
+
+
+def get_golden_env(env_args, pip_args, requirements,
+                   install_dev_requirements=False, backend='virtualenv'):
+    """Return path to golden virtual environment for given project.
+
+    Golden environments are stored in ``~/.bootstrapper/envs`` directory and
+    keyed by digest of virtual environment, see :func:`~get_env_digest`.
+
+    :param env_args: Virtualenv arguments.
+    :param pip_args: Pip arguments.
+    :param requirements: Path to requirements file.
+    :param install_dev_requirements: Install dev requirements as well?
+    :param backend: Backend to create virtual environment with.
+    :return:
+        Path to golden environment or ``None`` if project cannot be cloned,
+        as it is library or has editable requirements.
+    """
+    data = get_env_digest(env_args, pip_args, requirements,
+                          install_dev_requirements, backend)
+    if data is None:
+        return None
+    return os.path.join(get_data_dirname(), 'envs', data[1][:32])
 
 
-def prepare_args(config, bootstrap):
-    """Convert config dict to command line args line.
+def get_hook_digest(cmd, env_digest, filenames, previous, files):
+    """Calculate digest of hook command, installed env and input files.
 
-    :param config: Configuration dict.
-    :param bootstrap: Bootstrapper configuration dict.
+    Content of input file hashed only when its mtime or size changed since
+    previous run.
+
+    :param cmd: Rendered hook command.
+    :param env_digest: Digest of last install into virtual environment.
+    :param filenames: Sorted input filenames.
+    :param previous: Dict of input file hashes from previous run.
+    :param files: Dict to store input file hashes for next run in.
     """
-    config = copy.deepcopy(config)
-    environ = dict(copy.deepcopy(os.environ))
+    hasher = hashlib.sha256()
+    hasher.update(smart_str(cmd).encode('utf-8') + b'\0')
+    hasher.update(env_digest.encode('utf-8'))
 
-    data = {'env': bootstrap['env'],
-            'pip': pip_cmd(bootstrap['env'], '', return_path=True),
-            'requirements': bootstrap['requirements']}
-    environ.update(data)
+    for filename in filenames:
+        stat = os.stat(filename)
+        key = [stat.st_mtime, stat.st_size]
+        cached = previous.get(filename)
 
-    if isinstance(config, string_types):
-        return config.format(**environ)
+        if not cached or cached[:2] != key:
+            with open(filename, 'rb') as handler:
+                cached = key + [hashlib.sha256(handler.read()).hexdigest()]
 
-    for key, value in iteritems(config):
-        if not isinstance(value, string_types):
-            continue
-        config[key] = value.format(**environ)
+        files[filename] = cached
+        hasher.update(b'\0' + filename.encode('utf-8') + b'\0')
+        hasher.update(cached[2].encode('utf-8'))
 
-    return config_to_args(config)
+    return hasher.hexdigest()
 
 
-def print_error(message, wrap=True):
-    """Print error message to stderr, using ANSI-colors.
+def get_install_args(requirements, install_dev_requirements=False,
+                     use_lock=True, python=None):
+    """Return label, requirements files and pip arguments to install with.
+
+    When lock file for project requirements exists and is up to date, it is
+    used with dependencies resolution disabled and hash checking enabled.
+
+    :param requirements: Path to requirements file.
+    :param install_dev_requirements:
+        Also install prefixed or suffixed dev requirements. By default: False
+    :param use_lock:
+        Install from lock file if it is up to date. By default: True
+    :param python:
+        Interpreter executable name or path of virtual environment, see
+        :func:`~get_lock_digest`. By default: current interpreter
+    :return:
+        Tuple of ``project`` or ``library`` label, list of files affecting
+        install (requirements or library setup files) and pip arguments.
+    """
+    if os.path.isfile(requirements):
+        args = ('-r', requirements)
+        filenames = [requirements]
+        label = 'project'
+    else:
+        args = ('-U', '-e', '.')
+        filenames = [item for item in LIBRARY_FILES if os.path.isfile(item)]
+        label = 'library'
+
+    # Attempt to install development requirements
+    if install_dev_requirements:
+        dev_requirements = get_dev_requirements(requirements)
+
+        # If at least one dev requirements file found, install dev requirements
+        if dev_requirements:
+            args += ('-r', dev_requirements)
+            filenames.append(dev_requirements)
+
+    # Install exact pins from lock file without resolving dependencies
+    lock = get_lock_filename(requirements)
+    if (use_lock and label == 'project' and
+            read_lock_digest(lock) == get_lock_digest(filenames, python)):
+        args = ('--no-deps', '--require-hashes', '-r', lock)
+        filenames = [lock]
+
+    return (label, filenames, args)
+
+
+def get_install_digest(interpreter, filenames, args):
+    """Calculate digest of everything affecting install step.
+
+    Digest contains interpreter version of virtual environment, content of all
+    given files and pip arguments.
+
+    :param interpreter: Interpreter version of virtual environment.
+    :param filenames: Requirements (or library setup) files to hash.
+    :param args: Pip arguments to be passed to ``pip install`` command.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(interpreter.encode('utf-8'))
+
+    for filename in filenames:
+        hasher.update(b'\0' + filename.encode('utf-8') + b'\0')
+        with open(filename, 'rb') as handler:
+            hasher.update(handler.read())
+
+    hasher.update(b'\0'.join(smart_str(arg).encode('utf-8') for arg in args))
+    return hasher.hexdigest()
+
+
+def get_installed_distributions(dirname):
+    """Read distributions installed into virtual environment.
+
+    Names and versions are read from names of ``*.dist-info`` and
+    ``*.egg-info`` directories in ``site-packages``, its content memoized
+    until directory mtime changes.
+
+    :param dirname: Path to virtual environment.
+    :return: Dict where key is normalized name and value is version.
+    """
+    result = {}
+    patterns = (os.path.join(dirname, 'lib', 'python*', 'site-packages'),
+                os.path.join(dirname, 'Lib', 'site-packages'))
+
+    for pattern in patterns:
+        for site_packages in glob.glob(pattern):
+            mtime = os.stat(site_packages).st_mtime
+            for name in listdir(site_packages, mtime):
+                base, ext = os.path.splitext(name)
+                if ext not in ('.dist-info', '.egg-info'):
+                    continue
+                parts = base.split('-')
+                if len(parts) > 1:
+                    result[normalize_name(parts[0])] = parts[1].lower()
+
+    return result
+
+
+def get_interpreter_tag(dirname):
+    """Return interpreter tag (like ``cp36``) of virtual environment.
+
+    Tag derived from interpreter binary of virtual environment, see
+    :func:`~get_env_python` and :func:`~get_python_tag`.
+
+    :param dirname: Path to virtual environment.
+    :return: Tag or ``None`` if interpreter cannot be called.
+    """
+    return get_python_tag(get_env_python(dirname))
+
+
+def get_interpreter_version(dirname):
+    """Return version of interpreter used in virtual environment.
+
+    Version read from ``pyvenv.cfg`` file if it exists in virtual environment,
+    otherwise version of current interpreter used.
+
+    :param dirname: Path to virtual environment.
+    """
+    data = read_pyvenv_cfg(dirname)
+    version = data.get('version_info') or data.get('version')
+    if not version:
+        return ' '.join((platform.python_implementation(), sys.version))
+
+    return ' '.join((data.get('implementation', ''), version)).strip()
+
+
+def get_lock_digest(filenames, python=None):
+    """Calculate digest of requirements files to lock.
+
+    Digest contains tag of interpreter (see :func:`~get_python_tag`) and
+    platform, as resolved distributions and their hashes depend on them, and
+    content of all files in include graph of requirements files, but not
+    their paths, so it does not depend on current directory.
+
+    :param filenames: Requirements files.
+    :param python:
+        Interpreter executable name or path requirements locked for. By
+        default: current interpreter
+    """
+    hasher = hashlib.sha256()
+    hasher.update('{0} {1}\0'.format(
+        get_python_tag(python or sys.executable), sysconfig.get_platform()
+    ).encode('utf-8'))
+
+    for filename in walk_requirements(filenames):
+        with open(filename, 'rb') as handler:
+            hasher.update(handler.read() + b'\0')
+
+    return hasher.hexdigest()
+
+
+def get_lock_filename(requirements):
+    """Return path to lock file for given requirements file.
+
+    :param requirements: Path to requirements file.
+    """
+    return '{0}.lock'.format(os.path.splitext(requirements)[0])
+
+
+def get_locked_requirements(report, markers=None):
+    """Convert pip installation report into lock file lines.
+
+    :param report: Data of ``pip install --report`` JSON file.
+    :param markers:
+        Dict of environment markers of requirements by their normalized
+        names, kept in pinned requirements. By default: None
+    :return: List of pinned requirements with hashes.
+    :raise ValueError: If any requirement could not be pinned by hash.
+    """
+    markers = markers or {}
+    result = []
+
+    items = sorted(report.get('install') or [],
+                   key=lambda item: normalize_name(item['metadata']['name']))
+
+    for item in items:
+        metadata = item['metadata']
+        archive = (item.get('download_info') or {}).get('archive_info')
+
+        hashes = (archive or {}).get('hashes') or {}
+        if not hashes and (archive or {}).get('hash'):
+            hashes = dict([archive['hash'].split('=', 1)])
+        if not hashes:
+            raise ValueError('Cannot pin {0!r} by hash, only requirements '
+                             'from archives could be locked'.
+                             format(metadata['name']))
+
+        algorithm = 'sha256' if 'sha256' in hashes else sorted(hashes)[0]
+        marker = markers.get(normalize_name(metadata['name']))
+        result.append('{0}=={1}{2} \\\n    --hash={3}:{4}'.format(
+            metadata['name'], metadata['version'],
+            ' ; {0}'.format(marker) if marker else '', algorithm,
+            hashes[algorithm]
+        ))
+
+    return result
+
+
+def get_log_filename():
+    """Return path to bootstrapper log file in ``~/.bootstrapper``."""
+    return os.path.join(get_data_dirname(), '{0}.log'.format(__script__))
+
+
+def get_marker_environment(dirname):
+    """Return environment marker values for interpreter of virtual env.
+
+    Values are read from ``pyvenv.cfg`` file, ``None`` returned when virtual
+    environment has no such file, so values of current interpreter are used.
+
+    :param dirname: Path to virtual environment.
+    """
+    data = read_pyvenv_cfg(dirname)
+    version = data.get('version_info') or data.get('version')
+    if not version:
+        return None
+
+    version = '.'.join(version.split('.')[:3])
+    environment = {'python_full_version': version,
+                   'python_version': '.'.join(version.split('.')[:2])}
+    if data.get('implementation'):
+        environment['platform_python_implementation'] = data['implementation']
+        environment['implementation_name'] = data['implementation'].lower()
+    return environment
+
+
+def get_pinned_requirements(filenames, environment=None):
+    """Read pinned requirements from requirements files.
+
+    :param filenames: Requirements files.
+    :param environment:
+        Marker environment of virtual environment, see
+        :func:`~get_marker_environment`. By default: None
+    :return:
+        Dict where key is normalized name and value is tuple of pinned version
+        and requirement specifier, or ``None`` if any requirement is not
+        pinned or editable requirements are included.
+    """
+    if any(parse_requirements(filename)['editables']
+           for filename in walk_requirements(filenames, constraints=False)):
+        return None
+
+    result = {}
+
+    for requirement in read_requirements(filenames, environment):
+        matched = PINNED_REQUIREMENT_RE.match(requirement)
+        if not matched:
+            return None
+        result[normalize_name(matched.group('name'))] = (
+            matched.group('version'), requirement
+        )
+
+    return result
+
+
+def get_pip_version():
+    """Return version of pip available for current interpreter.
+
+    Version read from pip metadata directory name in ``sys.path`` to avoid
+    importing pip itself, which is slow.
+    """
+    for dirname in sys.path:
+        try:
+            names = os.listdir(dirname or os.curdir)
+        except OSError:
+            continue
+
+        for name in names:
+            matched = PIP_METADATA_RE.match(name)
+            if matched:
+                return matched.group('version')
+
+    return None
+
+
+def get_projects(patterns, config):
+    """Find project directories with config file by given patterns.
+
+    Each pattern is directory or glob pattern, like ``services/*``.
+
+    :param patterns: Sequence of directories or glob patterns.
+    :param config: Config filename to look for in each directory.
+    :return: Sorted list of unique project directories.
+    """
+    projects = set()
+    for pattern in patterns:
+        matches = glob.glob(os.path.expanduser(pattern)) or [pattern]
+        for dirname in matches:
+            if os.path.isfile(os.path.join(dirname, config)):
+                projects.add(os.path.normpath(dirname))
+    return sorted(projects)
+
+
+def get_python_executable(python):
+    """Convert interpreter version like ``3.6`` to executable name.
+
+    :param python: Interpreter version or executable name.
+    """
+    if re.match(r'^\d+(\.\d+)*$', python):
+        return 'python{0}'.format(python)
+    return python
+
+
+def get_python_tag(python):
+    """Return interpreter tag (like ``cp36``) of given interpreter.
+
+    :param python: Interpreter executable name or path.
+    :return:
+        Tag or ``None`` if interpreter cannot be found or called, see
+        :func:`~get_python_version`.
+    """
+    matched = re.match(r'^(\S+) (\d+)\.(\d+)',
+                       get_python_version(python) or '')
+    if not matched:
+        return None
+
+    prefix = {'CPython': 'cp', 'PyPy': 'pp'}.get(matched.group(1), 'py')
+    return prefix + matched.group(2) + matched.group(3)
+
+
+def get_python_version(python):
+    """Return implementation and full version of given interpreter.
+
+    Interpreter is called once, result cached in
+    ``~/.bootstrapper/pythons.json`` keyed by real path of interpreter and
+    its modification time and size.
+
+    :param python: Interpreter executable name or path.
+    :return:
+        Version string like ``CPython 3.6.5 (default, ...)``, or ``None`` if
+        interpreter cannot be found or called.
+    """
+    if python == sys.executable:
+        return ' '.join((platform.python_implementation(), sys.version))
+
+    path = which(python)
+    if not path:
+        return None
+
+    path = os.path.realpath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    filename = os.path.join(get_data_dirname(), PYTHON_VERSION_CACHE_FILENAME)
+    cache = read_json(filename)
+    key = [stat.st_mtime, stat.st_size]
+    cached = cache.get(path) or {}
+    if cached.get('key') == key:
+        return cached['version']
+
+    try:
+        version = subprocess.check_output((
+            path, '-c',
+            'import platform, sys; '
+            'print(platform.python_implementation() + " " + sys.version)'
+        )).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    cache[path] = {'key': key, 'version': version}
+    try:
+        write_json(filename, cache)
+    except (IOError, OSError):
+        pass
+
+    return version
+
+
+def get_snapshot_filename(snapshots, env_args, pip_args, requirements,
+                          install_dev_requirements=False,
+                          backend='virtualenv'):
+    """Return path to snapshot archive of virtual environment for project.
+
+    Snapshot named by interpreter and digest of virtual environment, see
+    :func:`~get_env_digest`.
+
+    :param snapshots: Directory with snapshots.
+    :param env_args: Virtualenv arguments.
+    :param pip_args: Pip arguments.
+    :param requirements: Path to requirements file.
+    :param install_dev_requirements: Install dev requirements as well?
+    :param backend: Backend to create virtual environment with.
+    :return:
+        Path to snapshot or ``None`` if project cannot be snapshotted, as it
+        is library or has editable requirements.
+    """
+    data = get_env_digest(env_args, pip_args, requirements,
+                          install_dev_requirements, backend)
+    if data is None:
+        return None
+    python, digest = data
+    return os.path.join(snapshots, '{0}-{1}.tar.gz'.format(
+        os.path.basename(python), digest[:32]
+    ))
+
+
+def get_steps(config, argv):
+    """Return bootstrap steps with their dependencies for :func:`~run_steps`.
+
+    Steps are:
+
+    * ``pre_requirements``: check pre-requirements
+    * ``prepare``: prepare virtualenv and pip arguments, find golden env and
+      snapshot
+    * ``env``: create virtual environment, after ``pre_requirements`` and
+      ``prepare``
+    * ``requirements``: parse requirements files and check lock file, while
+      virtual environment is created
+    * ``install``: install library or project, after ``env`` and
+      ``requirements``
+    * ``precompile``: compile bytecode of installed requirements, after
+      ``install``, when enabled
+    * ``golden``: publish golden environment, after ``install`` (and
+      ``precompile``)
+    * ``hook``: run post-bootstrap hook, after ``golden``, so it does not
+      change environment being published
+    * ``hooks``: run named post-bootstrap hooks, after ``golden``
+
+    For interpreter matrix, ``matrix`` step replaces ``prepare``, ``env``,
+    ``requirements``, ``install``, ``precompile`` and ``golden`` ones. For
+    ``lock`` command, ``lock`` step replaces ``requirements``, ``install``,
+    ``precompile``, ``golden``, ``hook`` and ``hooks`` ones and only first
+    interpreter is used. For ``snapshot``
+    command, only ``prepare`` and ``snapshot`` steps are run. Hook steps are
+    skipped when hooks disabled.
+
+    :param config: Configuration dict.
+    :param argv: Original command line arguments.
+    """
+    bootstrap = config[__script__]
+    state = {'golden': None, 'snapshot': None}
+
+    def check():
+        """Check pre-requirements."""
+        return check_pre_requirements(bootstrap['pre_requirements'],
+                                      bootstrap['backend'])
+
+    def hook():
+        """Run post-bootstrap hook, its result does not affect bootstrap."""
+        run_hook(bootstrap['hook'], bootstrap, bootstrap['quiet'])
+        return True
+
+    def hooks():
+        """Run named post-bootstrap hooks, they do not affect bootstrap."""
+        run_hooks(config['hooks'], bootstrap, bootstrap['hook_jobs'],
+                  bootstrap['quiet'])
+        return True
+
+    hook_steps = (
+        () if bootstrap['no_hooks'] else
+        (('hook', hook, ('golden', )), ('hooks', hooks, ('golden', )))
+    )
+
+    # Bootstrap virtual environment for each interpreter in subprocesses
+    pythons = bootstrap['pythons'] or []
+    command = bootstrap.get('command') or COMMANDS[0]
+    if len(pythons) > 1 and command == COMMANDS[0]:
+        return (
+            ('pre_requirements', check, ()),
+            ('matrix', lambda: run_matrix(argv, bootstrap),
+             ('pre_requirements', )),
+        ) + tuple((name, func, ('matrix', )) for name, func, _ in hook_steps)
+    elif pythons:
+        config['virtualenv']['python'] = get_python_executable(pythons[0])
+
+    def prepare():
+        """Prepare arguments, find golden environment and snapshot."""
+        state['env_args'] = prepare_args(config['virtualenv'], bootstrap)
+        state['pip_args'] = prepare_args(config['pip'], bootstrap)
+
+        env_dirname = get_env_dirname(bootstrap['env'],
+                                      bootstrap['ignore_activated'])
+        if bootstrap['golden_envs'] and env_dirname == bootstrap['env']:
+            state['golden'] = get_golden_env(
+                state['env_args'],
+                state['pip_args'],
+                bootstrap['requirements'],
+                bootstrap['install_dev_requirements'],
+                bootstrap['backend']
+            )
+        if bootstrap.get('snapshots') and env_dirname == bootstrap['env']:
+            state['snapshot'] = get_snapshot_filename(
+                bootstrap['snapshots'],
+                state['env_args'],
+                state['pip_args'],
+                bootstrap['requirements'],
+                bootstrap['install_dev_requirements'],
+                bootstrap['backend']
+            )
+        return True
+
+    def env():
+        """Create virtual environment."""
+        return create_env(
+            bootstrap['env'],
+            state['env_args'],
+            bootstrap['recreate'],
+            bootstrap['ignore_activated'],
+            bootstrap['quiet'],
+            bootstrap['backend'],
+            state['golden'],
+            bootstrap.get('env_timeout'),
+            state['snapshot']
+        )
+
+    def requirements():
+        """Parse requirements and check lock file to install from."""
+        state['install_args'] = get_install_args(
+            bootstrap['requirements'], bootstrap['install_dev_requirements'],
+            python=config['virtualenv'].get('python')
+        )
+        label, filenames, _ = state['install_args']
+        return label != 'project' or all(
+            parse_requirements(filename)
+            for filename in walk_requirements(filenames)
+        )
+
+    def install_():
+        """Install library or project into virtual environment."""
+        return install(
+            bootstrap['env'],
+            bootstrap['requirements'],
+            state['pip_args'],
+            bootstrap['ignore_activated'],
+            bootstrap['install_dev_requirements'],
+            bootstrap['quiet'],
+            bootstrap['force_install'],
+            bootstrap['jobs'],
+            bootstrap['wheel_cache'],
+            bootstrap['wheel_cache_max_size'],
+            bootstrap['incremental'],
+            bootstrap.get('wheelhouse'),
+            state['install_args']
+        )
+
+    def precompile():
+        """Compile bytecode, its result does not affect bootstrap."""
+        precompile_env(bootstrap['env'], bootstrap['ignore_activated'],
+                       bootstrap['jobs'], bootstrap['force_install'],
+                       bootstrap['quiet'])
+        return True
+
+    def golden():
+        """Store installed environment to clone it on next bootstraps."""
+        if state['golden']:
+            publish_golden_env(bootstrap['env'], state['golden'])
+        return True
+
+    def lock():
+        """Resolve requirements and write lock file."""
+        return lock_requirements(
+            bootstrap['env'],
+            bootstrap['requirements'],
+            state['pip_args'],
+            bootstrap['ignore_activated'],
+            bootstrap['install_dev_requirements'],
+            bootstrap['quiet']
+        )
+
+    def snapshot():
+        """Pack virtual environment into snapshot archive."""
+        if not state['snapshot']:
+            print_error('Snapshots directory is not set or project cannot be '
+                        'snapshotted')
+            return False
+        return snapshot_env(bootstrap['env'], state['snapshot'],
+                            bootstrap['quiet'])
+
+    if command == 'snapshot':
+        return (
+            ('prepare', prepare, ()),
+            ('snapshot', snapshot, ('prepare', )),
+        )
+
+    if command == 'lock':
+        return (
+            ('pre_requirements', check, ()),
+            ('prepare', prepare, ()),
+            ('env', env, ('pre_requirements', 'prepare')),
+            ('lock', lock, ('env', )),
+        )
+
+    install_steps = (('install', install_, ('env', 'requirements')), ) + (
+        (('precompile', precompile, ('install', )),
+         ('golden', golden, ('precompile', )))
+        if bootstrap['precompile'] else
+        (('golden', golden, ('install', )), )
+    )
+
+    return (
+        ('pre_requirements', check, ()),
+        ('prepare', prepare, ()),
+        ('env', env, ('pre_requirements', 'prepare')),
+        ('requirements', requirements, ()),
+    ) + install_steps + hook_steps
+
+
+def get_supported_tags(python):
+    """Return wheel tags supported by given interpreter.
+
+    Tags read by ``packaging`` library of interpreter, its copy vendored into
+    pip or by ``pep425tags`` module of pip older than 19.3.
+
+    :param python: Interpreter executable name or path.
+    :return:
+        Set of tags like ``cp36-cp36m-manylinux1_x86_64`` or ``None`` if they
+        cannot be read.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(
+                (python, '-c', SUPPORTED_TAGS_SCRIPT), stderr=devnull
+            )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return set(output.decode('utf-8').split())
+
+
+def get_temp_streams():
+    """Return two temporary file handlers for STDOUT and STDERR.
+
+    Not used by ``run_cmd`` anymore, which keeps hidden output in bounded ring
+    buffer, but kept for tests and benchmarks, which replace ``sys.stdout``
+    and ``sys.stderr`` with these handlers to capture printed messages.
+    """
+    kwargs = {'encoding': 'utf-8'} if IS_PY3 else {}
+    return (tempfile.TemporaryFile('w+', **kwargs),
+            tempfile.TemporaryFile('w+', **kwargs))
+
+
+def get_wheelhouse_index(wheelhouse):
+    """Map normalized project names to distribution files in wheelhouse.
+
+    Index cached in ``~/.bootstrapper/wheelhouse.json`` until wheelhouse
+    directory mtime changes, so its files are not listed and parsed on every
+    install.
+
+    :param wheelhouse: Directory with wheels and source distributions.
+    :return: Dict where key is normalized name and value is sorted list of
+        filenames.
+    """
+    wheelhouse = os.path.abspath(wheelhouse)
+    mtime = os.stat(wheelhouse).st_mtime
+
+    filename = os.path.join(get_data_dirname(), WHEELHOUSE_INDEX_FILENAME)
+    cache = read_json(filename)
+    cached = cache.get(wheelhouse) or {}
+    if cached.get('mtime') == mtime:
+        return cached['projects']
+
+    projects = defaultdict(list)
+    for name in sorted(listdir(wheelhouse, mtime)):
+        if name.endswith('.whl'):
+            project = name.split('-')[0]
+        else:
+            match = SDIST_FILENAME_RE.match(name)
+            project = match.group('name') if match else None
+        if project:
+            projects[normalize_name(project)].append(name)
+
+    cache[wheelhouse] = {'mtime': mtime, 'projects': projects}
+    try:
+        write_json(filename, cache)
+    except (IOError, OSError):
+        pass
+
+    return dict(projects)
+
+
+def handle_request(conn):
+    """Run bootstrapper in daemon process for request of connected client.
+
+    Request contains arguments, work directory and environment of client,
+    while its standard streams are received as file descriptors, so output
+    of bootstrapper and all its child processes goes directly to client.
+    Daemon state is restored after request finished.
+
+    :param conn: Socket of connected client.
+    """
+    global ERROR_HANDLER_DISABLED
+    import socket
+    from array import array
+
+    itemsize = array('i').itemsize
+    _, ancdata, _, _ = conn.recvmsg(1, socket.CMSG_SPACE(3 * itemsize))
+    fds = array('i')
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - len(data) % itemsize])
+
+    data = b''.join(iter(lambda: conn.recv(65536), b''))
+    if len(fds) != 3 or not data:
+        for fd in fds:
+            os.close(fd)
+        return
+
+    request = json.loads(data.decode('utf-8'))
+    cwd, environ, argv = os.getcwd(), dict(os.environ), sys.argv
+    saved = [os.dup(fd) for fd in range(3)]
+
+    try:
+        for fd, client_fd in enumerate(fds):
+            os.dup2(client_fd, fd)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['environ'])
+        sys.argv = argv[:1] + request['argv']
+
+        try:
+            returncode = int(main(*request['argv']))
+        except SystemExit as err:
+            returncode = err.code if isinstance(err.code, int) else 1
+    finally:
+        flush_streams()
+        for fd in range(3):
+            os.dup2(saved[fd], fd)
+            os.close(saved[fd])
+        for fd in fds:
+            os.close(fd)
+
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        sys.argv = argv
+        PIP_CMD_KWARGS.clear()
+        ERROR_HANDLER_DISABLED = False
+
+    conn.sendall(json.dumps({'returncode': returncode}).encode('utf-8'))
+
+
+def install(env, requirements, args, ignore_activated=False,
+            install_dev_requirements=False, quiet=False, force=False,
+            jobs=None, wheel_cache=None, wheel_cache_max_size=None,
+            incremental=False, wheelhouse=None, install_args=None):
+    """Install library or project into virtual environment.
+
+    Install from lock file when it is up to date, see
+    :func:`~get_install_args`. Skip calling pip if nothing changed since last
+    successful install. For this stamp file with digest of requirements
+    files, pip arguments and interpreter version stored inside of virtual
+    environment.
+
+    :param env: Use given virtual environment name.
+    :param requirements: Use given requirements file for pip.
+    :param args: Pass given arguments to pip script.
+    :param ignore_activated:
+        Do not run pip inside already activated virtual environment. By
+        default: False
+    :param install_dev_requirements:
+        When enabled install prefixed or suffixed dev requirements after
+        original installation process completed. By default: False
+    :param quiet: Do not output message to terminal. By default: False
+    :param force: Run pip even if stamp file is up to date. By default: False
+    :param jobs:
+        When greater than 1, prefetch wheels for all requirements using this
+        number of concurrent pip processes before installing them. By default:
+        None
+    :param wheel_cache:
+        Path to wheel cache shared between all bootstrapped projects. Unless
+        lock file is used, wheels for all requirements of project are
+        prefetched (even if ``jobs`` is not given) and stored there, wheels
+        from cache are passed to pip via ``--find-links``. By default: None
+    :param wheel_cache_max_size:
+        Disk budget of wheel cache, least recently used wheels are evicted
+        when it is exceeded. By default: None
+    :param incremental:
+        When all project requirements are pinned and lock file is not used,
+        install only added or changed ones and uninstall removed ones, see
+        :func:`~install_delta`. By default: False
+    :param wheelhouse:
+        Directory with wheels and source distributions to install from,
+        served as simple index while pip is running, see
+        :func:`~serve_wheelhouse`. By default: None
+    :param install_args:
+        Result of :func:`~get_install_args` if it is already called. By
+        default: None
+    """
+    pip_args = args
+    dirname = get_env_dirname(env, ignore_activated)
+    label, filenames, install_args = install_args or get_install_args(
+        requirements, install_dev_requirements,
+        python=get_env_python(dirname)
+    )
+    args += install_args
+
+    lock = get_lock_filename(requirements)
+    if (not quiet and label == 'project' and filenames != [lock] and
+            os.path.isfile(lock)):
+        print_message('Lock file {0} is outdated or generated for other '
+                      'interpreter or platform, run "{1} lock" to update '
+                      'it'.format(lock, __script__))
+
+    stamp = os.path.join(dirname, STAMP_FILENAME)
+    environment = get_marker_environment(dirname)
+    digest = get_install_digest(get_interpreter_version(dirname),
+                                (walk_requirements(filenames)
+                                 if label == 'project'
+                                 else filenames),
+                                args)
+
+    previous = read_json(stamp)
+    pins = (get_pinned_requirements(filenames, environment)
+            if label == 'project'
+            else None)
+
+    if not force and previous.get('digest') == digest:
+        if not quiet:
+            print_message('== Step 2. Install {0} =='.format(label))
+            print_message('Requirements are not changed since last install, '
+                          'done...')
+            print_message()
+        return True
+
+    # Serve offline wheelhouse as simple index while pip is running
+    with serve_wheelhouse(wheelhouse) as index_url:
+        if index_url:
+            pip_args += ('--index-url', index_url)
+            args += ('--index-url', index_url)
+
+        # Locally built wheels do not match hashes of lock file
+        tag = (get_interpreter_tag(dirname)
+               if label == 'project' and filenames != [lock]
+               else None)
+        store = os.path.join(wheel_cache, tag) if wheel_cache and tag else None
+        no_index = False
+
+        # Build wheels for all requirements (concurrently, if jobs given),
+        # store them in wheel cache and install from them
+        if store or (jobs and jobs > 1 and label == 'project'):
+            prefetched = os.path.join(dirname, WHEELHOUSE_DIRNAME)
+            no_index = prefetch_wheels(env, filenames, pip_args, prefetched,
+                                       jobs or 1, ignore_activated, quiet,
+                                       store, environment)
+            pip_args += ('--find-links', prefetched)
+            args += ('--find-links', prefetched)
+
+            if store:
+                cache_wheels(prefetched, store)
+                evict_wheels(wheel_cache, parse_size(wheel_cache_max_size))
+
+        if store and os.path.isdir(store):
+            pip_args += ('--find-links', store)
+            args += ('--find-links', store)
+
+        # Apply only difference between installed and pinned requirements,
+        # but never bypass hash checking of up to date lock file
+        if (
+            incremental and pins is not None and not force and
+            filenames != [lock]
+        ):
+            if not quiet:
+                print_message('== Step 2. Install {0} (incremental) =='.
+                              format(label))
+
+            result = install_delta(env, dirname, pins,
+                                   previous.get('requirements') or {},
+                                   pip_args, ignore_activated, quiet)
+            return write_install_stamp(stamp, digest, pins, result, quiet)
+
+        if not quiet:
+            print_message('== Step 2. Install {0} =='.format(label))
+
+        result = not pip_cmd(env,
+                             ('install', ) + args + (('--no-index', )
+                                                     if no_index
+                                                     else ()),
+                             ignore_activated,
+                             echo=not quiet)
+
+        # Wheels for dependencies may be evicted from cache, so use index
+        if not result and no_index:
+            if not quiet:
+                print_message('Install from prefetched wheels failed, '
+                              'retrying with pip index...')
+            result = not pip_cmd(env,
+                                 ('install', ) + args,
+                                 ignore_activated,
+                                 echo=not quiet)
+
+        return write_install_stamp(stamp, digest, pins, result, quiet)
+
+
+def install_delta(env, dirname, pins, previous, args, ignore_activated=False,
+                  quiet=False):
+    """Install only added or changed pinned requirements.
+
+    Installed distributions read from ``*.dist-info`` and ``*.egg-info``
+    directories of virtual environment, without calling ``pip freeze``.
+    Requirements pinned on previous install, but removed from requirements
+    files are uninstalled. Planned changes are printed before applying.
+
+    :param env: Virtual environment name.
+    :param dirname: Path to virtual environment.
+    :param pins: Dict of currently pinned requirements, see
+        :func:`~get_pinned_requirements`.
+    :param previous: Dict of requirements pinned on previous install, where
+        key is normalized name and value is version.
+    :param args: Pip arguments.
+    :param ignore_activated:
+        Do not run pip inside already activated virtual environment. By
+        default: False
+    :param quiet: Do not output message to terminal. By default: False
+    """
+    installed = get_installed_distributions(dirname)
+    plan, to_install, to_uninstall = [], [], []
+
+    for name, (version, requirement) in sorted(iteritems(pins)):
+        current = installed.get(name)
+        if current == version.lower():
+            continue
+        to_install.append(requirement)
+        plan.append('+ {0}'.format(requirement)
+                    if current is None
+                    else '~ {0}: {1} -> {2}'.format(name, current, version))
+
+    for name in sorted(iterkeys(previous)):
+        if name not in pins and name in installed:
+            to_uninstall.append(name)
+            plan.append('- {0}=={1}'.format(name, installed[name]))
+
+    if not quiet:
+        for item in plan or ['Installed requirements are up to date, '
+                             'done...']:
+            print_message(item)
+
+    if to_uninstall and pip_cmd(env,
+                                ('uninstall', '-y') + tuple(to_uninstall),
+                                ignore_activated,
+                                echo=not quiet):
+        return False
+
+    if to_install:
+        return not pip_cmd(env,
+                           ('install', ) + tuple(args) + tuple(to_install),
+                           ignore_activated,
+                           echo=not quiet)
+
+    return True
+
+
+def is_precompiled(env):
+    """Check whether bytecode of virtual environment compiled after install.
+
+    :param env: Path to virtual environment.
+    """
+    data = read_json(os.path.join(env, STAMP_FILENAME))
+    digest = data.get('digest')
+    return bool(digest) and data.get('precompiled') == digest
+
+
+def iteritems(data, **kwargs):
+    """Iterate over dict items."""
+    return iter(data.items(**kwargs)) if IS_PY3 else data.iteritems(**kwargs)
+
+
+def iterkeys(data, **kwargs):
+    """Iterate over dict keys."""
+    return iter(data.keys(**kwargs)) if IS_PY3 else data.iterkeys(**kwargs)
+
+
+def kill_process_group(process, data=None):
+    """Kill process started in new process group with all its children.
+
+    :param process: ``subprocess.Popen`` instance.
+    :param data:
+        Trace event data to mark process as killed in. By default: None
+    """
+    if process.returncode is not None:
+        return
+
+    if data is not None:
+        data['killed'] = True
+
+    try:
+        if IS_WINDOWS:
+            subprocess.call(('taskkill', '/F', '/T', '/PID', str(process.pid)),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+        elif os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+
+def kill_processes():
+    """Kill all running child processes with all their children.
+
+    Called when bootstrap interrupted, as steps run their processes in worker
+    threads and processes started in new process group do not receive
+    ``SIGINT`` from terminal.
+    """
+    with PROCESSES_LOCK:
+        processes = list(PROCESSES)
+    for process in processes:
+        kill_process_group(process)
+
+
+def listdir(dirname, mtime):
+    """List directory content, memoize result until directory mtime changes.
+
+    :param dirname: Directory to list.
+    :param mtime: Current modification time of directory.
+    """
+    cached = LISTDIR_CACHE.get(dirname)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        names = []
+
+    if IS_WINDOWS:
+        names = [name.lower() for name in names]
+
+    LISTDIR_CACHE[dirname] = (mtime, frozenset(names))
+    return LISTDIR_CACHE[dirname][1]
+
+
+def lock_requirements(env, requirements, args, ignore_activated=False,
+                      install_dev_requirements=False, quiet=False):
+    """Resolve project requirements and write lock file.
+
+    Requirements resolved by ``pip install --dry-run --report`` (pip 22.2 or
+    later required in virtual environment), then exact pins with hashes are
+    written to lock file next to requirements file, see
+    :func:`~get_lock_filename`.
+
+    :param env: Virtual environment name.
+    :param requirements: Path to requirements file.
+    :param args: Pip arguments.
+    :param ignore_activated:
+        Do not run pip inside already activated virtual environment. By
+        default: False
+    :param install_dev_requirements:
+        Also lock prefixed or suffixed dev requirements. By default: False
+    :param quiet: Do not output message to terminal. By default: False
+    """
+    dirname = get_env_dirname(env, ignore_activated)
+    label, filenames, install_args = get_install_args(
+        requirements, install_dev_requirements, use_lock=False
+    )
+    if label != 'project':
+        print_error('Cannot lock requirements of library, requirements file '
+                    'does not exist at {0!r}'.format(requirements))
+        return False
+
+    if not quiet:
+        print_message('== Step 2. Lock requirements ==')
+
+    handle, report = tempfile.mkstemp(prefix=__script__, suffix='.json')
+    os.close(handle)
+
+    try:
+        result = not pip_cmd(env,
+                             ('install', '--dry-run', '--ignore-installed',
+                              '--quiet', '--report', report) +
+                             tuple(args) + install_args,
+                             ignore_activated,
+                             echo=not quiet)
+        data = read_json(report)
+    finally:
+        os.unlink(report)
+
+    if not result:
+        print_error('Cannot resolve requirements. Please, check that pip '
+                    '22.2 or later is installed into virtual environment')
+        return False
+
+    # Keep markers of requirements, which are true for virtual environment
+    environment = get_marker_environment(dirname)
+    markers = {}
+    for filename in walk_requirements(filenames):
+        for requirement, marker in parse_requirements(filename)[
+            'requirements'
+        ]:
+            matched = re.match(r'^[A-Za-z0-9][A-Za-z0-9._-]*', requirement)
+            if (matched and marker and
+                    evaluate_marker(marker, environment) is not False):
+                markers[normalize_name(matched.group(0))] = marker
+
+    try:
+        lines = get_locked_requirements(data, markers)
+    except ValueError as err:
+        print_error(str(err))
+        return False
+
+    lock = get_lock_filename(requirements)
+    write_lock(lock, get_lock_digest(filenames, get_env_python(dirname)),
+               lines)
+
+    if not quiet:
+        print_message('{0} requirements locked to {1}'.
+                      format(len(lines), lock))
+        print_message()
+
+    return True
+
+
+@error_handler
+def main(*args):
+    r"""Bootstrap Python projects and libraries with virtualenv and pip.
+
+    Also check system requirements before bootstrap and run post bootstrap
+    hook if any. Independent steps are run concurrently, see
+    :func:`~get_steps`.
+
+    :param \*args: Command line arguments list.
+    """
+    del TRACE_EVENTS[:]
+    start = time.time()
+    argv = args or sys.argv[1:]
+
+    # Pass arguments to running daemon, if client opted in
+    if DAEMON_SOCKET_KEY in os.environ and not DAEMON and (
+        '--daemon' not in argv
+    ):
+        returncode = run_client(get_daemon_socket(), argv)
+        if returncode is not None:
+            return returncode
+
+    # Create parser, read arguments from direct input or command line
+    with disable_error_handler():
+        args = parse_args(argv)
+
+    # Serve bootstrap requests from clients until stopped
+    if args.daemon:
+        return not run_daemon(get_daemon_socket())
+
+    # Bootstrap each project of monorepo in separate process
+    if args.projects:
+        result = run_projects(argv, args)
+        if args.profile:
+            write_trace(args.profile)
+        return not result
+
+    # Read current config from file and command line arguments
+    config = read_config(args.config, args)
+    if config is None:
+        return True
+    bootstrap = config[__script__]
+
+    # Setup timeout and retries of all pip commands
+    PIP_CMD_KWARGS.update(timeout=bootstrap.get('pip_timeout'),
+                          retries=bootstrap['pip_retries'],
+                          backoff=bootstrap['pip_retry_backoff'])
+
+    # Run all bootstrap steps, exit if any of them failed
+    results = run_steps(get_steps(config, argv))
+
+    if not bootstrap['quiet']:
+        print_timings(time.time() - start)
+    if args.profile:
+        write_trace(args.profile)
+
+    if not all(results.values()):
+        return True
+
+    # All OK!
+    if not bootstrap['quiet']:
+        print_message('All OK!')
+
+    # False means everything went alright, exit code: 0
+    return False
+
+
+def normalize_name(name):
+    """Normalize distribution name as described in PEP 503.
+
+    :param name: Distribution name.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parallel_map(func, items, jobs):
+    """Call function for each item using pool of threads.
+
+    Exception raised in any call re-raised after all threads finished. On
+    interrupt, child processes started by calls are killed, see
+    :func:`~kill_processes`.
+
+    :param func: Function to call.
+    :param items: Sequence of items to pass to function.
+    :param jobs: Maximum number of concurrent calls.
+    :return: List of results in order of given items.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    queue = Queue()
+
+    for index, item in enumerate(items):
+        queue.put((index, item))
+
+    def worker():
+        """Process items from queue until it is empty."""
+        while True:
+            try:
+                index, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[index] = func(item)
+            except BaseException as err:
+                errors.append(err)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(jobs or 1, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # Calls are run in threads, so kill their processes explicitly
+        kill_processes()
+        raise
+
+    if errors:
+        raise errors[0]
+
+    return results
+
+
+def parse_args(args):
+    """
+    Parse args from command line by creating argument parser instance and
+    process it.
+
+    :param args: Command line arguments list.
+    """
+    from argparse import ArgumentParser
+
+    description = ('Bootstrap Python projects and libraries with virtualenv '
+                   'and pip.')
+    parser = ArgumentParser(description=description)
+    parser.add_argument('--version', action='version', version=__version__)
+
+    parser.add_argument(
+        'command', nargs='?', choices=COMMANDS, default=COMMANDS[0],
+        help='Command to run: bootstrap project or library, lock project '
+             'requirements or snapshot its virtual environment. By default: '
+             '{0}'.format(COMMANDS[0])
+    )
+
+    parser.add_argument(
+        '-c', '--config', default=DEFAULT_CONFIG,
+        help='Path to config file. By default: {0}'.format(DEFAULT_CONFIG)
+    )
+    parser.add_argument(
+        '-p', '--pre-requirements', default=[], nargs='+',
+        help='List of pre-requirements to check, separated by space.'
+    )
+    parser.add_argument(
+        '-e', '--env',
+        help='Virtual environment name. By default: {0}'.
+             format(CONFIG[__script__]['env'])
+    )
+    parser.add_argument(
+        '-r', '--requirements',
+        help='Path to requirements file. By default: {0}'.
+             format(CONFIG[__script__]['requirements'])
+    )
+    parser.add_argument(
+        '-d', '--install-dev-requirements', action='store_true', default=None,
+        help='Install prefixed or suffixed "dev" requirements after '
+             'installation of original requirements file or library completed '
+             'without errors.'
+    )
+    parser.add_argument(
+        '-C', '--hook', help='Execute this hook after bootstrap process.'
+    )
+    parser.add_argument(
+        '--hook-jobs', type=int,
+        help='Maximum number of named hooks from [hooks] section to run '
+             'concurrently. By default: unlimited'
+    )
+    parser.add_argument(
+        '--force-hooks', action='store_true', default=None,
+        help='Run post-bootstrap hooks even if their inputs are not changed '
+             'since last run.'
+    )
+    parser.add_argument(
+        '--no-hooks', action='store_true', default=None,
+        help='Do not run any post-bootstrap hooks.'
+    )
+    parser.add_argument(
+        '-P', '--pythons', default=[], nargs='+',
+        help='Bootstrap virtual environment for each of given interpreters '
+             '(like 2.7 or pypy3) concurrently, separated by space.'
+    )
+    parser.add_argument(
+        '--projects', default=[], metavar='DIR', nargs='+',
+        help='Bootstrap each of given project directories or glob patterns '
+             'with config file concurrently, separated by space.'
+    )
+    parser.add_argument(
+        '-b', '--backend', choices=BACKENDS,
+        help='Backend to create virtual environment with. By default: {0}'.
+             format(CONFIG[__script__]['backend'])
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int,
+        help='Prefetch wheels for requirements using this number of '
+             'concurrent pip processes before installing them.'
+    )
+    parser.add_argument(
+        '--golden-envs', action='store_true', default=None,
+        help='Clone virtual environment from golden one with same interpreter '
+             'and requirements, if any.'
+    )
+    parser.add_argument(
+        '-I', '--incremental', action='store_true', default=None,
+        help='Install only added or changed pinned requirements and uninstall '
+             'removed ones.'
+    )
+    parser.add_argument(
+        '--precompile', action='store_true', default=None,
+        help='Compile bytecode of installed requirements using all CPUs '
+             'after install.'
+    )
+    parser.add_argument(
+        '--snapshots', metavar='DIR',
+        help='Restore virtual environment from snapshot in this directory, '
+             'if any. Snapshot command stores snapshots there.'
+    )
+    parser.add_argument(
+        '--force-install', action='store_true', default=None,
+        help='Run pip even if requirements are not changed since last '
+             'install.'
+    )
+    parser.add_argument(
+        '--ignore-activated', action='store_true', default=None,
+        help='Ignore pre-activated virtualenv, like on Travis CI.'
+    )
+    parser.add_argument(
+        '--recreate', action='store_true', default=None,
+        help='Recreate virtualenv on every run.'
+    )
+    parser.add_argument(
+        '--profile', metavar='FILE',
+        help='Write timings of bootstrap steps and commands to this file in '
+             'Chrome trace event format.'
+    )
+    parser.add_argument(
+        '--daemon', action='store_true',
+        help='Serve bootstrap requests over Unix socket, keeping caches warm '
+             'between them. Clients use daemon only when {0} environment '
+             'variable is set.'.format(DAEMON_SOCKET_KEY)
+    )
+    parser.add_argument(
+        '-q', '--quiet', action='store_true', default=None,
+        help='Minimize output, show only error messages.'
+    )
+
+    return parser.parse_args(args)
+
+
+def parse_requirements(filename):
+    """Parse pip requirements file.
+
+    Line continuations, comments, ``${VAR}`` environment variables, includes,
+    editables, options and environment markers are supported. Parsed result
+    cached until size or modification time of file changes.
+
+    :param filename: Path to requirements file.
+    :return:
+        Dict with ``includes`` (``-r``) and ``constraints`` (``-c``) lists of
+        paths, ``editables`` and ``options`` lists and ``requirements`` list
+        of tuples of requirement specifier and environment marker.
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (stat.st_mtime, stat.st_size)
+
+    cached = REQUIREMENTS_CACHE.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    dirname = os.path.dirname(filename)
+    parsed = {'constraints': [], 'editables': [], 'includes': [],
+              'options': [], 'requirements': []}
+
+    with open(filename) as handler:
+        content = re.sub(r'\\\r?\n', '', handler.read())
+
+    for line in content.splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if not line:
+            continue
+
+        line = ENVIRON_VAR_RE.sub(
+            lambda matched: os.environ.get(matched.group('name'),
+                                           matched.group(0)),
+            line
+        )
+
+        matched = REQUIREMENT_OPTION_RE.match(line)
+        if matched:
+            option, value = matched.group('option'), matched.group('value')
+            if option in ('-r', '--requirement', '-c', '--constraint'):
+                if '://' not in value:
+                    value = os.path.join(dirname, value)
+                parsed['includes'
+                       if option in ('-r', '--requirement')
+                       else 'constraints'].append(value)
+            elif option in ('-e', '--editable'):
+                parsed['editables'].append(value)
+            else:
+                parsed['options'].append(line)
+            continue
+
+        # Per-requirement options (like ``--hash``) go after specifier
+        requirement = re.split(r'\s+--?\w', line, 1)[0]
+        requirement, _, marker = requirement.partition(';')
+        parsed['requirements'].append((requirement.strip(), marker.strip()))
+
+    REQUIREMENTS_CACHE[path] = (key, parsed)
+    return parsed
+
+
+def parse_size(value):
+    """Convert size like ``512M`` or ``2G`` to number of bytes.
+
+    :param value: Size as integer or string with optional unit suffix.
+    """
+    if not value or isinstance(value, int):
+        return value or None
+
+    value = value.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ''
+    return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def pip_cmd(env, cmd, ignore_activated=False, **kwargs):
+    r"""Run pip command in given or activated virtual environment.
+
+    :param env: Virtual environment name.
+    :param cmd: Pip subcommand to run.
+    :param ignore_activated:
+        Ignore activated virtual environment and use given venv instead. By
+        default: False
+    :param \*\*kwargs:
+        Additional keyword arguments to be passed to :func:`~run_cmd`, by
+        default ``PIP_CMD_KWARGS`` used and transient network errors are
+        retried.
+    """
+    cmd = tuple(cmd)
+    dirname = get_env_dirname(env, ignore_activated)
+    pip_path = os.path.join(dirname, 'Scripts' if IS_WINDOWS else 'bin', 'pip')
+
+    if kwargs.pop('return_path', False):
+        return pip_path
+
+    if not os.path.isfile(pip_path):
+        raise OSError('No pip found at {0!r}'.format(pip_path))
+
+    # Disable pip version check in tests
+    if BOOTSTRAPPER_TEST_KEY in os.environ and cmd[0] == 'install':
+        cmd = list(cmd)
+        cmd.insert(1, '--disable-pip-version-check')
+        cmd = tuple(cmd)
+
+    # Apply timeout and retries from config, see main()
+    options = dict(PIP_CMD_KWARGS, retry_on=PIP_TRANSIENT_ERROR_RE)
+    options.update(kwargs)
+
+    with disable_error_handler():
+        return run_cmd((pip_path, ) + cmd, **options)
+
+
+def precompile_env(env, ignore_activated=False, jobs=None, force=False,
+                   quiet=False):
+    """Compile bytecode of all modules in site-packages of virtual environment.
+
+    Modules compiled by interpreter of virtual environment using process pool
+    of ``jobs`` workers (all CPUs by default) on Python 3.5+. On Python 3.7+
+    hash-based ``.pyc`` files are written (replacing timestamp-based ones
+    written by pip), so they stay valid in cloned and restored environments.
+    Compilation skipped if it is already done after last install.
+
+    :param env: Path to virtual environment.
+    :param ignore_activated:
+        Ignore activated virtual environment and use given venv instead. By
+        default: False
+    :param jobs: Number of worker processes. By default: None
+    :param force: Compile even if compiled after last install. By default:
+        False
+    :param quiet: Do not output messages to STDOUT. By default: False
+    :return: ``True`` if all modules compiled.
+    """
+    dirname = get_env_dirname(env, ignore_activated)
+    stamp = os.path.join(dirname, STAMP_FILENAME)
+    data = read_json(stamp)
+
+    if not force and is_precompiled(dirname):
+        if not quiet:
+            print_message('Bytecode is compiled since last install, done...')
+            print_message()
+        return True
+
+    if not quiet:
+        print_message('== Step 2.5. Precompile bytecode ==')
+
+    python = os.path.join(dirname, 'Scripts' if IS_WINDOWS else 'bin',
+                          'python')
+    started = time.time()
+    result = not run_cmd((python, '-c', PRECOMPILE_SCRIPT, str(jobs or 0)),
+                         fail_silently=True)
+
+    if not quiet:
+        print_message('Bytecode compiled in {0:.2f}s{1}, done...'.format(
+            time.time() - started,
+            '' if result else ' (some modules failed to compile)'
+        ))
+        print_message()
+
+    if data.get('digest'):
+        data['precompiled'] = data['digest']
+        try:
+            write_json(stamp, data)
+        except (IOError, OSError):
+            pass
+
+    return result
+
+
+def prefetch_wheels(env, filenames, args, wheelhouse, jobs,
+                    ignore_activated=False, quiet=False, store=None,
+                    environment=None):
+    """Build or download wheels for all requirements concurrently.
+
+    Each requirement (with its dependencies) handled by separate ``pip wheel``
+    process, up to ``jobs`` processes run at once, or all requirements handled
+    by single process if ``jobs`` is 1. Each process writes wheels
+    to its own temporary directory, then they are atomically renamed into
+    wheelhouse, so other processes never find partially written wheels there.
+
+    :param env: Virtual environment name.
+    :param filenames: Requirements files to read requirements from.
+    :param args: Pip arguments, only ones supported by ``pip wheel`` are used.
+    :param wheelhouse: Directory to store wheels.
+    :param jobs: Number of concurrent pip processes.
+    :param ignore_activated:
+        Ignore activated virtual environment and use given venv instead. By
+        default: False
+    :param quiet: Do not output messages to terminal. By default: False
+    :param store:
+        Wheel cache directory for interpreter of virtual environment. Pinned
+        requirements which compatible wheels are already there are not
+        prefetched, see :func:`~find_cached_wheel`. By default: None
+    :param environment:
+        Marker environment of virtual environment, see
+        :func:`~get_marker_environment`. By default: None
+    :return:
+        ``True`` if wheels for all requirements are in wheelhouse, so they
+        could be installed without index.
+    """
+    requirements = read_requirements(filenames, environment)
+    pinned = all(PINNED_REQUIREMENT_RE.match(requirement)
+                 for requirement in requirements)
+
+    if not quiet:
+        print_message('== Step 1.5. Prefetch wheels ==')
+
+    if not requirements:
+        if not quiet:
+            print_message('No requirements to prefetch, done...')
+            print_message()
+        return False
+
+    wheel_args = ('--find-links', wheelhouse)
+    if store and os.path.isdir(store):
+        wheel_args += ('--find-links', store)
+    wheel_args += filter_args(args, WHEEL_OPTIONS)
+
+    tags = (get_supported_tags(get_env_python(get_env_dirname(
+        env, ignore_activated
+    ))) if store else None)
+    missing = []
+    for requirement in requirements:
+        if store and find_cached_wheel(store, requirement, tags):
+            if not quiet:
+                print_message('= {0}'.format(requirement))
+        else:
+            missing.append(requirement)
+
+    def prefetch(items):
+        """Build or download wheels for given requirements."""
+        temp = tempfile.mkdtemp(prefix='.', dir=wheelhouse)
+        try:
+            result = not pip_cmd(env,
+                                 ('wheel', '--wheel-dir', temp) +
+                                 wheel_args + items,
+                                 ignore_activated,
+                                 fail_silently=True)
+            for name in os.listdir(temp):
+                filename = os.path.join(wheelhouse, name)
+                if not name.endswith('.whl') or os.path.exists(filename):
+                    continue
+                try:
+                    os.rename(os.path.join(temp, name), filename)
+                except OSError:
+                    # Same wheel renamed by other process meanwhile, on
+                    # Windows rename does not replace existing file
+                    pass
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+        if not quiet:
+            for requirement in items:
+                print_message('{0} {1}'.format('+' if result else '!',
+                                               requirement))
+        return result
+
+    if not os.path.isdir(wheelhouse):
+        os.makedirs(wheelhouse)
+
+    # Single pip process resolves all requirements at once, unless concurrent
+    results = parallel_map(prefetch,
+                           ([(item, ) for item in missing]
+                            if jobs > 1
+                            else [tuple(missing)] if missing else []),
+                           jobs)
+
+    if not quiet:
+        if not pinned:
+            print_message('Not all requirements are pinned, pip index '
+                          'still be used on install')
+        elif not all(results):
+            print_message('Some wheels are not prefetched, pip index still '
+                          'be used on install')
+        print_message()
+
+    return pinned and all(results)
+
+
+def prepare_args(config, bootstrap):
+    """Convert config dict to command line args line.
+
+    Placeholders in values formatted with ``env``, ``pip`` and
+    ``requirements`` values or with environment variables. Only referenced
+    environment variables are looked up, result cached under
+    ``~/.bootstrapper`` until config or any of them changed.
+
+    :param config: Configuration dict.
+    :param bootstrap: Bootstrapper configuration dict.
+    """
+    data = {'env': bootstrap['env'],
+            'pip': pip_cmd(bootstrap['env'], '', return_path=True),
+            'requirements': bootstrap['requirements']}
+    is_string = isinstance(config, string_types)
+
+    cache_key = get_cache_key('args', config, data)
+    cached = get_cached_value(cache_key)
+    if cached is not None:
+        return cached if is_string else tuple(cached)
+
+    environ = {}
+
+    def format_value(value):
+        """Format value with data and referenced environment variables."""
+        for _, name, _, _ in Formatter().parse(value):
+            name = re.split(r'[.[]', name or '', 1)[0]
+            if name and name not in data:
+                environ[name] = os.environ.get(name)
+
+        context = dict((key, item)
+                       for key, item in iteritems(environ)
+                       if item is not None)
+        context.update(data)
+        return value.format(**context)
+
+    if is_string:
+        result = format_value(config)
+    else:
+        result = config_to_args(dict(
+            (key, format_value(value)
+             if isinstance(value, string_types)
+             else value)
+            for key, value in iteritems(config)
+        ))
+
+    set_cached_value(cache_key, result, environ)
+    return result
+
+
+def print_error(message, wrap=True):
+    """Print error message to stderr, using ANSI-colors.
 
     :param message: Message to print
     :param wrap:
@@ -464,24 +2677,90 @@ def print_error(message, wrap=True):
     if wrap:
         message = 'ERROR: {0}. Exit...'.format(message.rstrip('.'))
 
-    colorizer = (_color_wrap(colorama.Fore.RED)
-                 if colorama
-                 else lambda message: message)
-    return print(colorizer(message), file=sys.stderr)
+    # Colorize message only with pip versions that provide helpers for it.
+    # Import pip lazily as it is slow and needed only on errors
+    try:
+        from pip.log import _color_wrap
+        from pip._vendor import colorama
+        message = _color_wrap(colorama.Fore.RED)(message)
+    except ImportError:
+        pass
+
+    with OUTPUT_LOCK:
+        sys.stderr.write('{0}\n'.format(message))
+        sys.stderr.flush()
 
 
 def print_message(message=None):
-    """Print message via ``subprocess.call`` function.
+    """Print message to STDOUT and flush it immediately.
 
     This helps to ensure consistent output and avoid situations where print
-    messages actually shown after messages from all inner threads.
+    messages actually shown after messages from child processes, without
+    spawning any subprocess for each message. Safe to call from multiple
+    threads.
 
     :param message: Text message to print.
     """
-    kwargs = {'stdout': sys.stdout,
-              'stderr': sys.stderr,
-              'shell': True}
-    return subprocess.call('echo "{0}"'.format(message or ''), **kwargs)
+    with OUTPUT_LOCK:
+        sys.stdout.write('{0}\n'.format(message or ''))
+        sys.stdout.flush()
+
+
+def print_table(headers, rows):
+    """Print rows as plain text table.
+
+    :param headers: Column titles.
+    :param rows: Sequence of rows, each is sequence of values.
+    """
+    rows = [tuple(smart_str(value) for value in row) for row in rows]
+    widths = [max(len(item) for item in column)
+              for column in zip(headers, *rows)]
+    template = '  '.join('{{{0}:<{1}}}'.format(index, width)
+                         for index, width in enumerate(widths))
+
+    print_message(template.format(*headers).rstrip())
+    print_message(template.format(*('-' * width for width in widths)))
+    for row in rows:
+        print_message(template.format(*row).rstrip())
+
+
+def print_timings(total):
+    """Print duration of each bootstrap step as one row table.
+
+    :param total: Total duration of bootstrap in seconds.
+    """
+    events = sorted((event for event in TRACE_EVENTS
+                     if event['cat'] == 'step'),
+                    key=operator.itemgetter('ts'))
+    headers = tuple(event['name'] for event in events) + ('total', )
+    row = tuple('{0:.2f}s'.format(value)
+                for value in [event['dur'] / 1e6 for event in events] +
+                [total])
+
+    print_table(headers, [row])
+    print_message()
+
+
+def publish_golden_env(env, golden):
+    """Clone virtual environment to golden environment if it does not exist.
+
+    Environment cloned to temporary directory first and then renamed, so
+    concurrent bootstrapper processes never see partially cloned golden
+    environment.
+
+    :param env: Path to bootstrapped virtual environment.
+    :param golden: Path to golden environment.
+    """
+    if os.path.isdir(golden):
+        return
+
+    temp = '{0}.{1}.tmp'.format(golden, os.getpid())
+    clone_env(env, temp, golden)
+
+    try:
+        os.rename(temp, golden)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
 
 
 def read_config(filename, args):
@@ -489,11 +2768,23 @@ def read_config(filename, args):
     Read and parse configuration file. By default, ``filename`` is relative
     path to current work directory.
 
-    If no config file found, default ``CONFIG`` would be used.
+    If no config file found, default ``CONFIG`` would be used. Merged config
+    cached under ``~/.bootstrapper`` until config file, command line
+    arguments or bootstrapper itself changed.
 
     :param filename: Read config from given filename.
     :param args: Parsed command line arguments.
     """
+    # Expand user and environ vars in config filename
+    is_default = filename == DEFAULT_CONFIG
+    filename = os.path.expandvars(os.path.expanduser(filename))
+
+    # Return merged config from cache if config file and args not changed
+    cache_key = get_config_cache_key(filename, args)
+    cached = get_cached_value(cache_key)
+    if cached is not None:
+        return defaultdict(dict, cached)
+
     # Initial vars
     config = defaultdict(dict)
     splitter = operator.methodcaller('split', ' ')
@@ -501,7 +2792,23 @@ def read_config(filename, args):
     converters = {
         __script__: {
             'env': safe_path,
+            'env_timeout': float,
+            'hook_inputs': splitter,
+            'hook_outputs': splitter,
+            'hook_timeout': float,
+            'pip_retry_backoff': float,
+            'pip_timeout': float,
             'pre_requirements': splitter,
+            'pythons': splitter,
+            'snapshots': lambda value: (
+                safe_path(os.path.expanduser(value)) if value else None
+            ),
+            'wheel_cache': lambda value: (
+                safe_path(os.path.expanduser(value)) if value else None
+            ),
+            'wheelhouse': lambda value: (
+                safe_path(os.path.expanduser(value)) if value else None
+            ),
         },
         'pip': {
             'allow_external': splitter,
@@ -512,14 +2819,16 @@ def read_config(filename, args):
     sections = set(iterkeys(default))
 
     # Append download-cache for old pip versions
-    if int(getattr(pip, '__version__', '1.x').split('.')[0]) < 6:
+    pip_version = get_pip_version()
+    if pip_version and int(pip_version.split('.')[0]) < 6:
         default['pip']['download_cache'] = safe_path(os.path.expanduser(
             os.path.join('~', '.{0}'.format(__script__), 'pip-cache')
         ))
 
-    # Expand user and environ vars in config filename
-    is_default = filename == DEFAULT_CONFIG
-    filename = os.path.expandvars(os.path.expanduser(filename))
+    # Share wheel cache between all projects by default
+    default[__script__]['wheel_cache'] = safe_path(os.path.expanduser(
+        os.path.join('~', '.{0}'.format(__script__), 'wheels')
+    ))
 
     # Read config if it exists on disk
     if not is_default and not os.path.isfile(filename):
@@ -541,13 +2850,14 @@ def read_config(filename, args):
 
         items = parser.items(section)
 
-        # Make auto convert here for integers and boolean values
+        # Make auto convert here for integers and boolean values, but keep
+        # hook commands as is
         for key, value in items:
             try:
-                value = int(value)
+                value = value if section == 'hooks' else int(value)
             except (TypeError, ValueError):
                 try:
-                    value = bool(strtobool(value))
+                    value = strtobool(value)
                 except ValueError:
                     pass
 
@@ -565,26 +2875,366 @@ def read_config(filename, args):
                 config[section].setdefault(key, value)
 
     # Update bootstrap config from parsed args
-    keys = set((
-        'env', 'hook', 'install_dev_requirements', 'ignore_activated',
-        'pre_requirements', 'quiet', 'recreate', 'requirements'
-    ))
+    for key in CONFIG_ARGS:
+        value = getattr(args, key)
+        config[__script__].setdefault(key, value)
+
+        if key in ('pre_requirements', 'pythons') and not value:
+            continue
+
+        if value is not None:
+            config[__script__][key] = value
+
+    set_cached_value(cache_key, config)
+    return config
+
+
+def read_json(filename):
+    """Read data from JSON file. Return empty dict if file cannot be read.
+
+    :param filename: Path to JSON file.
+    """
+    try:
+        with open(filename) as handler:
+            data = json.load(handler)
+    except (IOError, OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def read_lock_digest(filename):
+    """Read digest of locked requirements files from lock file.
+
+    :param filename: Path to lock file.
+    :return: Digest or ``None`` if lock file does not exist.
+    """
+    try:
+        with open(filename) as handler:
+            for line in handler:
+                if not line.startswith('#'):
+                    break
+                if line.startswith(LOCK_DIGEST_PREFIX):
+                    return line[len(LOCK_DIGEST_PREFIX):].strip()
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def read_output(process, size, echo=False):
+    """Read STDOUT and STDERR of child process until they are closed.
+
+    Streams read concurrently, only last ``size`` bytes of each stream kept
+    in memory. If STDOUT is not piped, only STDERR read.
+
+    :param process: ``subprocess.Popen`` instance with piped streams.
+    :param size: Maximum size of kept tail of each stream.
+    :param echo:
+        Also write output to STDOUT and STDERR of bootstrapper. By default:
+        False
+    :return: Tuple of STDOUT and STDERR tails.
+    """
+    if process.stdout is None:
+        return (b'', read_tail(process.stderr, size,
+                               sys.stderr if echo else None))
+
+    tails = {}
+
+    def read_stderr():
+        """Read tail of STDERR in background thread."""
+        tails['stderr'] = read_tail(process.stderr, size,
+                                    sys.stderr if echo else None)
+
+    thread = threading.Thread(target=read_stderr)
+    thread.daemon = True
+    thread.start()
+
+    tails['stdout'] = read_tail(process.stdout, size,
+                                sys.stdout if echo else None)
+    thread.join()
+    return (tails['stdout'], tails['stderr'])
+
+
+def read_pyvenv_cfg(dirname):
+    """Read ``pyvenv.cfg`` file of virtual environment into dict.
+
+    Return empty dict if virtual environment has no such file.
+
+    :param dirname: Path to virtual environment.
+    """
+    filename = os.path.join(dirname, 'pyvenv.cfg')
+    data = {}
+
+    if os.path.isfile(filename):
+        with open(filename) as handler:
+            for line in handler:
+                key, _, value = line.partition('=')
+                data[key.strip()] = value.strip()
+
+    return data
+
+
+def read_requirements(filenames, environment=None):
+    """Read requirement specifiers from requirements files.
+
+    Files included with ``-r`` option are read as well, each file only once.
+    Requirements which environment markers are not matched are skipped, when
+    marker cannot be evaluated it is kept in specifier for pip to decide.
+
+    :param filenames: Path or list of paths to requirements files.
+    :param environment:
+        Marker environment of virtual environment, see
+        :func:`~get_marker_environment`. By default: None
+    """
+    requirements = []
+
+    for filename in walk_requirements(filenames, constraints=False):
+        for requirement, marker in parse_requirements(filename)[
+                'requirements']:
+            if marker:
+                matched = evaluate_marker(marker, environment)
+                if matched is False:
+                    continue
+                if matched is None:
+                    requirement = '{0}; {1}'.format(requirement, marker)
+            if requirement not in requirements:
+                requirements.append(requirement)
+
+    return requirements
+
+
+def read_tail(stream, size, target=None):
+    """Read stream until it is closed, keep only last ``size`` bytes.
+
+    Chunks are kept in ring buffer, so memory usage does not depend on
+    amount of data written to stream.
+
+    :param stream: Stream to read.
+    :param size: Maximum size of kept tail.
+    :param target: Stream to copy read data to. By default: None
+    """
+    chunks, total = deque(), 0
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    while True:
+        chunk = os.read(stream.fileno(), 8192)
+        if not chunk:
+            break
+
+        if target is not None:
+            with OUTPUT_LOCK:
+                target.write(decoder.decode(chunk))
+                target.flush()
+
+        chunks.append(chunk)
+        total += len(chunk)
+        while total - len(chunks[0]) >= size:
+            total -= len(chunks.popleft())
+
+    stream.close()
+    return b''.join(chunks)[-size:]
+
+
+def restore_env(filename, env):
+    """Restore virtual environment from snapshot archive.
+
+    Archive extracted in streaming mode to temporary directory, which renamed
+    to virtual environment after. Like in :func:`~clone_env`, absolute path of
+    snapshotted environment replaced in scripts of ``bin``/``Scripts``
+    directory and ``pyvenv.cfg``, and symlinks pointing inside of it are
+    retargeted.
+
+    As snapshots may come from shared volumes, archive is not trusted: members
+    with absolute or parent paths, members written through symlinks outside
+    of environment, hardlinks to outside and absolute symlinks (besides
+    retargeted ones and interpreter links in ``bin``/``Scripts`` directory)
+    are rejected.
+
+    :param filename: Path to snapshot archive.
+    :param env: Path to new virtual environment.
+    :return: ``True`` if virtual environment restored.
+    """
+    import tarfile
+
+    new_path = os.path.abspath(env)
+    temp = '{0}.{1}.tmp'.format(new_path, os.getpid())
+    root = os.path.realpath(temp)
+    scripts = 'Scripts' if IS_WINDOWS else 'bin'
+
+    def is_unsafe(name):
+        """Check whether relative path leaves the environment."""
+        return os.path.isabs(name) or name.split(os.sep)[0] == '..'
+
+    def check_inside(path, member):
+        """Ensure real path of existing parts is inside of environment."""
+        real = os.path.realpath(path)
+        if real != root and not real.startswith(root + os.sep):
+            raise ValueError('Unsafe path {0!r}'.format(member.name))
+
+    try:
+        with tarfile.open(filename, 'r|gz') as archive:
+            for member in archive:
+                old_path = archive.pax_headers.get(SNAPSHOT_PATH_KEY)
+                name = os.path.normpath(member.name)
+                if is_unsafe(name):
+                    raise ValueError('Unsafe path {0!r}'.format(member.name))
+
+                target = os.path.join(temp, name)
+                check_inside(os.path.dirname(target), member)
+                if not member.isdir() and os.path.lexists(target):
+                    raise ValueError('Duplicate path {0!r}'.
+                                     format(member.name))
+
+                if member.isdir():
+                    if not os.path.isdir(target):
+                        os.makedirs(target)
+                    continue
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+
+                if member.issym():
+                    link = member.linkname
+                    if old_path and os.path.isabs(link) and (
+                        link == old_path or
+                        link.startswith(old_path.rstrip(os.sep) + os.sep)
+                    ):
+                        link = new_path + link[len(old_path):]
+                    elif os.path.isabs(link) and not (
+                        os.path.dirname(name) == scripts and
+                        PYTHON_EXECUTABLE_RE.match(os.path.basename(link))
+                    ):
+                        raise ValueError('Unsafe symlink {0!r} -> {1!r}'.
+                                         format(member.name, link))
+                    os.symlink(link, target)
+                    continue
+                if member.islnk():
+                    source = os.path.normpath(member.linkname)
+                    if is_unsafe(source):
+                        raise ValueError('Unsafe hardlink {0!r} -> {1!r}'.
+                                         format(member.name, member.linkname))
+                    source = os.path.join(temp, source)
+                    check_inside(source, member)
+                    os.link(source, target)
+                    continue
+                if not member.isfile():
+                    continue
+
+                source = archive.extractfile(member)
+                with open(target, 'wb') as handler:
+                    if old_path and (name.split(os.sep)[0] == scripts or
+                                     name == 'pyvenv.cfg'):
+                        handler.write(source.read().replace(
+                            old_path.encode('utf-8'),
+                            new_path.encode('utf-8')
+                        ))
+                    else:
+                        shutil.copyfileobj(source, handler)
+                os.chmod(target, member.mode)
+                os.utime(target, (member.mtime, member.mtime))
+
+        os.rename(temp, new_path)
+    except (IOError, OSError, ValueError, tarfile.TarError) as err:
+        print_error('Cannot restore snapshot {0!r}: {1}'.format(filename, err),
+                    False)
+        shutil.rmtree(temp, ignore_errors=True)
+        return False
+
+    return True
+
+
+def run_child(cmd, prefix, timeout=None, **kwargs):
+    r"""Run child process and print its output lines with given prefix.
+
+    STDERR of child process merged into its STDOUT.
+
+    :param cmd: Command to run.
+    :type cmd: tuple or str
+    :param prefix: Prefix for each line of output.
+    :param timeout:
+        Kill child process with all its children, if it is not finished in
+        given number of seconds. By default: None
+    :param \*\*kwargs: Additional keyword arguments for ``subprocess.Popen``.
+    :return: Return code of child process.
+    """
+    cmd_str = cmd if isinstance(cmd, string_types) else ' '.join(cmd)
+    if timeout:
+        set_process_group(kwargs)
+
+    with trace(prefix.strip(), 'child', cmd=cmd_str) as data:
+        process = subprocess.Popen(cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   **kwargs)
+        with PROCESSES_LOCK:
+            PROCESSES.add(process)
+        timer = (threading.Timer(timeout, kill_process_group, (process, data))
+                 if timeout
+                 else None)
+        if timer:
+            timer.daemon = True
+            timer.start()
 
-    for key in keys:
-        value = getattr(args, key)
-        config[__script__].setdefault(key, value)
+        try:
+            for line in iter(process.stdout.readline, b''):
+                print_message('{0}{1}'.format(
+                    prefix, line.decode('utf-8', 'replace').rstrip()
+                ))
+        finally:
+            process.stdout.close()
+            data['returncode'], data['cpu'] = wait_process(process)
+            if timer:
+                timer.cancel()
+            with PROCESSES_LOCK:
+                PROCESSES.discard(process)
+
+    return data['returncode']
+
+
+def run_client(filename, argv):
+    """Pass bootstrapper arguments to daemon and wait for its result.
+
+    Work directory, environment and standard streams of current process are
+    passed to daemon as well.
+
+    :param filename: Path to Unix socket of daemon.
+    :param argv: Command line arguments.
+    :return:
+        Exit code of bootstrap or ``None`` if daemon is not available, so
+        bootstrap should be run in current process.
+    """
+    # Import socket lazily as it is needed only for daemon clients
+    import socket
+    from array import array
 
-        if key == 'pre_requirements' and not value:
-            continue
+    if not hasattr(socket.socket, 'sendmsg'):
+        return None
 
-        if value is not None:
-            config[__script__][key] = value
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    request = {'argv': list(argv),
+               'cwd': os.getcwd(),
+               'environ': dict(os.environ)}
 
-    return config
+    try:
+        client.connect(filename)
+        client.sendmsg([b'\0'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                  array('i', range(3)).tobytes())])
+        client.sendall(json.dumps(request).encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        response = b''.join(iter(lambda: client.recv(4096), b''))
+        return json.loads(response.decode('utf-8'))['returncode']
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+    finally:
+        client.close()
 
 
-def run_cmd(cmd, echo=False, fail_silently=False, **kwargs):
-    r"""Call given command with ``subprocess.call`` function.
+def run_cmd(cmd, echo=False, fail_silently=False, timeout=None, retries=0,
+            backoff=1, retry_on=None, **kwargs):
+    r"""Call given command with ``subprocess.Popen`` and wait for it.
+
+    Wall and CPU time of command recorded as trace event, see
+    :func:`~trace`. When output is hidden, only last ``OUTPUT_TAIL_SIZE``
+    bytes of STDOUT and STDERR kept in memory. If command fails, they are
+    saved to bootstrapper log and shown (unless ``fail_silently`` enabled).
 
     :param cmd: Command to run.
     :type cmd: tuple or str
@@ -592,43 +3242,256 @@ def run_cmd(cmd, echo=False, fail_silently=False, **kwargs):
         If enabled show command to call and its output in STDOUT, otherwise
         hide all output. By default: False
     :param fail_silently: Do not raise exception on error. By default: False
+    :param timeout:
+        Kill command with all its child processes, if it is not finished in
+        given number of seconds. By default: None
+    :param retries:
+        Retry failed command up to given number of times, if its output
+        matches ``retry_on`` regular expression. When output echoed, only
+        STDERR piped (and copied to STDERR of bootstrapper) to match it, while
+        STDOUT stays attached to terminal. By default: 0
+    :param backoff:
+        Delay before first retry in seconds, doubled for each next retry. By
+        default: 1
+    :param retry_on:
+        Compiled regular expression to match output of transient failures.
+        By default: None
     :param \*\*kwargs:
-        Additional keyword arguments to be passed to ``subprocess.call``
-        function. STDOUT and STDERR streams would be setup inside of function
+        Additional keyword arguments to be passed to ``subprocess.Popen``
+        class. STDOUT and STDERR streams would be setup inside of function
         to ensure hiding command output in case of disabling ``echo``.
     """
-    out, err = None, None
+    cmd_str = cmd if isinstance(cmd, string_types) else ' '.join(cmd)
+    capture = not echo or bool(retries and retry_on)
+    output = (b'', b'')
 
     if echo:
-        cmd_str = cmd if isinstance(cmd, string_types) else ' '.join(cmd)
-        kwargs['stdout'], kwargs['stderr'] = sys.stdout, sys.stderr
         print_message('$ {0}'.format(cmd_str))
-    else:
-        out, err = get_temp_streams()
-        kwargs['stdout'], kwargs['stderr'] = out, err
+
+    # Errors should be read to find transient failures, but echoed STDOUT
+    # (with progress bars) is kept on terminal
+    kwargs['stdout'] = sys.stdout if echo else subprocess.PIPE
+    kwargs['stderr'] = subprocess.PIPE if capture else sys.stderr
+
+    # Start command in new process group to kill it with all its children
+    if timeout:
+        set_process_group(kwargs)
+
+    parts = cmd_str.split()
+    name = ' '.join([os.path.basename(parts[0])] + parts[1:2])
 
     try:
-        retcode = subprocess.call(cmd, **kwargs)
+        for attempt in range(retries + 1):
+            flush_streams()
+
+            with trace(name, 'cmd', cmd=cmd_str) as data:
+                process = subprocess.Popen(cmd, **kwargs)
+                with PROCESSES_LOCK:
+                    PROCESSES.add(process)
+                timer = (threading.Timer(timeout, kill_process_group,
+                                         (process, data))
+                         if timeout
+                         else None)
+                if timer:
+                    timer.daemon = True
+                    timer.start()
+
+                try:
+                    if capture:
+                        output = read_output(process, OUTPUT_TAIL_SIZE, echo)
+                    retcode, data['cpu'] = wait_process(process)
+                except BaseException:
+                    kill_process_group(process)
+                    raise
+                finally:
+                    if timer:
+                        timer.cancel()
+                    with PROCESSES_LOCK:
+                        PROCESSES.discard(process)
+
+                data['returncode'] = retcode
+
+            if (
+                not retcode or data.get('killed') or attempt >= retries or
+                not retry_on or
+                not retry_on.search(b'\n'.join(output).decode('utf-8',
+                                                              'replace'))
+            ):
+                break
+
+            delay = backoff * 2 ** attempt
+            print_message('Command {0!r} failed with transient error, retry '
+                          '{1} of {2} in {3}s...'.format(cmd_str, attempt + 1,
+                                                         retries, delay))
+            time.sleep(delay)
     except subprocess.CalledProcessError as err:
         if fail_silently:
             return False
         print_error(str(err) if IS_PY3 else unicode(err))  # noqa
-    finally:
-        if out:
-            out.close()
-        if err:
-            err.close()
 
-    if retcode and echo and not fail_silently:
-        print_error('Command {0!r} returned non-zero exit status {1}'.
-                    format(cmd_str, retcode))
+    reason = ('timed out after {0} seconds'.format(timeout)
+              if data.get('killed')
+              else 'returned non-zero exit status {0}'.format(retcode))
+
+    if retcode and not echo:
+        filename = save_output(cmd_str, reason, output)
+        if not fail_silently:
+            for tail in output:
+                if tail.strip():
+                    print_error(tail.decode('utf-8', 'replace').rstrip(),
+                                False)
+            print_error('Command {0!r} {1}. Last output stored to {2}'.
+                        format(cmd_str, reason, filename))
+    elif retcode and not fail_silently:
+        print_error('Command {0!r} {1}'.format(cmd_str, reason))
 
     return retcode
 
 
+def run_daemon(filename):
+    """Serve bootstrap requests from clients over Unix socket.
+
+    Requests are handled one by one in daemon process, so parsed configs and
+    requirements, directory listings and installed distributions stay in
+    memory between them, while each cache is still invalidated by mtime of
+    related files. Daemon stops on ``SIGINT`` or ``SIGTERM``, or on first
+    request after bootstrapper itself changed.
+
+    :param filename: Path to Unix socket to listen.
+    :return: ``True`` if daemon stopped without errors.
+    """
+    import socket
+
+    if not hasattr(socket.socket, 'sendmsg'):
+        print_error('Daemon is supported only on Unix with Python 3.3+')
+        return False
+
+    # Remove socket left by stopped daemon, but not one of running daemon
+    if os.path.exists(filename):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(filename)
+        except (IOError, OSError):
+            os.unlink(filename)
+        else:
+            print_error('Daemon is already running at {0!r}'.
+                        format(filename))
+            return False
+        finally:
+            probe.close()
+
+    # Create socket with owner only permissions, so no one else can connect
+    # before it is listening
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(filename)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+
+    DAEMON['socket'] = filename
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    mtime = os.stat(__file__).st_mtime
+    print_message('Listening on {0}'.format(filename))
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                # Let client bootstrap by itself with changed bootstrapper
+                if os.stat(__file__).st_mtime != mtime:
+                    break
+                handle_request(conn)
+            except Exception as err:
+                save_traceback(err)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        DAEMON.clear()
+        server.close()
+        os.unlink(filename)
+
+    return True
+
+
+def run_fresh_hook(name, cmd, inputs, outputs, config, func, quiet=False):
+    """Run hook unless its inputs are not changed since last successful run.
+
+    Hook is up to date when digest of its rendered command, last install into
+    virtual environment and content of files matching ``inputs`` glob
+    patterns is same as on last successful run, and each of ``outputs``
+    patterns matches any file. Digests stored inside of virtual environment.
+    Hooks without inputs and all hooks with ``force_hooks`` enabled are
+    always run.
+
+    :param name: Hook name.
+    :param cmd: Rendered hook command.
+    :param inputs: Glob patterns of hook input files.
+    :param outputs: Glob patterns of hook output files.
+    :param config: Configuration dict.
+    :param func: Function to run hook, should return true value on success.
+    :param quiet: Do not output messages to STDOUT. By default: False
+    :return: Result of function or ``True`` if hook is up to date.
+    """
+    if not inputs:
+        return func()
+
+    dirname = get_env_dirname(config['env'], config['ignore_activated'])
+    stamp = os.path.join(dirname, HOOKS_STAMP_FILENAME)
+    env_digest = read_json(os.path.join(dirname, STAMP_FILENAME)).get(
+        'digest'
+    )
+    kwargs = {'recursive': True} if sys.version_info >= (3, 5) else {}
+
+    with HOOKS_LOCK:
+        previous = read_json(stamp).get(name) or {}
+
+    files = {}
+    filenames = sorted(set(
+        filename for pattern in inputs
+        for filename in glob.glob(pattern, **kwargs)
+        if os.path.isfile(filename)
+    ))
+    digest = get_hook_digest(cmd, env_digest or '', filenames,
+                             previous.get('files') or {}, files)
+
+    if (
+        not config.get('force_hooks') and
+        previous.get('digest') == digest and
+        all(glob.glob(pattern, **kwargs) for pattern in outputs or ())
+    ):
+        if not quiet:
+            print_message('Hook {0!r} inputs are not changed since last run, '
+                          'skipped...'.format(name))
+        return True
+
+    result = func()
+
+    with HOOKS_LOCK:
+        data = read_json(stamp)
+        if result:
+            data[name] = {'digest': digest, 'files': files}
+        else:
+            data.pop(name, None)
+        try:
+            write_json(stamp, data)
+        except (IOError, OSError):
+            pass
+
+    return result
+
+
 def run_hook(hook, config, quiet=False):
     """Run post-bootstrap hook if any.
 
+    Hook killed with all its child processes if it does not finish in
+    ``hook_timeout`` seconds from config. Hook skipped if its
+    ``hook_inputs`` are not changed since last run, see
+    :func:`~run_fresh_hook`.
+
     :param hook: Hook to run.
     :param config: Configuration dict.
     :param quiet: Do not output messages to STDOUT/STDERR. By default: False
@@ -639,10 +3502,17 @@ def run_hook(hook, config, quiet=False):
     if not quiet:
         print_message('== Step 3. Run post-bootstrap hook ==')
 
-    result = not run_cmd(prepare_args(hook, config),
-                         echo=not quiet,
-                         fail_silently=True,
-                         shell=True)
+    cmd = prepare_args(hook, config)
+    result = run_fresh_hook(
+        'hook', cmd, config.get('hook_inputs'), config.get('hook_outputs'),
+        config,
+        lambda: not run_cmd(cmd,
+                            echo=not quiet,
+                            fail_silently=True,
+                            timeout=config.get('hook_timeout'),
+                            shell=True),
+        quiet
+    )
 
     if not quiet:
         print_message()
@@ -650,6 +3520,277 @@ def run_hook(hook, config, quiet=False):
     return result
 
 
+def run_hooks(hooks, config, jobs=None, quiet=False):
+    """Run named post-bootstrap hooks concurrently, respecting dependencies.
+
+    Each hook given as ``<name> = <command>`` option of ``[hooks]`` section
+    and runs after all hooks listed in its ``<name>.after`` option
+    succeeded, see :func:`~run_steps`. Unknown and cyclic dependencies are
+    errors. Failed hook cancels only hooks depending on it. Output of each
+    hook prefixed with its name. Hook skipped if its ``<name>.inputs`` are
+    not changed since last run, see :func:`~run_fresh_hook`.
+
+    :param hooks: Dict of hook commands and their dependencies.
+    :param config: Configuration dict.
+    :param jobs: Maximum number of concurrent hooks. By default: unlimited
+    :param quiet: Do not output messages to STDOUT/STDERR. By default: False
+    :return: ``True`` if all hooks succeeded.
+    """
+    names = sorted(key for key in hooks
+                   if key.rsplit('.', 1)[-1] not in HOOK_OPTIONS)
+    if not names:
+        return True
+
+    steps = []
+    for name in names:
+        after = tuple(smart_str(hooks.get(name + '.after') or '').split())
+        unknown = sorted(set(after) - set(names))
+        if unknown:
+            print_error('Hook {0!r} runs after unknown hooks: {1}'.
+                        format(name, ', '.join(unknown)))
+            return False
+
+        cmd = prepare_args(smart_str(hooks[name]), config)
+        if quiet:
+            func = partial(run_cmd, cmd, fail_silently=True,
+                           timeout=config.get('hook_timeout'), shell=True)
+        else:
+            func = partial(run_child, cmd, '[{0}] '.format(name),
+                           timeout=config.get('hook_timeout'), shell=True)
+        inputs, outputs = (
+            smart_str(hooks.get('{0}.{1}'.format(name, option)) or '').split()
+            for option in ('inputs', 'outputs')
+        )
+        steps.append((name,
+                      partial(run_fresh_hook, name, cmd, inputs, outputs,
+                              config, lambda func=func: not func(), quiet),
+                      after))
+
+    cycle = find_cycle(dict((name, after) for name, _, after in steps))
+    if cycle:
+        print_error('Hooks depend on each other in cycle: {0}'.
+                    format(' -> '.join(cycle)))
+        return False
+
+    if not quiet:
+        print_message('== Step 3. Run post-bootstrap hooks ==')
+
+    results = run_steps(steps, jobs, 'hook')
+    failed = [name for name in names if not results[name]]
+
+    if failed:
+        print_error('Hooks failed or cancelled: {0}'.
+                    format(', '.join(failed)), False)
+    elif not quiet:
+        print_message()
+
+    return not failed
+
+
+def run_matrix(argv, bootstrap):
+    """Bootstrap virtual environment for each interpreter concurrently.
+
+    Each interpreter bootstrapped by separate bootstrapper process into
+    ``<env>-<python>`` virtual environment without running post-bootstrap
+    hooks. Up to ``jobs`` processes run at once, while ``-j`` argument is not
+    passed to them. Output of each process prefixed with interpreter, results
+    table printed at the end.
+
+    :param argv: Original command line arguments.
+    :param bootstrap: Bootstrapper configuration dict.
+    :return: ``True`` if all virtual environments bootstrapped.
+    """
+    pythons = bootstrap['pythons']
+    env = bootstrap['env'].rstrip('/\\')
+    # Number of concurrent interpreters is not passed to child processes, as
+    # jobs there enables prefetching wheels
+    child_argv = exclude_args(argv, {'--jobs': False, '-j': False})
+    script = os.path.abspath(__file__)
+    if script.endswith(('.pyc', '.pyo')):
+        script = script[:-1]
+
+    def bootstrap_python(python):
+        """Bootstrap virtual environment for given interpreter."""
+        python_env = '{0}-{1}'.format(env, python)
+        cmd = (sys.executable, script) + tuple(child_argv) + (
+            '--env', python_env, '--pythons', python, '--no-hooks',
+            '--profile', ''
+        )
+
+        start = time.time()
+        result = not run_child(cmd, '[{0}] '.format(python))
+        return (python, python_env, 'OK' if result else 'FAILED',
+                '{0:.2f}s'.format(time.time() - start))
+
+    results = parallel_map(bootstrap_python,
+                           pythons,
+                           bootstrap['jobs'] or len(pythons))
+
+    if not bootstrap['quiet']:
+        print_message()
+        print_table(('Python', 'Env', 'Result', 'Duration'), results)
+        print_message()
+
+    failed = [item[0] for item in results if item[2] != 'OK']
+    if failed:
+        print_error('Cannot bootstrap virtual environment for {0}'.
+                    format(', '.join(failed)))
+        return False
+
+    return True
+
+
+def run_projects(argv, args):
+    """Bootstrap each project of monorepo concurrently.
+
+    Pre-requirements of all projects checked once before starting, so
+    ``which`` cache is shared by all projects. Each project bootstrapped by
+    separate bootstrapper process in project directory, sharing pip and wheel
+    caches. Up to ``jobs`` processes (by default: number of CPUs) run at once,
+    while ``-j`` argument is not passed to them. Output of each process
+    prefixed with project directory, results table printed at the end.
+
+    :param argv: Original command line arguments.
+    :param args: Parsed command line arguments.
+    :return: ``True`` if all projects bootstrapped.
+    """
+    from multiprocessing import cpu_count
+
+    projects = get_projects(args.projects, args.config)
+    if not projects:
+        print_error('No projects with {0!r} config found'.format(args.config))
+        return False
+
+    script = os.path.abspath(__file__)
+    if script.endswith(('.pyc', '.pyo')):
+        script = script[:-1]
+
+    # Do not pass projects and number of concurrent projects to child
+    # processes, as jobs there enables prefetching wheels
+    child_argv = exclude_args(argv, {'--projects': True, '--jobs': False,
+                                     '-j': False})
+
+    # Check pre-requirements of all projects at once
+    pre_requirements = set(args.pre_requirements)
+    backend = 'venv'
+    for dirname in projects:
+        config = read_config(os.path.join(dirname, args.config), args)
+        if config is None:
+            return False
+        bootstrap = config[__script__]
+        pre_requirements.update(bootstrap['pre_requirements'] or [])
+        if bootstrap['backend'] == 'virtualenv':
+            backend = 'virtualenv'
+
+    if not check_pre_requirements(pre_requirements, backend):
+        return False
+
+    def bootstrap_project(dirname):
+        """Bootstrap project in given directory."""
+        cmd = (sys.executable, script) + tuple(child_argv) + ('--profile', '')
+
+        start = time.time()
+        result = not run_child(cmd, '[{0}] '.format(dirname), cwd=dirname)
+        return (dirname, 'OK' if result else 'FAILED',
+                '{0:.2f}s'.format(time.time() - start))
+
+    results = parallel_map(bootstrap_project,
+                           projects,
+                           args.jobs or cpu_count())
+
+    if not args.quiet:
+        print_message()
+        print_table(('Project', 'Result', 'Duration'), results)
+        print_message()
+
+    failed = [item[0] for item in results if item[1] != 'OK']
+    if failed:
+        print_error('Cannot bootstrap {0}'.format(', '.join(failed)))
+        return False
+
+    if not args.quiet:
+        print_message('All OK!')
+    return True
+
+
+def run_steps(steps, jobs=None, category='step'):
+    """Run steps in threads, respecting dependencies between them.
+
+    Step starts as soon as all its dependencies succeeded, so independent
+    steps run concurrently. Failed step cancels all steps depending on it
+    (directly or not), while independent steps are run to the end. Exception
+    raised in any step stops starting new steps and re-raised after running
+    steps finished. On interrupt, child processes started by steps are
+    killed, see :func:`~kill_processes`. Timing of each step recorded as
+    trace event of given category.
+
+    :param steps:
+        Sequence of ``(name, func, dependencies)`` tuples. Function called
+        without arguments and should return true value on success.
+    :param jobs: Maximum number of concurrent steps. By default: unlimited
+    :param category: Category of trace events. By default: step
+    :return:
+        Dict with result of each step: ``True`` if step succeeded, ``False``
+        if it failed or was cancelled.
+    """
+    pending = list(steps)
+    results = {}
+    running = []
+    errors = []
+    condition = threading.Condition()
+
+    def target(name, func):
+        """Run step function and store its result."""
+        try:
+            with trace(name, category) as data:
+                result = data['result'] = bool(func())
+        except BaseException as err:
+            errors.append(err)
+            result = False
+        with condition:
+            results[name] = result
+            running.remove(name)
+            condition.notify()
+
+    try:
+        with condition:
+            while True:
+                for step in list(pending):
+                    name, func, dependencies = step
+                    if any(results.get(item) is False
+                           for item in dependencies):
+                        pending.remove(step)
+                        results[name] = False
+                    elif (
+                        all(results.get(item) for item in dependencies) and
+                        (not jobs or len(running) < jobs) and
+                        not errors
+                    ):
+                        pending.remove(step)
+                        running.append(name)
+                        thread = threading.Thread(target=target,
+                                                  args=(name, func))
+                        thread.daemon = True
+                        thread.start()
+
+                # Nothing could be started until running steps finished
+                if not running:
+                    break
+                condition.wait(0.1)
+    except KeyboardInterrupt:
+        # Steps are run in threads, so kill their processes explicitly
+        kill_processes()
+        raise
+
+    if errors:
+        raise errors[0]
+
+    for name, _, _ in pending:
+        results[name] = False
+
+    return results
+
+
 def safe_path(path):
     """Replace slashes for Windows pathes.
 
@@ -658,22 +3799,39 @@ def safe_path(path):
     return path.replace('/', os.sep) if IS_WINDOWS else path
 
 
+def save_output(cmd, reason, output):
+    """Save last output of failed command to bootstrapper log file.
+
+    :param cmd: Command string.
+    :param reason: Reason of failure, like ``timed out after 10 seconds``.
+    :param output: Tuple of STDOUT and STDERR tails.
+    :return: Path to log file.
+    """
+    filename = get_log_filename()
+    lines = ['== {0} Command {1!r} {2} =='.
+             format(time.strftime('%Y-%m-%d %H:%M:%S'), cmd, reason)]
+
+    for label, tail in zip(('STDOUT', 'STDERR'), output):
+        lines.append('-- {0} (last {1} bytes) --'.format(label, len(tail)))
+        lines.append(tail.decode('utf-8', 'replace').rstrip())
+
+    with OUTPUT_LOCK:
+        with open(filename, 'a+') as handler:
+            handler.write(smart_str('\n'.join(lines) + '\n'))
+
+    return filename
+
+
 def save_traceback(err):
     """Save error traceback to bootstrapper log file.
 
     :param err: Catched exception.
     """
-    # Store logs to ~/.bootstrapper directory
-    dirname = safe_path(os.path.expanduser(
-        os.path.join('~', '.{0}'.format(__script__))
-    ))
-
-    # But ensure that directory exists
-    if not os.path.isdir(dirname):
-        os.mkdir(dirname)
+    # Import traceback lazily as it is needed only on errors
+    import traceback
 
     # Now we ready to put traceback to log file
-    filename = os.path.join(dirname, '{0}.log'.format(__script__))
+    filename = get_log_filename()
 
     with open(filename, 'a+') as handler:
         traceback.print_exc(file=handler)
@@ -688,6 +3846,201 @@ def save_traceback(err):
     return True
 
 
+def seed_pip(env):
+    """Install pip into virtual environment from wheels bundled with ensurepip.
+
+    Wheels are extracted to ``site-packages`` in-process and pip scripts are
+    written from its entry points, so no subprocess and no network access is
+    needed.
+
+    :param env: Path to virtual environment.
+    """
+    import ensurepip
+    import zipfile
+
+    bundled = os.path.join(os.path.dirname(ensurepip.__file__), '_bundled')
+    wheels = [name for name in sorted(listdir(bundled, None))
+              if name.endswith('.whl')]
+    if not any(name.startswith('pip-') for name in wheels):
+        print_error('No pip wheel bundled with ensurepip')
+        return False
+
+    python = os.path.join(os.path.abspath(env), 'bin', 'python')
+    site_packages = os.path.join(
+        env, 'lib', 'python{0}.{1}'.format(*sys.version_info[:2]),
+        'site-packages'
+    )
+
+    for name in wheels:
+        with zipfile.ZipFile(os.path.join(bundled, name)) as wheel:
+            wheel.extractall(site_packages)
+
+            if not name.startswith('pip-'):
+                continue
+
+            entry_points = [item for item in wheel.namelist()
+                            if item.endswith('.dist-info/entry_points.txt')]
+            content = wheel.read(entry_points[0]).decode('utf-8')
+
+        scripts = ConfigParser()
+        scripts.optionxform = str
+        scripts.read_string(content)
+
+        for script, entry_point in scripts.items('console_scripts'):
+            module, func = entry_point.split(':')
+            filename = os.path.join(env, 'bin', script)
+            with open(filename, 'w') as handler:
+                handler.write(PIP_SCRIPT.format(
+                    python=python, module=module.strip(), func=func.strip()
+                ))
+            os.chmod(filename, 0o755)
+
+    return True
+
+
+@contextmanager
+def serve_wheelhouse(wheelhouse):
+    """Serve wheelhouse as PEP 503 simple index from local HTTP server.
+
+    Server listens on random port of loopback interface in background thread
+    and stopped on exit from context, see :func:`~get_wheelhouse_index`.
+
+    :param wheelhouse:
+        Directory with wheels and source distributions. If empty, no server
+        started and ``None`` yielded.
+    :return: URL of simple index.
+    """
+    if not wheelhouse:
+        yield None
+        return
+
+    # Import HTTP server lazily as it is needed only for wheelhouse
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+        from urllib.parse import quote, unquote
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+        from urllib import quote, unquote
+
+    projects = get_wheelhouse_index(wheelhouse)
+    files = set(name for names in projects.values() for name in names)
+
+    class Handler(BaseHTTPRequestHandler):
+        """Serve project pages and files of wheelhouse."""
+
+        def do_GET(self):  # noqa
+            """Respond with project list, project page or file."""
+            parts = [unquote(part) for part in
+                     self.path.split('?')[0].strip('/').split('/')]
+
+            if parts == ['simple']:
+                return self.send_links(
+                    (name + '/', name) for name in sorted(projects)
+                )
+
+            if len(parts) == 2 and parts[0] == 'simple':
+                name = normalize_name(parts[1])
+                if name not in projects:
+                    return self.send_error(404)
+                if name != parts[1]:
+                    self.send_response(301)
+                    self.send_header('Location', '/simple/{0}/'.format(name))
+                    return self.end_headers()
+                return self.send_links(
+                    ('/files/' + quote(item), item) for item in projects[name]
+                )
+
+            if len(parts) == 2 and parts[0] == 'files' and parts[1] in files:
+                filename = os.path.join(wheelhouse, parts[1])
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length',
+                                 str(os.path.getsize(filename)))
+                self.end_headers()
+                with open(filename, 'rb') as handler:
+                    shutil.copyfileobj(handler, self.wfile)
+                return None
+
+            return self.send_error(404)
+
+        def log_message(self, *args):
+            """Do not log requests to STDERR."""
+
+        def send_links(self, links):
+            """Respond with HTML page of given links."""
+            body = ''.join('<a href="{0}">{1}</a><br>\n'.format(href, text)
+                           for href, text in links)
+            data = ('<!DOCTYPE html>\n<html><body>\n{0}</body></html>\n'.
+                    format(body).encode('utf-8'))
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    class Server(ThreadingMixIn, HTTPServer):
+        """Handle concurrent pip processes in threads."""
+
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        yield 'http://127.0.0.1:{0}/simple/'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def set_cached_value(key, value, environ=None):
+    """Store value to config cache in ``~/.bootstrapper``.
+
+    Only ``CONFIG_CACHE_SIZE`` most recently stored values kept.
+
+    :param key: Cache key, see :func:`~get_cache_key`.
+    :param value: JSON serializable value.
+    :param environ:
+        Environment variables value depends on with their current values. By
+        default: None
+    """
+    entries = CONFIG_CACHE.setdefault('entries', {})
+    entries[key] = {'environ': environ or {},
+                    'time': time.time(),
+                    'value': copy.deepcopy(value)}
+
+    for item in sorted(entries, key=lambda item: entries[item]['time'])[
+            :-CONFIG_CACHE_SIZE]:
+        entries.pop(item)
+
+    try:
+        write_json(os.path.join(get_data_dirname(), CONFIG_CACHE_FILENAME),
+                   entries)
+    except (IOError, OSError):
+        pass
+
+
+def set_process_group(kwargs):
+    """Update ``subprocess.Popen`` kwargs to start new process group.
+
+    This allows to kill process with all its children, see
+    :func:`~kill_process_group`.
+
+    :param kwargs: Keyword arguments dict to update.
+    """
+    if IS_WINDOWS:
+        kwargs['creationflags'] = (kwargs.get('creationflags', 0) |
+                                   subprocess.CREATE_NEW_PROCESS_GROUP)
+    elif IS_PY3:
+        kwargs['start_new_session'] = True
+    else:
+        kwargs['preexec_fn'] = os.setsid
+
+
 def smart_str(value, encoding='utf-8', errors='strict'):
     """Convert Python object to string.
 
@@ -700,13 +4053,322 @@ def smart_str(value, encoding='utf-8', errors='strict'):
     return str(value)
 
 
+def snapshot_env(env, filename, quiet=False):
+    """Pack virtual environment into compressed snapshot archive.
+
+    Absolute path of virtual environment stored in archive to be replaced on
+    restore, see :func:`~restore_env`. Hooks stamp, prefetched wheels and,
+    unless bytecode is precompiled after last install (see
+    :func:`~precompile_env`), ``__pycache__`` directories are skipped.
+    Archive written to temporary file first and then renamed, so concurrent
+    jobs never restore partially written snapshot.
+
+    :param env: Path to virtual environment.
+    :param filename: Path to snapshot archive.
+    :param quiet: Do not output messages to STDOUT. By default: False
+    :return: ``True`` if snapshot exists after the call.
+    """
+    import tarfile
+
+    if not quiet:
+        print_message('== Step 2. Snapshot virtual environment ==')
+
+    if os.path.isfile(filename):
+        if not quiet:
+            print_message('Snapshot {0!r} already exists, done...'.
+                          format(filename))
+            print_message()
+        return True
+
+    if not os.path.isdir(env):
+        print_error('Virtual environment {0!r} does not exist'.format(env))
+        return False
+
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    path = os.path.abspath(env)
+    temp = '{0}.{1}.tmp'.format(filename, os.getpid())
+    precompiled = is_precompiled(path)
+
+    def exclude(info):
+        """Skip hooks stamp, wheels and not precompiled bytecode caches."""
+        parts = info.name.split('/')
+        if (
+            parts == [HOOKS_STAMP_FILENAME] or
+            parts[0] == WHEELHOUSE_DIRNAME or
+            not precompiled and '__pycache__' in parts
+        ):
+            return None
+        return info
+
+    try:
+        with tarfile.open(temp, 'w:gz', compresslevel=6,
+                          format=tarfile.PAX_FORMAT,
+                          pax_headers={SNAPSHOT_PATH_KEY: path}) as archive:
+            for name in sorted(os.listdir(path)):
+                archive.add(os.path.join(path, name), name, filter=exclude)
+        os.rename(temp, filename)
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+
+    if not quiet:
+        print_message('Snapshot stored to {0!r}, done...'.format(filename))
+        print_message()
+
+    return True
+
+
+def strtobool(value):
+    """Convert string representation of truth to ``True`` or ``False``.
+
+    Same as ``distutils.util.strtobool``, but without importing distutils.
+
+    :param value: String value to convert.
+    :raises ValueError: If value cannot be converted.
+    """
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+    raise ValueError('Invalid truth value {0!r}'.format(value))
+
+
+@contextmanager
+def trace(name, category, **kwargs):
+    r"""Context manager to record wall and CPU time of code block.
+
+    Event stored in ``TRACE_EVENTS`` in Chrome trace event format. If
+    ``cpu`` is not set by code block, CPU time of whole bootstrapper process
+    is used.
+
+    :param name: Event name.
+    :param category: Event category, like ``step`` or ``cmd``.
+    :param \*\*kwargs: Event arguments.
+    """
+    data = dict(kwargs)
+    start, cpu = time.time(), sum(os.times()[:2])
+
+    try:
+        yield data
+    finally:
+        duration = time.time() - start
+        if data.get('cpu') is None:
+            data['cpu'] = sum(os.times()[:2]) - cpu
+        data['cpu'] = round(data['cpu'], 3)
+        TRACE_EVENTS.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': int(duration * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': data,
+        })
+
+
+def wait_process(process):
+    """Wait for child process and return its exit code and CPU time.
+
+    CPU time of child process read from its resource usage on POSIX systems,
+    on other systems ``None`` returned instead.
+
+    :param process: ``subprocess.Popen`` instance.
+    """
+    if not hasattr(os, 'wait4'):
+        return (process.wait(), None)
+
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+
+    process.returncode = (-os.WTERMSIG(status)
+                          if os.WIFSIGNALED(status)
+                          else os.WEXITSTATUS(status))
+    return (process.returncode, usage.ru_utime + usage.ru_stime)
+
+
+def walk_requirements(filenames, constraints=True):
+    """Walk include graph of requirements files.
+
+    :param filenames: Path or list of paths to requirements files.
+    :param constraints:
+        Also walk constraints files included with ``-c`` option. By default:
+        True
+    :return:
+        List of all existing requirements files in graph, each file listed
+        only once.
+    """
+    if isinstance(filenames, string_types):
+        filenames = [filenames]
+
+    result, seen = [], set()
+    queue = list(reversed(filenames))
+
+    while queue:
+        filename = queue.pop()
+        path = os.path.abspath(filename)
+        if path in seen or not os.path.isfile(path):
+            continue
+
+        seen.add(path)
+        result.append(filename)
+
+        parsed = parse_requirements(filename)
+        queue.extend(reversed(parsed['includes'] + (parsed['constraints']
+                                                    if constraints
+                                                    else [])))
+
+    return result
+
+
 def which(executable):
-    """Shortcut to check whether executable available in current env or not.
+    """Find executable in ``PATH`` without spawning any process.
+
+    Content of each ``PATH`` directory listed once and memoized. Results are
+    cached in ``~/.bootstrapper/which.json`` keyed by ``PATH`` value and
+    modification times of its directories, so repeated runs do not list any
+    directory at all.
+
+    :param executable: Executable to find.
+    :return: Path to executable or ``None`` if it is not found.
+    """
+    if os.path.dirname(executable):
+        return executable if os.access(executable, os.X_OK) else None
+
+    dirnames = [item for item in os.environ.get('PATH', '').split(os.pathsep)
+                if item]
+    mtimes = []
+    for dirname in dirnames:
+        try:
+            mtimes.append(os.stat(dirname).st_mtime)
+        except OSError:
+            mtimes.append(None)
+
+    extensions = ['']
+    if IS_WINDOWS:
+        extensions.extend(
+            item.lower()
+            for item in os.environ.get('PATHEXT', '.EXE').split(os.pathsep)
+            if item
+        )
+
+    key = hashlib.sha1(json.dumps([dirnames, mtimes, extensions]).
+                       encode('utf-8')).hexdigest()
+    filename = os.path.join(get_data_dirname(), WHICH_CACHE_FILENAME)
+    cache = read_json(filename)
+    found = cache.get('found', {}) if cache.get('key') == key else {}
+
+    if executable in found:
+        return found[executable]
+
+    found[executable] = None
+    name = executable.lower() if IS_WINDOWS else executable
+
+    for dirname, mtime in zip(dirnames, mtimes):
+        names = listdir(dirname, mtime)
+        for ext in extensions:
+            if name + ext not in names:
+                continue
+            path = os.path.join(dirname, executable + ext)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                found[executable] = path
+                break
+        if found[executable]:
+            break
+
+    try:
+        write_json(filename, {'key': key, 'found': found})
+    except (IOError, OSError):
+        pass
+
+    return found[executable]
+
+
+def write_install_stamp(stamp, digest, pins, result, quiet=False):
+    """Write stamp file after successful install and finish install step.
+
+    :param stamp: Path to stamp file.
+    :param digest: Install digest.
+    :param pins: Pinned requirements or ``None``.
+    :param result: Result of install.
+    :param quiet: Do not output message to terminal. By default: False
+    """
+    if result:
+        write_json(stamp, {
+            'digest': digest,
+            'requirements': dict(
+                (name, value[0]) for name, value in iteritems(pins or {})
+            ),
+        })
+
+    if not quiet:
+        print_message()
+
+    return result
+
+
+def write_json(filename, data):
+    """Atomically write data to JSON file.
+
+    Data written to temporary file first and then renamed, so concurrent
+    bootstrapper processes never read partially written file. Temporary file
+    named by process and thread, as steps of one process run in threads.
+
+    :param filename: Path to JSON file.
+    :param data: Data to write.
+    """
+    temp = '{0}.{1}.{2}.tmp'.format(filename, os.getpid(),
+                                    threading.current_thread().ident)
+
+    with open(temp, 'w') as handler:
+        json.dump(data, handler, sort_keys=True)
+
+    if IS_WINDOWS and os.path.isfile(filename):
+        os.unlink(filename)
+    os.rename(temp, filename)
+
+
+def write_lock(filename, digest, lines):
+    """Atomically write lock file.
+
+    :param filename: Path to lock file.
+    :param digest: Digest of locked requirements files.
+    :param lines: Pinned requirements with hashes.
+    """
+    temp = '{0}.{1}.tmp'.format(filename, os.getpid())
+
+    with open(temp, 'w') as handler:
+        handler.write('# Generated by "{0} lock", do not edit manually\n'.
+                      format(__script__))
+        handler.write('{0}{1}\n'.format(LOCK_DIGEST_PREFIX, digest))
+        handler.write(''.join('{0}\n'.format(line) for line in lines))
+
+    if IS_WINDOWS and os.path.isfile(filename):
+        os.unlink(filename)
+    os.rename(temp, filename)
+
+
+def write_trace(filename):
+    """Write recorded trace events to JSON file.
+
+    File could be opened in ``about:tracing`` page of Chrome or in Perfetto
+    UI.
 
-    :param executable: Executable to check.
+    :param filename: Path to trace file.
     """
-    cmd = 'where' if IS_WINDOWS else 'which'
-    return not run_cmd((cmd, executable), fail_silently=True)
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+               'args': {'name': __script__}}]
+    write_json(filename, {'displayTimeUnit': 'ms',
+                          'traceEvents': events + TRACE_EVENTS})
 
 
 if __name__ == '__main__':
@@ -2,11 +2,15 @@
 
 from __future__ import absolute_import
 
+import json
 import os
 import shlex
 import shutil
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 try:
     import unittest2 as unittest
@@ -22,6 +26,9 @@ import bootstrapper
 
 
 DIRNAME = os.path.abspath(os.path.dirname(__file__))
+FAKE_PIP = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/../pip.log"
+"""
 TEST_CONFIG = """[bootstrapper]
 pre_requirements = python
 quiet = True
@@ -241,14 +248,114 @@ class TestBootstrapperNoDashes(TestBootstrapper):
 class TestOther(unittest.TestCase):
 
     config = None
+    dirname = None
 
     def setUp(self):
         os.environ[bootstrapper.BOOTSTRAPPER_TEST_KEY] = '1'
 
+        # Caches and logs are stored under HOME, so do not touch real one
+        home = tempfile.mkdtemp(prefix='bootstrapper-home')
+        original_home = os.environ.get('HOME')
+        os.environ['HOME'] = home
+        self.addCleanup(shutil.rmtree, home, True)
+        self.addCleanup(os.environ.__setitem__, 'HOME', original_home)
+
     def tearDown(self):
         os.environ.pop(bootstrapper.BOOTSTRAPPER_TEST_KEY)
         if self.config and os.path.isfile(self.config.name):
             os.unlink(self.config.name)
+        if self.dirname and os.path.isdir(self.dirname):
+            shutil.rmtree(self.dirname)
+
+    def init_fake_env(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        env = os.path.join(self.dirname, 'env')
+        requirements = os.path.join(self.dirname, 'requirements.txt')
+
+        os.makedirs(os.path.join(env, 'bin'))
+        pip_path = os.path.join(env, 'bin', 'pip')
+        with open(pip_path, 'w+') as handler:
+            handler.write(FAKE_PIP)
+        os.chmod(pip_path, 0o755)
+
+        with open(requirements, 'w+') as handler:
+            handler.write('ordereddict==1.1\n')
+
+        return env, requirements
+
+    def read_pip_log(self, env):
+        filename = os.path.join(env, 'pip.log')
+        if not os.path.isfile(filename):
+            return []
+        with open(filename) as handler:
+            return handler.read().splitlines()
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Symlinks are not supported')
+    def test_clone_env(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        source = os.path.join(self.dirname, 'golden')
+        destination = os.path.join(self.dirname, 'env')
+        site_packages = os.path.join(source, 'lib', 'site-packages')
+
+        os.makedirs(os.path.join(source, 'bin'))
+        os.makedirs(os.path.join(source, bootstrapper.WHEELHOUSE_DIRNAME))
+        os.makedirs(os.path.join(site_packages, '__pycache__'))
+
+        files = {
+            ('bin', 'pip'): '#!{0}/bin/python\n'.format(source),
+            ('pyvenv.cfg', ): 'home = /usr/bin\n',
+            ('lib', 'site-packages', 'module.py'): 'PATH = {0!r}\n'.
+                                                   format(source),
+            ('lib', 'site-packages', '__pycache__', 'module.pyc'): '',
+            (bootstrapper.HOOKS_STAMP_FILENAME, ): '{}',
+            (bootstrapper.WHEELHOUSE_DIRNAME, 'six-1.0-py3-none-any.whl'): '',
+        }
+        for parts, content in files.items():
+            with open(os.path.join(source, *parts), 'w') as handler:
+                handler.write(content)
+
+        os.symlink(os.path.join(source, 'bin', 'pip'),
+                   os.path.join(source, 'bin', 'pip3'))
+        os.symlink('lib', os.path.join(source, 'lib64'))
+
+        bootstrapper.clone_env(source, destination)
+
+        with open(os.path.join(destination, 'bin', 'pip')) as handler:
+            self.assertEqual(handler.read(),
+                             '#!{0}/bin/python\n'.format(destination))
+        with open(os.path.join(destination, 'lib', 'site-packages',
+                               'module.py')) as handler:
+            self.assertEqual(handler.read(), files[
+                ('lib', 'site-packages', 'module.py')
+            ])
+
+        self.assertEqual(os.readlink(os.path.join(destination, 'bin', 'pip3')),
+                         os.path.join(destination, 'bin', 'pip'))
+        self.assertEqual(os.readlink(os.path.join(destination, 'lib64')),
+                         'lib')
+        self.assertTrue(os.path.isfile(
+            os.path.join(destination, 'pyvenv.cfg')
+        ))
+        self.assertFalse(os.path.exists(os.path.join(
+            destination, 'lib', 'site-packages', '__pycache__'
+        )))
+        self.assertFalse(os.path.exists(os.path.join(
+            destination, bootstrapper.HOOKS_STAMP_FILENAME
+        )))
+        self.assertFalse(os.path.exists(os.path.join(
+            destination, bootstrapper.WHEELHOUSE_DIRNAME
+        )))
+
+        bootstrapper.write_json(
+            os.path.join(source, bootstrapper.STAMP_FILENAME),
+            {'digest': 'digest', 'precompiled': 'digest'}
+        )
+        precompiled = os.path.join(self.dirname, 'precompiled')
+        bootstrapper.clone_env(source, precompiled)
+        self.assertTrue(bootstrapper.is_precompiled(precompiled))
+        self.assertTrue(os.path.isfile(os.path.join(
+            precompiled, 'lib', 'site-packages', '__pycache__', 'module.pyc'
+        )))
 
     def test_config_to_args(self):
         default_pip_config = bootstrapper.CONFIG['pip']
@@ -272,6 +379,374 @@ class TestOther(unittest.TestCase):
         index = args.index('--timeout')
         self.assertEqual(args[index + 1], '30')
 
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_install_stamp(self):
+        env, requirements = self.init_fake_env()
+        kwargs = {'ignore_activated': True, 'quiet': True}
+
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertEqual(len(self.read_pip_log(env)), 1)
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, (), force=True, **kwargs
+        ))
+        self.assertEqual(len(self.read_pip_log(env)), 2)
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, ('--quiet', ), **kwargs
+        ))
+        self.assertEqual(len(self.read_pip_log(env)), 3)
+
+        with open(requirements, 'a') as handler:
+            handler.write('MiniMock==1.2.8\n')
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertEqual(len(self.read_pip_log(env)), 4)
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_install_incremental(self):
+        env, requirements = self.init_fake_env()
+        kwargs = {'ignore_activated': True, 'quiet': True, 'incremental': True}
+        site_packages = os.path.join(env, 'lib', 'python3.6', 'site-packages')
+        os.makedirs(os.path.join(site_packages, 'ordereddict-1.1.dist-info'))
+
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertEqual(self.read_pip_log(env), [])
+
+        with open(requirements, 'a') as handler:
+            handler.write('MiniMock==1.2.8\n')
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        log = self.read_pip_log(env)
+        self.assertEqual(len(log), 1)
+        self.assertTrue(log[0].startswith('install '), log)
+        self.assertTrue(log[0].endswith(' MiniMock==1.2.8'), log)
+
+        os.makedirs(os.path.join(site_packages, 'MiniMock-1.2.8.dist-info'))
+        with open(requirements, 'w') as handler:
+            handler.write('minimock==1.2.8\n')
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertEqual(self.read_pip_log(env)[1:],
+                         ['uninstall -y ordereddict'])
+
+        with open(requirements, 'w') as handler:
+            handler.write('-e .\nminimock==1.2.8\n')
+        self.assertIsNone(bootstrapper.get_pinned_requirements([requirements]))
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_install_lock(self):
+        env, requirements = self.init_fake_env()
+        kwargs = {'ignore_activated': True, 'quiet': True}
+        lock = os.path.join(self.dirname, 'requirements.lock')
+
+        bootstrapper.write_lock(
+            lock,
+            bootstrapper.get_lock_digest([requirements]),
+            ['ordereddict==1.1 \\\n    --hash=sha256:abcdef']
+        )
+        self.assertEqual(bootstrapper.read_requirements(lock),
+                         ['ordereddict==1.1'])
+
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertTrue(self.read_pip_log(env)[0].endswith(
+            ' --no-deps --require-hashes -r {0}'.format(lock)
+        ))
+
+        # Incremental install does not bypass hash checking of lock file
+        os.unlink(os.path.join(env, bootstrapper.STAMP_FILENAME))
+        self.assertTrue(bootstrapper.install(env, requirements, (),
+                                             incremental=True, **kwargs))
+        self.assertTrue(self.read_pip_log(env)[1].endswith(
+            ' --no-deps --require-hashes -r {0}'.format(lock)
+        ))
+
+        # Lock file for other interpreter is not used
+        bootstrapper.write_lock(
+            lock,
+            bootstrapper.get_lock_digest([requirements], 'missing-python'),
+            ['ordereddict==1.1 \\\n    --hash=sha256:abcdef']
+        )
+        self.assertTrue(bootstrapper.install(env, requirements, (),
+                                             force=True, **kwargs))
+        self.assertTrue(self.read_pip_log(env)[2].endswith(
+            ' -r {0}'.format(requirements)
+        ))
+
+        with open(requirements, 'a') as handler:
+            handler.write('MiniMock==1.2.8\n')
+        self.assertTrue(bootstrapper.install(env, requirements, (), **kwargs))
+        self.assertTrue(self.read_pip_log(env)[3].endswith(
+            ' -r {0}'.format(requirements)
+        ))
+
+    def test_get_locked_requirements(self):
+        report = {'install': [
+            {'metadata': {'name': 'six', 'version': '1.11.0'},
+             'download_info': {'archive_info': {'hash': 'sha256=abcdef'}}},
+            {'metadata': {'name': 'MiniMock', 'version': '1.2.8'},
+             'download_info': {'archive_info': {
+                 'hashes': {'md5': '123456', 'sha256': 'fedcba'}
+             }}},
+        ]}
+        self.assertEqual(
+            bootstrapper.get_locked_requirements(report),
+            ['MiniMock==1.2.8 \\\n    --hash=sha256:fedcba',
+             'six==1.11.0 \\\n    --hash=sha256:abcdef']
+        )
+
+        self.assertEqual(
+            bootstrapper.get_locked_requirements(
+                report, {'six': 'python_version < "4"'}
+            )[1],
+            'six==1.11.0 ; python_version < "4" \\\n    --hash=sha256:abcdef'
+        )
+
+        report['install'].append({
+            'metadata': {'name': 'project', 'version': '1.0'},
+            'download_info': {'dir_info': {'editable': True}},
+        })
+        self.assertRaises(ValueError,
+                          bootstrapper.get_locked_requirements,
+                          report)
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_install_prefetch_wheels(self):
+        env, requirements = self.init_fake_env()
+        with open(requirements, 'a') as handler:
+            handler.write('MiniMock==1.2.8\n')
+
+        # Fake pip writes wheel for requirement given as last argument
+        with open(os.path.join(env, 'bin', 'pip'), 'a') as handler:
+            handler.write('if [ "$1" = wheel ]; then\n'
+                          '    for last; do :; done\n'
+                          '    touch "$3/${last%%=*}-py3-none-any.whl"\n'
+                          'fi\n')
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, ('--timeout', '30', '--upgrade'),
+            ignore_activated=True, quiet=True, jobs=2
+        ))
+
+        log = self.read_pip_log(env)
+        wheelhouse = os.path.join(env, bootstrapper.WHEELHOUSE_DIRNAME)
+        self.assertEqual(len(log), 3)
+
+        # Each pip process writes wheels to its own temporary directory
+        wheel_dirs = [line.split()[2] for line in log[:2]]
+        self.assertEqual(len(set(wheel_dirs)), 2)
+        for wheel_dir in wheel_dirs:
+            self.assertTrue(wheel_dir.startswith(wheelhouse), wheel_dir)
+        self.assertEqual(
+            sorted(line.split(None, 3)[3] for line in log[:2]),
+            ['--find-links {0} --timeout 30 {1}'.format(wheelhouse, item)
+             for item in ('MiniMock==1.2.8', 'ordereddict==1.1')]
+        )
+        self.assertEqual(sorted(os.listdir(wheelhouse)),
+                         ['MiniMock-py3-none-any.whl',
+                          'ordereddict-py3-none-any.whl'])
+        self.assertTrue(log[2].startswith('install '), log)
+        self.assertIn('--find-links {0}'.format(wheelhouse), log[2])
+        self.assertTrue(log[2].endswith('--no-index'), log)
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_install_wheel_cache(self):
+        env, requirements = self.init_fake_env()
+        with open(requirements, 'a') as handler:
+            handler.write('MiniMock==1.2.8\n')
+
+        wheel_cache = os.path.join(self.dirname, 'wheels')
+        store = os.path.join(wheel_cache,
+                             bootstrapper.get_interpreter_tag(env))
+        wheelhouse = os.path.join(env, bootstrapper.WHEELHOUSE_DIRNAME)
+        os.makedirs(store)
+        os.makedirs(wheelhouse)
+
+        cached = os.path.join(store, 'MiniMock-1.2.8-py2.py3-none-any.whl')
+        built = os.path.join(wheelhouse, 'ordereddict-1.1-py3-none-any.whl')
+        for filename in (cached, built):
+            with open(filename, 'wb') as handler:
+                handler.write(b'0' * 1024)
+        os.utime(cached, (0, 0))
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, (), ignore_activated=True, quiet=True, jobs=2,
+            wheel_cache=wheel_cache, wheel_cache_max_size='1K'
+        ))
+
+        log = self.read_pip_log(env)
+        self.assertEqual(len(log), 2)
+        self.assertIn('ordereddict==1.1', log[0])
+        self.assertIn('--find-links {0}'.format(store), log[0])
+        self.assertIn('--find-links {0}'.format(store), log[1])
+
+        # Cached wheel used, but least recently, so it evicted from the cache
+        self.assertFalse(os.path.isfile(cached))
+        self.assertEqual(os.listdir(store),
+                         ['ordereddict-1.1-py3-none-any.whl'])
+
+        # Without jobs wheels are prefetched by single pip process as well
+        with open(os.path.join(env, 'bin', 'pip'), 'a') as handler:
+            handler.write('if [ "$1" = wheel ]; then\n'
+                          '    touch "$3/six-1.11.0-py2.py3-none-any.whl"\n'
+                          'fi\n')
+        with open(requirements, 'a') as handler:
+            handler.write('six==1.11.0\n')
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, (), ignore_activated=True, quiet=True,
+            wheel_cache=wheel_cache
+        ))
+        log = self.read_pip_log(env)
+        self.assertEqual(len(log), 4)
+        self.assertTrue(log[2].startswith('wheel '), log)
+        self.assertTrue(log[2].endswith(' MiniMock==1.2.8 six==1.11.0'), log)
+        self.assertTrue(os.path.isfile(
+            os.path.join(store, 'six-1.11.0-py2.py3-none-any.whl')
+        ))
+
+    def test_find_cached_wheel(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        for name in ('six-1.11.0-py2.py3-none-any.whl',
+                     'numpy-1.0-cp99-cp99-plan9_x86.whl',
+                     'numpy-1.0-1-cp36-cp36m-linux_x86_64.whl'):
+            with open(os.path.join(self.dirname, name), 'wb'):
+                pass
+
+        def find(requirement, tags=None):
+            filename = bootstrapper.find_cached_wheel(self.dirname,
+                                                      requirement, tags)
+            return os.path.basename(filename) if filename else None
+
+        self.assertEqual(find('six==1.11.0'),
+                         'six-1.11.0-py2.py3-none-any.whl')
+        self.assertIsNone(find('six==1.10.0'))
+        self.assertIsNone(find('six>=1.11.0'))
+
+        # Only wheels with supported tags are matched
+        self.assertIsNone(find('numpy==1.0'))
+        self.assertIsNone(find('numpy==1.0', {'cp37-cp37m-linux_x86_64'}))
+        self.assertEqual(find('numpy==1.0', {'cp36-cp36m-linux_x86_64'}),
+                         'numpy-1.0-1-cp36-cp36m-linux_x86_64.whl')
+        self.assertEqual(find('six==1.11.0', {'py3-none-any'}),
+                         'six-1.11.0-py2.py3-none-any.whl')
+
+        tags = bootstrapper.get_supported_tags(sys.executable)
+        self.assertIn('py{0}-none-any'.format(sys.version_info[0]), tags)
+        self.assertIsNone(
+            bootstrapper.get_supported_tags('missing-python-executable')
+        )
+
+    def test_parse_requirements(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        requirements = os.path.join(self.dirname, 'requirements.txt')
+        base = os.path.join(self.dirname, 'base', 'requirements.txt')
+        os.makedirs(os.path.dirname(base))
+
+        with open(requirements, 'w+') as handler:
+            handler.write('# Comment\n'
+                          '--index-url ${BOOTSTRAPPER_TEST_INDEX}/simple\n'
+                          '-r base/requirements.txt\n'
+                          '-c constraints.txt\n'
+                          'MiniMock==1.2.8 \\\n'
+                          '    --hash=sha256:abcdef  # Pinned\n'
+                          'ordereddict==1.1; python_version < "0"\n')
+        with open(base, 'w+') as handler:
+            handler.write('--requirement=../requirements.txt\n'
+                          'six>=1.11\n')
+
+        os.environ['BOOTSTRAPPER_TEST_INDEX'] = 'https://localhost'
+        self.addCleanup(os.environ.pop, 'BOOTSTRAPPER_TEST_INDEX')
+        parsed = bootstrapper.parse_requirements(requirements)
+
+        self.assertEqual(parsed['options'],
+                         ['--index-url https://localhost/simple'])
+        self.assertEqual(parsed['includes'],
+                         [os.path.join(self.dirname, 'base/requirements.txt')])
+        self.assertEqual(parsed['constraints'],
+                         [os.path.join(self.dirname, 'constraints.txt')])
+        self.assertEqual(parsed['requirements'],
+                         [('MiniMock==1.2.8', ''),
+                          ('ordereddict==1.1', 'python_version < "0"')])
+        self.assertIs(bootstrapper.parse_requirements(requirements), parsed)
+
+        self.assertEqual(bootstrapper.walk_requirements(requirements),
+                         [requirements, parsed['includes'][0]])
+
+        result = bootstrapper.read_requirements(requirements)
+        self.assertEqual(result[0], 'MiniMock==1.2.8')
+        self.assertEqual(result[-1], 'six>=1.11')
+        self.assertNotIn('ordereddict==1.1', result)
+
+    def test_parse_size(self):
+        self.assertIsNone(bootstrapper.parse_size(None))
+        self.assertEqual(bootstrapper.parse_size(1024), 1024)
+        self.assertEqual(bootstrapper.parse_size('512'), 512)
+        self.assertEqual(bootstrapper.parse_size('2K'), 2048)
+        self.assertEqual(bootstrapper.parse_size('1.5G'), 1536 * 1024 ** 2)
+
+    @unittest.skipIf(not bootstrapper.IS_PY3 or bootstrapper.IS_WINDOWS,
+                     'In-process venv backend seeds pip only on Python 3 '
+                     'outside of Windows')
+    def test_create_env_venv(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        env = os.path.join(self.dirname, 'env')
+
+        self.assertTrue(bootstrapper.create_env(
+            env, (), quiet=True, backend='venv'
+        ))
+        self.assertTrue(os.path.islink(os.path.join(env, 'bin', 'python')))
+
+        pip_path = os.path.join(env, 'bin', 'pip')
+        self.assertTrue(os.access(pip_path, os.X_OK))
+        self.assertEqual(
+            subprocess.call((pip_path, '--version'), stdout=subprocess.PIPE),
+            0
+        )
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_serve_wheelhouse(self):
+        try:
+            from urllib.error import HTTPError
+            from urllib.request import urlopen
+        except ImportError:
+            from urllib2 import HTTPError, urlopen
+
+        env, requirements = self.init_fake_env()
+        wheelhouse = os.path.join(self.dirname, 'wheelhouse')
+        os.makedirs(wheelhouse)
+        for name in ('Foo_Bar-1.0-py2.py3-none-any.whl', 'foo.bar-1.1.tar.gz',
+                     'ordereddict-1.1.tar.gz', 'README.txt'):
+            with open(os.path.join(wheelhouse, name), 'w+') as handler:
+                handler.write(name)
+
+        self.assertEqual(bootstrapper.get_wheelhouse_index(wheelhouse), {
+            'foo-bar': ['Foo_Bar-1.0-py2.py3-none-any.whl',
+                        'foo.bar-1.1.tar.gz'],
+            'ordereddict': ['ordereddict-1.1.tar.gz'],
+        })
+
+        with bootstrapper.serve_wheelhouse(wheelhouse) as index_url:
+            content = urlopen(index_url).read().decode('utf-8')
+            self.assertIn('href="foo-bar/"', content)
+            self.assertIn('href="ordereddict/"', content)
+
+            content = urlopen(index_url + 'Foo.Bar/').read().decode('utf-8')
+            self.assertIn('/files/foo.bar-1.1.tar.gz', content)
+            self.assertIn('/files/Foo_Bar-1.0-py2.py3-none-any.whl', content)
+
+            content = urlopen(index_url.replace(
+                '/simple/', '/files/foo.bar-1.1.tar.gz'
+            )).read()
+            self.assertEqual(content, b'foo.bar-1.1.tar.gz')
+
+            self.assertRaises(HTTPError, urlopen, index_url + 'README/')
+
+        self.assertTrue(bootstrapper.install(
+            env, requirements, (), ignore_activated=True, quiet=True,
+            wheelhouse=wheelhouse
+        ))
+        self.assertIn('--index-url http://127.0.0.1:',
+                      self.read_pip_log(env)[0])
+
     def test_get_streams(self):
         out, err = bootstrapper.get_temp_streams()
 
@@ -284,6 +759,133 @@ class TestOther(unittest.TestCase):
         out.close()
         err.close()
 
+    def test_lazy_pip_import(self):
+        code = 'import bootstrapper, sys; sys.exit("pip" in sys.modules)'
+        self.assertEqual(
+            subprocess.call((sys.executable, '-c', code), cwd=DIRNAME), 0
+        )
+
+    @unittest.skipIf(not bootstrapper.IS_PY3 or bootstrapper.IS_WINDOWS,
+                     'Venv backend is not available on Python 2, test '
+                     'expects bin directory')
+    def test_precompile_env(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        env = os.path.join(self.dirname, 'env')
+        stamp = os.path.join(env, bootstrapper.STAMP_FILENAME)
+        self.assertTrue(bootstrapper.create_env(
+            env, (), quiet=True, backend='venv'
+        ))
+
+        python = os.path.join(env, 'bin', 'python')
+        purelib = subprocess.check_output((
+            python, '-c',
+            'import sysconfig; print(sysconfig.get_paths()["purelib"])'
+        )).decode('utf-8').strip()
+        with open(os.path.join(purelib, 'precompiled.py'), 'w+') as handler:
+            handler.write('VALUE = 42\n')
+        bootstrapper.write_json(stamp, {'digest': 'digest'})
+
+        self.assertTrue(bootstrapper.precompile_env(env, quiet=True))
+        self.assertTrue(any(
+            name.startswith('precompiled.')
+            for name in os.listdir(os.path.join(purelib, '__pycache__'))
+        ))
+        self.assertEqual(bootstrapper.read_json(stamp)['precompiled'],
+                         'digest')
+
+        shutil.rmtree(os.path.join(purelib, '__pycache__'))
+        self.assertTrue(bootstrapper.precompile_env(env, quiet=True))
+        self.assertFalse(os.path.isdir(os.path.join(purelib, '__pycache__')))
+
+        # Up to date timestamp-based pyc, like written by pip, is replaced
+        subprocess.check_call((python, '-m', 'compileall', '-q', purelib))
+        self.assertTrue(bootstrapper.precompile_env(env, force=True,
+                                                    quiet=True))
+        pycache = os.path.join(purelib, '__pycache__')
+        for name in os.listdir(pycache):
+            if name.startswith('precompiled.') and sys.version_info >= (3, 7):
+                with open(os.path.join(pycache, name), 'rb') as handler:
+                    # Flags of checked hash-based pyc, see PEP 552
+                    self.assertEqual(bytearray(handler.read(8))[4], 3)
+
+    def test_print_message(self):
+        out, err = bootstrapper.get_temp_streams()
+        original_out, original_err = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = out, err
+
+        try:
+            bootstrapper.print_message('Message')
+            bootstrapper.run_cmd(('echo', 'Command'), echo=True)
+            bootstrapper.print_message()
+        finally:
+            sys.stdout, sys.stderr = original_out, original_err
+
+        out.seek(0)
+        self.assertEqual(out.read(), 'Message\n$ echo Command\nCommand\n\n')
+
+        out.close()
+        err.close()
+
+    def test_run_cmd_output_tail(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        original_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.dirname
+        self.addCleanup(os.environ.__setitem__, 'HOME', original_home)
+
+        out, err = bootstrapper.get_temp_streams()
+        original_out, original_err = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = out, err
+
+        script = ('import sys; sys.stdout.write("x" * 1000000); '
+                  'sys.stderr.write("Failed"); sys.exit(3)')
+        try:
+            retcode = bootstrapper.run_cmd((sys.executable, '-c', script))
+        finally:
+            sys.stdout, sys.stderr = original_out, original_err
+
+        self.assertEqual(retcode, 3)
+        err.seek(0)
+        message = err.read()
+        self.assertIn('Failed', message)
+        self.assertIn('returned non-zero exit status 3', message)
+        self.assertLess(len(message), bootstrapper.OUTPUT_TAIL_SIZE + 1024)
+
+        with open(bootstrapper.get_log_filename()) as handler:
+            log = handler.read()
+        self.assertIn('-- STDOUT (last {0} bytes) --'.
+                      format(bootstrapper.OUTPUT_TAIL_SIZE), log)
+        self.assertIn('-- STDERR (last 6 bytes) --\nFailed', log)
+
+        out.close()
+        err.close()
+
+    def test_print_table(self):
+        out, err = bootstrapper.get_temp_streams()
+        original_out, original_err = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = out, err
+
+        try:
+            bootstrapper.print_table(('Python', 'Result'),
+                                     (('2.7', 'OK'), ('pypy3', 'FAILED')))
+            bootstrapper.run_child(
+                (sys.executable, '-c', 'print("one"); print("two")'), '[3] '
+            )
+        finally:
+            sys.stdout, sys.stderr = original_out, original_err
+
+        out.seek(0)
+        self.assertEqual(out.read().splitlines(), [
+            'Python  Result',
+            '------  ------',
+            '2.7     OK',
+            'pypy3   FAILED',
+            '[3] one',
+            '[3] two',
+        ])
+
+        out.close()
+        err.close()
+
     def test_read_config(self):
         default_pip_config = bootstrapper.CONFIG['pip']
         expected_pip_config = {
@@ -312,10 +914,527 @@ class TestOther(unittest.TestCase):
         self.assertEqual(config['pip'], expected_pip_config)
         self.assertEqual(config['virtualenv'], {})
 
+    def test_read_config_cache(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        original_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.dirname
+        self.addCleanup(os.environ.__setitem__, 'HOME', original_home)
+        self.addCleanup(bootstrapper.CONFIG_CACHE.clear)
+        bootstrapper.CONFIG_CACHE.clear()
+
+        filename = os.path.join(self.dirname, 'bootstrap.cfg')
+        with open(filename, 'w+') as handler:
+            handler.write('[pip]\nindex_url = {BOOTSTRAPPER_TEST_INDEX}\n')
+
+        os.environ['BOOTSTRAPPER_TEST_INDEX'] = 'https://localhost/simple'
+        self.addCleanup(os.environ.pop, 'BOOTSTRAPPER_TEST_INDEX')
+
+        args = bootstrapper.parse_args([])
+        config = bootstrapper.read_config(filename, args)
+        bootstrap = config[bootstrapper.__script__]
+        pip_args = bootstrapper.prepare_args(config['pip'], bootstrap)
+        self.assertIn('https://localhost/simple', pip_args)
+
+        entries = bootstrapper.read_json(os.path.join(
+            self.dirname, '.bootstrapper', bootstrapper.CONFIG_CACHE_FILENAME
+        ))
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(bootstrapper.read_config(filename, args), config)
+        self.assertEqual(bootstrapper.prepare_args(config['pip'], bootstrap),
+                         pip_args)
+        self.assertEqual(len(bootstrapper.CONFIG_CACHE['entries']), 2)
+
+        os.environ['BOOTSTRAPPER_TEST_INDEX'] = 'https://mirror/simple'
+        self.assertIn('https://mirror/simple',
+                      bootstrapper.prepare_args(config['pip'], bootstrap))
+
+        with open(filename, 'a') as handler:
+            handler.write('timeout = 30\n')
+        self.assertEqual(
+            bootstrapper.read_config(filename, args)['pip']['timeout'], 30
+        )
+        self.assertEqual(len(bootstrapper.CONFIG_CACHE['entries']), 3)
+
+    @unittest.skipIf(bootstrapper.IS_WINDOWS or not bootstrapper.IS_PY3,
+                     'Unix sockets with file descriptors are not supported')
+    def test_daemon(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        filename = os.path.join(self.dirname, 'daemon.sock')
+        self.assertIsNone(bootstrapper.run_client(filename, ['--version']))
+
+        env = dict(os.environ, BOOTSTRAPPER_SOCKET=filename)
+        process = subprocess.Popen(
+            (sys.executable, bootstrapper.__file__, '--daemon'),
+            env=env,
+            stdout=subprocess.PIPE
+        )
+        self.addCleanup(process.stdout.close)
+        process.stdout.readline()
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o600)
+
+        self.assertEqual(bootstrapper.run_client(filename, ['--version']), 0)
+        self.assertEqual(
+            bootstrapper.run_client(filename, ['-c', 'missing.cfg']), 1
+        )
+
+        process.terminate()
+        self.assertEqual(process.wait(), 0)
+        self.assertFalse(os.path.exists(filename))
+
+    def test_exclude_args(self):
+        options = {'--projects': True, '--jobs': False, '-j': False}
+        self.assertEqual(
+            bootstrapper.exclude_args(
+                ['--projects', 'a', 'b', '-j', '8', '-d', '--proj=c', '-j4',
+                 '--jobs=2', '--job', '3', '-e', 'env', 'lock'],
+                options
+            ),
+            ['-d', '-e', 'env', 'lock']
+        )
+        self.assertEqual(
+            bootstrapper.exclude_args(['-r', 'requirements.txt'], options),
+            ['-r', 'requirements.txt']
+        )
+
+    def test_get_projects(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        for name in ('api', 'web', 'docs'):
+            os.makedirs(os.path.join(self.dirname, 'services', name))
+        for name in ('api', 'web'):
+            open(os.path.join(self.dirname, 'services', name, 'bootstrap.cfg'),
+                 'w').close()
+
+        api = os.path.join(self.dirname, 'services', 'api')
+        web = os.path.join(self.dirname, 'services', 'web')
+        self.assertEqual(
+            bootstrapper.get_projects(
+                [os.path.join(self.dirname, 'services', '*'), api],
+                'bootstrap.cfg'
+            ),
+            [api, web]
+        )
+        self.assertEqual(
+            bootstrapper.get_projects([self.dirname], 'bootstrap.cfg'), []
+        )
+
+    def test_get_steps(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        filename = os.path.join(self.dirname, 'bootstrap.cfg')
+        open(filename, 'w').close()
+
+        def get_dependencies(*argv):
+            config = bootstrapper.read_config(filename,
+                                              bootstrapper.parse_args(argv))
+            return dict((name, dependencies) for name, _, dependencies
+                        in bootstrapper.get_steps(config, list(argv)))
+
+        dependencies = get_dependencies()
+        self.assertEqual(dependencies['requirements'], ())
+        self.assertEqual(dependencies['install'], ('env', 'requirements'))
+        self.assertEqual(dependencies['golden'], ('install', ))
+        self.assertEqual(dependencies['hook'], ('golden', ))
+        self.assertEqual(dependencies['hooks'], ('golden', ))
+
+        dependencies = get_dependencies('--precompile')
+        self.assertEqual(dependencies['golden'], ('precompile', ))
+        self.assertEqual(dependencies['hook'], ('golden', ))
+
+    def test_get_python_version(self):
+        version = bootstrapper.get_python_version(sys.executable)
+        self.assertTrue(version.endswith(sys.version), version)
+
+        # Other path to the same interpreter is called to find out version
+        python = os.path.join(os.path.dirname(sys.executable), '.',
+                              os.path.basename(sys.executable))
+        self.assertEqual(bootstrapper.get_python_version(python), version)
+        self.assertEqual(bootstrapper.get_python_version(python), version)
+        self.assertIsNone(
+            bootstrapper.get_python_version('missing-python-executable')
+        )
+
+        tag = bootstrapper.get_python_tag(sys.executable)
+        self.assertTrue(tag.endswith('{0}{1}'.format(*sys.version_info)), tag)
+        self.assertIsNone(
+            bootstrapper.get_python_tag('missing-python-executable')
+        )
+
+    def test_get_snapshot_filename(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        original_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.dirname
+        self.addCleanup(os.environ.__setitem__, 'HOME', original_home)
+
+        snapshots = os.path.join(self.dirname, 'snapshots')
+        requirements = os.path.join(self.dirname, 'requirements.txt')
+        base = os.path.join(self.dirname, 'base.txt')
+        with open(requirements, 'w+') as handler:
+            handler.write('-r base.txt\n')
+
+        def get_snapshot_filename(content):
+            with open(base, 'w+') as handler:
+                handler.write(content)
+            bootstrapper.REQUIREMENTS_CACHE.clear()
+            return bootstrapper.get_snapshot_filename(
+                snapshots, ('-p', sys.executable), (), requirements
+            )
+
+        # Changes in included requirements files change snapshot name
+        filename = get_snapshot_filename('six==1.16.0\n')
+        self.assertTrue(filename.startswith(snapshots), filename)
+        self.assertEqual(get_snapshot_filename('six==1.16.0\n'), filename)
+        self.assertNotEqual(get_snapshot_filename('six==1.15.0\n'),
+                            filename)
+
+        # Included editable requirements disable snapshots
+        self.assertIsNone(get_snapshot_filename('-e /some/checkout\n'))
+
+    def test_get_python_executable(self):
+        self.assertEqual(bootstrapper.get_python_executable('3.6'),
+                         'python3.6')
+        self.assertEqual(bootstrapper.get_python_executable('pypy3'), 'pypy3')
+
+    def test_run_cmd_retry(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        counter = os.path.join(self.dirname, 'counter')
+        script = ('import os, sys\n'
+                  'open({0!r}, "a").write("1")\n'
+                  'if os.path.getsize({0!r}) < 3:\n'
+                  '    sys.stderr.write(sys.argv[1])\n'
+                  '    sys.exit(1)\n'.format(counter))
+        kwargs = {'fail_silently': True, 'retries': 2, 'backoff': 0,
+                  'retry_on': bootstrapper.PIP_TRANSIENT_ERROR_RE}
+
+        self.assertEqual(bootstrapper.run_cmd(
+            (sys.executable, '-c', script, 'Connection reset by peer'),
+            **kwargs
+        ), 0)
+        self.assertEqual(os.path.getsize(counter), 3)
+
+        os.unlink(counter)
+        self.assertEqual(bootstrapper.run_cmd(
+            (sys.executable, '-c', script, 'No matching distribution'),
+            **kwargs
+        ), 1)
+        self.assertEqual(os.path.getsize(counter), 1)
+
+        # Echoed command is matched by its STDERR, STDOUT is not piped
+        os.unlink(counter)
+        self.assertEqual(bootstrapper.run_cmd(
+            (sys.executable, '-c', script, 'Connection reset by peer'),
+            echo=True, **kwargs
+        ), 0)
+        self.assertEqual(os.path.getsize(counter), 3)
+
+    def test_run_cmd_timeout(self):
+        del bootstrapper.TRACE_EVENTS[:]
+        start = time.time()
+
+        self.assertNotEqual(bootstrapper.run_cmd(
+            (sys.executable, '-c', 'import time; time.sleep(30)'),
+            fail_silently=True,
+            timeout=0.5
+        ), 0)
+        self.assertLess(time.time() - start, 10)
+        self.assertTrue(bootstrapper.TRACE_EVENTS[-1]['args']['killed'])
+
+    def test_kill_processes(self):
+        retcodes = []
+        start = time.time()
+        thread = threading.Thread(target=lambda: retcodes.append(
+            bootstrapper.run_cmd(
+                (sys.executable, '-c', 'import time; time.sleep(30)'),
+                fail_silently=True,
+                timeout=60
+            )
+        ))
+        thread.start()
+        while not bootstrapper.PROCESSES and time.time() - start < 10:
+            time.sleep(0.05)
+
+        bootstrapper.kill_processes()
+        thread.join()
+        self.assertLess(time.time() - start, 10)
+        self.assertNotEqual(retcodes, [0])
+        self.assertFalse(bootstrapper.PROCESSES)
+
+    def test_run_fresh_hook(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        config = {'env': self.dirname, 'ignore_activated': True}
+        source = os.path.join(self.dirname, 'app.js')
+        bundle = os.path.join(self.dirname, 'bundle.js')
+        calls = []
+
+        def build():
+            calls.append(True)
+            shutil.copyfile(source, bundle)
+            return True
+
+        def run(**kwargs):
+            return bootstrapper.run_fresh_hook(
+                'build', 'make assets', [os.path.join(self.dirname, 'app.*')],
+                [bundle], dict(config, **kwargs), build, True
+            )
+
+        with open(source, 'w+') as handler:
+            handler.write('app')
+
+        self.assertTrue(run())
+        self.assertTrue(run())
+        self.assertEqual(len(calls), 1)
+
+        self.assertTrue(run(force_hooks=True))
+        self.assertEqual(len(calls), 2)
+
+        os.unlink(bundle)
+        self.assertTrue(run())
+        self.assertEqual(len(calls), 3)
+
+        with open(source, 'a') as handler:
+            handler.write('\n')
+        self.assertTrue(run())
+        self.assertTrue(run())
+        self.assertEqual(len(calls), 4)
+
+        self.assertTrue(bootstrapper.run_fresh_hook(
+            'build', 'make assets', [], [], config, build, True
+        ))
+        self.assertEqual(len(calls), 5)
+
+    def test_run_hooks(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        config = bootstrapper.CONFIG[bootstrapper.__script__]
+        log = os.path.join(self.dirname, 'hooks.log')
+        hooks = {
+            'assets': 'echo assets >> {0}'.format(log),
+            'assets.after': 'migrate',
+            'broken': 'exit 1',
+            'migrate': 'echo migrate >> {0}'.format(log),
+            'notify': 'echo notify >> {0}'.format(log),
+            'notify.after': 'assets broken',
+        }
+
+        for quiet in (False, True):
+            self.assertFalse(bootstrapper.run_hooks(hooks, config,
+                                                    quiet=quiet))
+            with open(log) as handler:
+                self.assertEqual(handler.read().split(),
+                                 ['migrate', 'assets'])
+            os.unlink(log)
+
+        self.assertFalse(bootstrapper.run_hooks(
+            {'assets': hooks['assets'], 'assets.after': 'migrate'}, config
+        ))
+        self.assertFalse(os.path.exists(log))
+
+        self.assertTrue(bootstrapper.run_hooks(
+            {'assets': hooks['assets'], 'assets.after': 'migrate',
+             'migrate': hooks['migrate']}, config, jobs=1, quiet=True
+        ))
+        with open(log) as handler:
+            self.assertEqual(handler.read().split(), ['migrate', 'assets'])
+        os.unlink(log)
+
+        self.assertEqual(bootstrapper.find_cycle({'a': ('b', ), 'b': ()}),
+                         None)
+        self.assertEqual(
+            bootstrapper.find_cycle({'a': ('b', ), 'b': ('c', ),
+                                     'c': ('b', )}),
+            ['b', 'c', 'b']
+        )
+        self.assertFalse(bootstrapper.run_hooks(
+            {'assets': hooks['assets'], 'assets.after': 'migrate',
+             'migrate': hooks['migrate'], 'migrate.after': 'assets'}, config
+        ))
+        self.assertFalse(os.path.exists(log))
+
+    def test_run_steps(self):
+        calls = []
+        barrier = threading.Event()
+
+        def step(name, result=True, wait=False):
+            def func():
+                if wait:
+                    self.assertTrue(barrier.wait(5))
+                else:
+                    barrier.set()
+                calls.append(name)
+                return result
+            return func
+
+        results = bootstrapper.run_steps((
+            ('first', step('first', wait=True), ()),
+            ('second', step('second', False), ()),
+            ('third', step('third'), ('first', )),
+            ('fourth', step('fourth'), ('second', )),
+            ('fifth', step('fifth'), ('fourth', 'third')),
+        ))
+
+        self.assertEqual(calls, ['second', 'first', 'third'])
+        self.assertEqual(results, {'first': True,
+                                   'second': False,
+                                   'third': True,
+                                   'fourth': False,
+                                   'fifth': False})
+
+    def test_run_steps_error(self):
+        def error():
+            raise OSError('Step failed')
+
+        with self.assertRaises(OSError):
+            bootstrapper.run_steps((('error', error, ()),
+                                    ('next', lambda: True, ('error', ))))
+
+    def test_snapshot_env(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        env = os.path.join(self.dirname, 'env')
+        restored = os.path.join(self.dirname, 'restored')
+        snapshot = os.path.join(self.dirname, 'snapshots', 'env.tar.gz')
+
+        os.makedirs(os.path.join(env, 'bin'))
+        os.makedirs(os.path.join(env, 'lib', '__pycache__'))
+        os.makedirs(os.path.join(env, bootstrapper.WHEELHOUSE_DIRNAME))
+        script = os.path.join(env, 'bin', 'pip')
+        with open(script, 'w+') as handler:
+            handler.write('#!{0}/bin/python\n'.format(env))
+        os.chmod(script, 0o755)
+        with open(os.path.join(env, 'lib', '__pycache__', 'x.pyc'), 'w+'):
+            pass
+        with open(os.path.join(env, bootstrapper.HOOKS_STAMP_FILENAME),
+                  'w+'):
+            pass
+        os.symlink(script, os.path.join(env, 'bin', 'pip3'))
+
+        self.assertTrue(bootstrapper.snapshot_env(env, snapshot, True))
+        self.assertTrue(os.path.isfile(snapshot))
+        self.assertTrue(bootstrapper.snapshot_env(env, snapshot, True))
+
+        self.assertTrue(bootstrapper.restore_env(snapshot, restored))
+        with open(os.path.join(restored, 'bin', 'pip')) as handler:
+            self.assertEqual(handler.read(),
+                             '#!{0}/bin/python\n'.format(restored))
+        self.assertTrue(os.access(os.path.join(restored, 'bin', 'pip'),
+                                  os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(restored, 'bin', 'pip3')),
+                         os.path.join(restored, 'bin', 'pip'))
+        self.assertFalse(os.path.exists(
+            os.path.join(restored, 'lib', '__pycache__')
+        ))
+        self.assertFalse(os.path.exists(
+            os.path.join(restored, bootstrapper.HOOKS_STAMP_FILENAME)
+        ))
+        self.assertFalse(os.path.exists(
+            os.path.join(restored, bootstrapper.WHEELHOUSE_DIRNAME)
+        ))
+
+    def test_snapshot_env_unsafe(self):
+        import io
+        import tarfile
+
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        outside = os.path.join(self.dirname, 'outside')
+        os.mkdir(outside)
+
+        def restore(*members):
+            snapshot = os.path.join(self.dirname, 'snapshot.tar.gz')
+            with tarfile.open(snapshot, 'w:gz') as archive:
+                for name, kind, linkname in members:
+                    info = tarfile.TarInfo(name)
+                    info.type = kind
+                    info.linkname = linkname
+                    data = b'evil' if kind == tarfile.REGTYPE else b''
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+            env = os.path.join(self.dirname, 'env')
+            result = bootstrapper.restore_env(snapshot, env)
+            self.assertFalse(os.path.exists(env))
+            return result
+
+        self.assertFalse(restore(('bin', tarfile.SYMTYPE, outside),
+                                 ('bin/evil', tarfile.REGTYPE, '')))
+        self.assertFalse(restore(('lib', tarfile.SYMTYPE, '..'),
+                                 ('lib/evil', tarfile.REGTYPE, '')))
+        self.assertFalse(restore(('evil', tarfile.LNKTYPE, '../x')))
+        self.assertFalse(restore(('lib/x', tarfile.SYMTYPE, '/etc/x')))
+        self.assertFalse(restore(('x', tarfile.SYMTYPE, '../outside/x'),
+                                 ('x', tarfile.REGTYPE, '')))
+        self.assertEqual(os.listdir(outside), [])
+        self.assertFalse(os.path.exists(os.path.join(self.dirname, 'evil')))
+
+    def test_trace(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        filename = os.path.join(self.dirname, 'trace.json')
+        del bootstrapper.TRACE_EVENTS[:]
+
+        bootstrapper.run_steps((
+            ('cmd', lambda: not bootstrapper.run_cmd(
+                (sys.executable, '-c', 'pass')
+            ), ()),
+        ))
+        bootstrapper.write_trace(filename)
+
+        with open(filename) as handler:
+            events = json.load(handler)['traceEvents']
+
+        self.assertEqual([(event['ph'], event.get('cat'), event['name'])
+                          for event in events],
+                         [('M', None, 'process_name'),
+                          ('X', 'cmd', os.path.basename(sys.executable) +
+                           ' -c'),
+                          ('X', 'step', 'cmd')])
+        self.assertEqual(events[1]['args']['returncode'], 0)
+        self.assertTrue(events[2]['args']['result'])
+        self.assertGreaterEqual(events[2]['dur'], events[1]['dur'])
+
     def test_which(self):
         self.assertTrue(bootstrapper.which('python'))
         self.assertFalse(bootstrapper.which('does-not-exist'))
 
+    @unittest.skipIf(bootstrapper.IS_WINDOWS, 'Fake pip is a shell script')
+    def test_which_cache(self):
+        env, _ = self.init_fake_env()
+        pip_path = os.path.join(env, 'bin', 'pip')
+        original_home, original_path = os.environ['HOME'], os.environ['PATH']
+        os.environ['HOME'] = self.dirname
+        os.environ['PATH'] = os.path.dirname(pip_path)
+
+        try:
+            self.assertEqual(bootstrapper.which('pip'), pip_path)
+            self.assertIsNone(bootstrapper.which('virtualenv'))
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.dirname, '.bootstrapper', 'which.json'
+            )))
+            self.assertEqual(bootstrapper.which('pip'), pip_path)
+
+            os.unlink(pip_path)
+            os.utime(os.path.dirname(pip_path), (0, 0))
+            self.assertIsNone(bootstrapper.which('pip'))
+        finally:
+            os.environ['HOME'] = original_home
+            os.environ['PATH'] = original_path
+
+    def test_write_json_threads(self):
+        self.dirname = tempfile.mkdtemp(prefix='bootstrapper')
+        filename = os.path.join(self.dirname, 'data.json')
+        errors = []
+
+        def target(value):
+            try:
+                for _ in range(100):
+                    bootstrapper.write_json(filename, {'value': value})
+            except (IOError, OSError) as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=target, args=(value, ))
+                   for value in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertIn(bootstrapper.read_json(filename)['value'], range(4))
+        self.assertEqual(os.listdir(self.dirname), ['data.json'])
+
 
 if __name__ == '__main__':
     unittest.main()